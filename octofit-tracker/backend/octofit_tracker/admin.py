@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, Team, Activity, Leaderboard, Workout
+from .models import User, Team, Activity, DailyActivityRollup, Leaderboard, PeriodLeaderboard, ActivityTypeLeaderboard, UserStats, Workout, Job
 
 
 @admin.register(User)
@@ -26,6 +26,14 @@ class ActivityAdmin(admin.ModelAdmin):
     ordering = ('-created_at',)
 
 
+@admin.register(DailyActivityRollup)
+class DailyActivityRollupAdmin(admin.ModelAdmin):
+    list_display = ('date', 'user_id', 'team_id', 'activity_type', 'count', 'duration', 'calories')
+    list_filter = ('activity_type', 'date')
+    search_fields = ('user_id', 'team_id')
+    ordering = ('-date',)
+
+
 @admin.register(Leaderboard)
 class LeaderboardAdmin(admin.ModelAdmin):
     list_display = ('rank', 'user_id', 'team_id', 'total_calories', 'total_duration', 'updated_at')
@@ -34,9 +42,40 @@ class LeaderboardAdmin(admin.ModelAdmin):
     ordering = ('rank',)
 
 
+@admin.register(PeriodLeaderboard)
+class PeriodLeaderboardAdmin(admin.ModelAdmin):
+    list_display = ('period', 'period_start', 'rank', 'user_id', 'team_id', 'total_calories', 'expires_at')
+    list_filter = ('period', 'period_start')
+    search_fields = ('user_id', 'team_id')
+    ordering = ('period', '-period_start', 'rank')
+
+
+@admin.register(ActivityTypeLeaderboard)
+class ActivityTypeLeaderboardAdmin(admin.ModelAdmin):
+    list_display = ('activity_type', 'rank', 'user_id', 'team_id', 'total_calories', 'total_activities')
+    list_filter = ('activity_type',)
+    search_fields = ('user_id', 'team_id')
+    ordering = ('activity_type', 'rank')
+
+
+@admin.register(UserStats)
+class UserStatsAdmin(admin.ModelAdmin):
+    list_display = ('user_id', 'current_streak', 'longest_streak', 'last_active_date', 'updated_at')
+    search_fields = ('user_id',)
+    ordering = ('-longest_streak',)
+
+
 @admin.register(Workout)
 class WorkoutAdmin(admin.ModelAdmin):
     list_display = ('name', 'activity_type', 'difficulty', 'duration', 'calories_estimate', 'created_at')
     list_filter = ('difficulty', 'activity_type', 'created_at')
     search_fields = ('name', 'description', 'activity_type')
     ordering = ('-created_at',)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'status', 'attempts', 'dedup_key', 'created_at', 'finished_at')
+    list_filter = ('kind', 'status', 'created_at')
+    search_fields = ('kind', 'dedup_key')
+    ordering = ('-created_at',)
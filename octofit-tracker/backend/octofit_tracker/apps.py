@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+
+
+class OctofitTrackerConfig(AppConfig):
+    name = 'octofit_tracker'
+
+    def ready(self):
+        # Mongo clients are created lazily, so registering here reaches all of them
+        from .profiling import register_listener
+        register_listener()
+        # Connects the activity signals that keep the derived collections current
+        from . import tracking  # noqa: F401
@@ -0,0 +1,196 @@
+import gzip
+import heapq
+import operator
+import os
+from datetime import datetime
+from pathlib import Path
+from bson import json_util
+from bson.json_util import JSONMode, JSONOptions
+from django.conf import settings
+from pymongo import UpdateOne
+from .models import Activity
+from .utils import batches, partition_key
+
+
+# Activities are partitioned by calendar month: each one carries the month of
+# its date as a partition key (Activity.month, '2024-03'). Months older than
+# OCTOFIT_ACTIVITY_RETENTION_MONTHS are moved out of the activities collection
+# into one gzip-compressed NDJSON file per month under OCTOFIT_ARCHIVE_DIR, so
+# the collection and its indexes only hold the recent months the API reads.
+#
+# Archiving does not go through tracking: the daily rollups, leaderboards and
+# user stats keep counting archived activities. Their rebuilds only recompute
+# what is dated from archived_before() on and keep the rest. Date-bounded
+# reads filter on the partition key (ActivityRepository.date_range), which
+# also picks the archive files that exports read along with the collection.
+# While activities stored before the key existed have not been backfilled,
+# they filter on the date alone so that those activities are not left out.
+
+FILE_PREFIX = 'activities-'
+FILE_SUFFIX = '.ndjson.gz'
+# Extended JSON keeps ObjectIds and datetimes (as naive UTC, like djongo) intact
+JSON_OPTIONS = JSONOptions(json_mode=JSONMode.RELAXED, tz_aware=False)
+# Conditions understood by find(), which covers the filters built by exports
+OPERATORS = {
+    '$in': lambda value, operand: value in operand,
+    '$gt': operator.gt,
+    '$gte': operator.ge,
+    '$lt': operator.lt,
+    '$lte': operator.le,
+}
+# Bounds of a date condition mapped to the bounds of the months it covers
+MONTH_BOUNDS = {'$gt': '$gte', '$gte': '$gte', '$lt': '$lte', '$lte': '$lte'}
+
+
+def archive_path(month):
+    return Path(settings.OCTOFIT_ARCHIVE_DIR) / f'{FILE_PREFIX}{month}{FILE_SUFFIX}'
+
+
+def archived_months():
+    """List the archived months, oldest first"""
+    paths = Path(settings.OCTOFIT_ARCHIVE_DIR).glob(f'{FILE_PREFIX}*{FILE_SUFFIX}')
+    return sorted(path.name[len(FILE_PREFIX):-len(FILE_SUFFIX)] for path in paths)
+
+
+def _month_index(month):
+    year, number = month.split('-')
+    return int(year) * 12 + int(number) - 1
+
+
+def _month(index):
+    return f'{index // 12:04d}-{index % 12 + 1:02d}'
+
+
+def archived_before():
+    """Get the first day after the archived months (a naive midnight, as djongo stores dates), or None"""
+    months = archived_months()
+    if not months:
+        return None
+    following = _month_index(months[-1]) + 1
+    return datetime(following // 12, following % 12 + 1, 1)
+
+
+def cutoff_month(today=None):
+    """Get the oldest month kept in the activities collection"""
+    today = today or datetime.utcnow().date()
+    return _month(_month_index(partition_key(today)) - settings.OCTOFIT_ACTIVITY_RETENTION_MONTHS + 1)
+
+
+def read_month(month):
+    """Yield the archived activities of a month in date order"""
+    path = archive_path(month)
+    if not path.exists():
+        return
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        for line in file:
+            yield json_util.loads(line, json_options=JSON_OPTIONS)
+
+
+def matches(document, query):
+    """Check an archived activity against a Mongo filter of equality and OPERATORS conditions"""
+    for field, condition in query.items():
+        value = document.get(field)
+        if isinstance(condition, dict):
+            if not all(OPERATORS[name](value, operand) for name, operand in condition.items()):
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _partition(query):
+    """Get the condition on the month of the archive files a filter can match"""
+    if 'month' in query:
+        return {'month': query['month']}
+    if isinstance(query.get('date'), dict):
+        return {'month': {
+            MONTH_BOUNDS[name]: partition_key(operand)
+            for name, operand in query['date'].items() if name in MONTH_BOUNDS
+        }}
+    return {}
+
+
+def find(query):
+    """Yield the archived activities matching a filter in date order, reading only the months it selects"""
+    partition = _partition(query)
+    for month in archived_months():
+        if not matches({'month': month}, partition):
+            continue
+        for document in read_month(month):
+            if matches(document, query):
+                yield document
+
+
+def _sort_key(document):
+    return document['date'], document['_id']
+
+
+def _unique(documents):
+    """Drop repeats of the previous document, left by a run that failed between writing and deleting"""
+    previous = None
+    for document in documents:
+        if document['_id'] != previous:
+            previous = document['_id']
+            yield document
+
+
+def partition_keys_missing():
+    """Check whether any activity of the collection is stored without a partition key"""
+    return Activity.objects.mongo_find_one({'month': {'$in': [None, '']}}, {'_id': 1}) is not None
+
+
+def backfill_partition_keys(batch_size=10000):
+    """Set the partition key of activities stored without one; return how many were updated"""
+    cursor = Activity.objects.mongo_find({'month': {'$in': [None, '']}}, {'date': 1}).batch_size(batch_size)
+    count = 0
+    for batch in batches(cursor, batch_size):
+        Activity.objects.mongo_bulk_write([
+            UpdateOne({'_id': document['_id']}, {'$set': {'month': partition_key(document['date'])}})
+            for document in batch
+        ], ordered=False)
+        count += len(batch)
+    return count
+
+
+def archive_month(month, batch_size=10000):
+    """Move the activities of a month from the collection into its archive file; return how many moved
+
+    Activities of the month archived by an earlier run are merged in, so the
+    file stays in date order. It is replaced in one step before anything is
+    deleted, and only the activities written to it are deleted.
+    """
+    moved_ids = []
+
+    def moved():
+        cursor = Activity.objects.mongo_find({'month': month}).sort([('date', 1), ('_id', 1)])
+        for document in cursor.batch_size(batch_size):
+            moved_ids.append(document['_id'])
+            yield document
+
+    path = archive_path(month)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(path.name + '.tmp')
+    with gzip.open(temporary, 'wt', encoding='utf-8') as file:
+        documents = _unique(heapq.merge(read_month(month), moved(), key=_sort_key))
+        for chunk in batches(documents, batch_size):
+            file.write(''.join(json_util.dumps(document, json_options=JSON_OPTIONS) + '\n' for document in chunk))
+    if not moved_ids:
+        temporary.unlink()
+        return 0
+    os.replace(temporary, path)
+    for chunk in batches(moved_ids, batch_size):
+        Activity.objects.mongo_delete_many({'_id': {'$in': chunk}})
+    return len(moved_ids)
+
+
+def archive(today=None, batch_size=10000):
+    """Archive every month older than the retention window; return {month: activities moved}"""
+    backfill_partition_keys(batch_size)
+    months = sorted(Activity.objects.mongo_distinct('month', {'month': {'$lt': cutoff_month(today)}}))
+    return {month: archive_month(month, batch_size) for month in months}
+
+
+def clear():
+    """Delete every archive file"""
+    for month in archived_months():
+        archive_path(month).unlink()
@@ -0,0 +1,149 @@
+import asyncio
+import weakref
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import JsonResponse
+from .lookups import to_object_ids
+from .models import DailyActivityRollup
+from .repositories import ActivityRepository, LeaderboardRepository, activity_count_pipeline
+from .serializers import ActivityStatsQuerySerializer
+from . import stats
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:  # motor is only needed when serving the async API under ASGI
+    AsyncIOMotorClient = None
+
+
+# Non-blocking read endpoints for ASGI deployments. They render the same rows
+# as the pymongo repositories but talk to MongoDB through motor, and run the
+# related-name and count lookups of a page concurrently.
+
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_database():
+    """Get the octofit database from a motor client bound to the running event loop"""
+    if AsyncIOMotorClient is None:
+        raise ImproperlyConfigured('The async API requires the motor package.')
+    loop = asyncio.get_running_loop()
+    database_settings = settings.DATABASES['default']
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = AsyncIOMotorClient(**database_settings.get('CLIENT', {}), io_loop=loop)
+    return client[database_settings['NAME']]
+
+
+async def names(database, model, ids):
+    object_ids = to_object_ids(ids)
+    if not object_ids:
+        return {}
+    cursor = database[model._meta.db_table].find({'_id': {'$in': object_ids}}, {'name': 1})
+    return {str(document['_id']): document['name'] async for document in cursor}
+
+
+async def activity_counts(database, user_ids):
+    cursor = database[DailyActivityRollup._meta.db_table].aggregate(activity_count_pipeline(user_ids))
+    return {row['_id']: row['count'] async for row in cursor}
+
+
+async def resolve(repository, database, documents, fields=None):
+    """Run every lookup a repository needs for a page concurrently"""
+    plan = repository.lookup_plan(fields)
+    results = await asyncio.gather(*(
+        names(database, lookup[2], repository.lookup_ids(documents, lookup))
+        if lookup[1] == 'names' else
+        activity_counts(database, repository.lookup_ids(documents, lookup))
+        for lookup in plan
+    ))
+    return {lookup[0]: result for lookup, result in zip(plan, results)}
+
+
+def page_size(request):
+    try:
+        size = int(request.GET.get('page_size', settings.REST_FRAMEWORK['PAGE_SIZE']))
+    except ValueError:
+        size = settings.REST_FRAMEWORK['PAGE_SIZE']
+    return max(1, min(size, settings.OCTOFIT_MAX_PAGE_SIZE))
+
+
+def next_url(request, after):
+    query = request.GET.copy()
+    query['after'] = after
+    return request.build_absolute_uri(f'?{query.urlencode()}')
+
+
+async def read_page(request, repository, query, sort, position):
+    """Read one keyset page and render it as {next, results}"""
+    database = get_database()
+    size = page_size(request)
+    documents = await (
+        database[repository.model._meta.db_table]
+        .find(query, {field: 1 for field in repository.fields})
+        .sort(sort)
+        .to_list(size + 1)
+    )
+    has_next = len(documents) > size
+    documents = documents[:size]
+    related = await resolve(repository, database, documents)
+    return JsonResponse({
+        'next': next_url(request, position(documents[-1])) if has_next else None,
+        'results': repository.represent(documents, related=related),
+    })
+
+
+def invalid_cursor():
+    return JsonResponse({'detail': 'Invalid cursor'}, status=404)
+
+
+async def activities(request):
+    """Activities ordered by _id, paginated with ?after=<_id>"""
+    query = {}
+    if request.GET.get('after'):
+        try:
+            query['_id'] = {'$gt': ObjectId(request.GET['after'])}
+        except InvalidId:
+            return invalid_cursor()
+    return await read_page(
+        request, ActivityRepository(), query, [('_id', 1)],
+        lambda document: str(document['_id']),
+    )
+
+
+async def leaderboard(request):
+    """Leaderboard ordered by rank, paginated with ?after=<rank>:<_id>"""
+    query = {}
+    if request.GET.get('after'):
+        try:
+            rank, _, object_id = request.GET['after'].partition(':')
+            rank, object_id = int(rank), ObjectId(object_id)
+        except (ValueError, InvalidId):
+            return invalid_cursor()
+        query = {'$or': [{'rank': {'$gt': rank}}, {'rank': rank, '_id': {'$gt': object_id}}]}
+    return await read_page(
+        request, LeaderboardRepository(), query, [('rank', 1), ('_id', 1)],
+        lambda document: f"{document['rank']}:{document['_id']}",
+    )
+
+
+async def activity_stats(request):
+    """Async variant of /api/activities/stats/"""
+    query = ActivityStatsQuerySerializer(data=request.GET)
+    if not query.is_valid():
+        return JsonResponse(query.errors, status=400)
+    params = query.validated_data
+    database = get_database()
+    rows = await (
+        database[DailyActivityRollup._meta.db_table]
+        .aggregate(stats.build_pipeline(**params))
+        .to_list(None)
+    )
+    points = stats.fold_points(rows)
+    model = stats.GROUP_NAME_MODELS.get(params['group_by'])
+    group_names = await names(database, model, points) if model else {key: key for key in points}
+    return JsonResponse({
+        **{key: str(value) for key, value in params.items()},
+        'series': stats.build_series(points, group_names),
+    })
@@ -0,0 +1,128 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+
+
+# Cached responses are keyed by a per-resource generation number. Writes bump
+# the generation, which orphans every cached response of that resource at
+# once; orphaned entries age out through the backend's LRU/TTL eviction.
+# Generations start from the current time in milliseconds so that an evicted
+# generation key can never come back with a value an older entry used.
+
+
+def api_cache():
+    return caches[settings.OCTOFIT_API_CACHE]
+
+
+def _generation_key(resource):
+    return f'octofit:generation:{resource}'
+
+
+def generation(resource):
+    """Get the current cache generation of a resource"""
+    cache = api_cache()
+    key = _generation_key(resource)
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        value = cache.get(key)
+    return value
+
+
+def invalidate(*resources):
+    """Drop every cached response of the given resources"""
+    cache = api_cache()
+    for resource in resources:
+        try:
+            cache.incr(_generation_key(resource))
+        except ValueError:
+            generation(resource)
+
+
+def make_etag(content):
+    return f'"{hashlib.md5(content).hexdigest()}"'
+
+
+def etag_matches(request, etag):
+    header = request.headers.get('If-None-Match', '')
+    return etag in (tag.strip() for tag in header.split(',')) or header.strip() == '*'
+
+
+class CacheInvalidationMixin:
+    """Invalidates cached responses of dependent resources after writes through the viewset"""
+    invalidates = ()
+
+    def get_invalidated_resources(self):
+        return self.invalidates
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        invalidate(*self.get_invalidated_resources())
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        invalidate(*self.get_invalidated_resources())
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        invalidate(*self.get_invalidated_resources())
+
+
+class CachedResponseMixin(CacheInvalidationMixin):
+    """Caches rendered JSON list/retrieve responses and answers matching ETags with 304
+
+    Writes through the viewset invalidate cache_resource and every resource
+    listed in invalidates.
+    """
+    cache_resource = None
+
+    def get_invalidated_resources(self):
+        return (self.cache_resource, *self.invalidates)
+
+    def get_cache_key(self, request):
+        # The accepted media type carries renderer parameters such as indent=4
+        variant = f'{request.get_full_path()} {request.accepted_media_type}'
+        digest = hashlib.md5(variant.encode()).hexdigest()
+        return f'octofit:response:{self.cache_resource}:{generation(self.cache_resource)}:{digest}'
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        # The browsable API embeds per-user content, so only JSON is cached
+        if request.accepted_renderer.format != 'json':
+            return handler(request, *args, **kwargs)
+
+        cache = api_cache()
+        key = self.get_cache_key(request)
+        entry = cache.get(key)
+        response = None
+        if entry is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            response.accepted_renderer = request.accepted_renderer
+            response.accepted_media_type = request.accepted_media_type
+            response.renderer_context = self.get_renderer_context()
+            response.render()
+            entry = {
+                'content': response.content,
+                'content_type': response['Content-Type'],
+                'etag': make_etag(response.content),
+            }
+            cache.set(key, entry)
+
+        if etag_matches(request, entry['etag']):
+            response = HttpResponseNotModified()
+        elif response is None:
+            response = HttpResponse(entry['content'], content_type=entry['content_type'])
+        # On a miss the rendered DRF response is returned as is, keeping its data
+        response['ETag'] = entry['etag']
+        patch_vary_headers(response, ('Accept',))
+        return response
@@ -0,0 +1,58 @@
+from pymongo import UpdateMany
+from .lookups import name_snapshots, team_names
+from .models import User, Activity, Leaderboard, PeriodLeaderboard, ActivityTypeLeaderboard
+from .utils import batches
+
+
+# Activities and leaderboard entries (all-time, per period and per activity
+# type) carry snapshots of their user's and team's names so that reads need no
+# lookups. The snapshots are written when the documents are created and
+# rewritten here whenever a user or team is renamed or a user moves to another
+# team. Readers fall back to a lookup for documents whose snapshot is missing,
+# so a resync is only needed for performance.
+
+LEADERBOARDS = (Leaderboard, PeriodLeaderboard, ActivityTypeLeaderboard)
+
+
+def snapshot_for(user_id):
+    """Get the name snapshot to store on a new document of the given user"""
+    return name_snapshots([user_id]).get(user_id, {'user_name': None, 'team_name': None})
+
+
+def propagate_user(user):
+    """Rewrite the snapshots of one user's activities and leaderboard entries
+
+    The leaderboard entries also follow the user to their new team.
+    """
+    user_id = str(user._id)
+    team_name = team_names([user.team_id]).get(user.team_id) if user.team_id else None
+    names = {'user_name': user.name, 'team_name': team_name}
+    Activity.objects.mongo_update_many({'user_id': user_id}, {'$set': names})
+    for model in LEADERBOARDS:
+        model.objects.mongo_update_many({'user_id': user_id}, {'$set': {**names, 'team_id': user.team_id or ''}})
+
+
+def propagate_team(team):
+    """Rewrite the team name snapshot on documents of the team's members"""
+    team_id = str(team._id)
+    member_ids = [str(user._id) for user in User.objects.filter(team_id=team_id).only('_id')]
+    for chunk in batches(member_ids, 1000):
+        Activity.objects.mongo_update_many({'user_id': {'$in': chunk}}, {'$set': {'team_name': team.name}})
+    for model in LEADERBOARDS:
+        model.objects.mongo_update_many({'team_id': team_id}, {'$set': {'team_name': team.name}})
+
+
+def resync(batch_size=1000):
+    """Rewrite every snapshot from the users and teams collections; return the number of users"""
+    count = 0
+    users = User.objects.only('_id', 'name', 'team_id').order_by('_id')
+    for chunk in batches(users.iterator(), batch_size):
+        teams = team_names(user.team_id for user in chunk)
+        operations = []
+        for user in chunk:
+            names = {'user_name': user.name, 'team_name': teams.get(user.team_id)}
+            operations.append(UpdateMany({'user_id': str(user._id)}, {'$set': names}))
+        for model in (Activity, *LEADERBOARDS):
+            model.objects.mongo_bulk_write(operations, ordered=False)
+        count += len(chunk)
+    return count
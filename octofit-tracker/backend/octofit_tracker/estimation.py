@@ -0,0 +1,129 @@
+from django.core.exceptions import ImproperlyConfigured
+from pymongo import UpdateOne
+from .lookups import user_weights
+from .models import Activity
+from .utils import batches
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed to estimate whole histories
+    np = None
+
+
+# Calorie and distance estimates for activities recorded without them.
+# Calories follow the compendium of physical activities: a MET value per
+# activity type times the user's weight in kg times the hours spent, so
+# kcal = MET * weight * duration / 60. Distances assume an average speed per
+# activity type; types without one (weights, yoga...) have no distance.
+# estimate_batch() computes the same values with numpy for millions of
+# stored activities; both round the same way so they always agree.
+
+MET_VALUES = {
+    'Running': 9.8,
+    'Cycling': 7.5,
+    'Swimming': 8.0,
+    'Walking': 3.5,
+    'Weightlifting': 5.0,
+    'Strength Training': 5.0,
+    'Boxing': 7.8,
+    'Yoga': 2.5,
+    'CrossFit': 8.0,
+}
+DEFAULT_MET = 5.0
+# Weight assumed for users who did not enter theirs
+DEFAULT_WEIGHT = 70.0
+# Average speed in km/h
+SPEEDS = {'Running': 8.0, 'Cycling': 15.0, 'Swimming': 2.5, 'Walking': 5.0}
+
+ESTIMATED_FIELDS = ('calories_burned', 'distance')
+
+
+def require_numpy():
+    if np is None:
+        raise ImproperlyConfigured('Batch activity estimation requires the numpy package.')
+
+
+def estimate_calories(activity_type, duration, weight=None):
+    """Estimate the calories burned in duration minutes of an activity type"""
+    met = MET_VALUES.get(activity_type, DEFAULT_MET)
+    return int(round(met * (weight or DEFAULT_WEIGHT) * duration / 60))
+
+
+def estimate_distance(activity_type, duration):
+    """Estimate the distance in km covered in duration minutes of an activity type"""
+    return round(duration / 60 * SPEEDS.get(activity_type, 0.0) * 100) / 100
+
+
+def estimate_batch(activity_types, durations, weights):
+    """Estimate (calories, distances) arrays for parallel sequences of types, durations and weights
+
+    weights may contain None for users without a weight.
+    """
+    require_numpy()
+    types, inverse = np.unique(np.asarray(activity_types, dtype=object).astype(str), return_inverse=True)
+    mets = np.array([MET_VALUES.get(activity_type, DEFAULT_MET) for activity_type in types])[inverse]
+    speeds = np.array([SPEEDS.get(activity_type, 0.0) for activity_type in types])[inverse]
+    durations = np.asarray(durations, dtype=np.float64)
+    weights = np.array([weight or DEFAULT_WEIGHT for weight in weights], dtype=np.float64)
+    calories = np.rint(mets * weights * durations / 60).astype(np.int64)
+    distances = np.rint(durations / 60 * speeds * 100) / 100
+    return calories, distances
+
+
+def missing_estimates(rows):
+    """Get, for each validated activity row, the estimates of the fields it leaves out
+
+    The weights of the users involved are looked up with one query.
+    """
+    rows = list(rows)
+    needed = [row for row in rows if any(row.get(field) is None for field in ESTIMATED_FIELDS)]
+    weights = user_weights(row['user_id'] for row in needed) if needed else {}
+    estimates = []
+    for row in rows:
+        values = {}
+        if row.get('calories_burned') is None:
+            values['calories_burned'] = estimate_calories(
+                row['activity_type'], row['duration'], weights.get(row['user_id']),
+            )
+        if row.get('distance') is None:
+            values['distance'] = estimate_distance(row['activity_type'], row['duration'])
+        estimates.append(values)
+    return estimates
+
+
+def reestimate(recompute_all=False, batch_size=50000):
+    """Estimate the stored activities in batches and write the values that changed; return (scanned, updated)
+
+    Only activities missing calories or a distance are estimated unless
+    recompute_all is set, which replaces every stored value. Archived months
+    are left as they are. The derived collections are left to the caller to
+    rebuild.
+    """
+    require_numpy()
+    query = {} if recompute_all else {'$or': [{field: None} for field in ESTIMATED_FIELDS]}
+    fields = {'_id': 1, 'user_id': 1, 'activity_type': 1, 'duration': 1, **{field: 1 for field in ESTIMATED_FIELDS}}
+    cursor = Activity.objects.mongo_find(query, fields).batch_size(batch_size)
+    scanned = updated = 0
+    for batch in batches(cursor, batch_size):
+        weights = user_weights(activity['user_id'] for activity in batch)
+        calories, distances = estimate_batch(
+            [activity['activity_type'] for activity in batch],
+            [activity['duration'] for activity in batch],
+            [weights.get(activity['user_id']) for activity in batch],
+        )
+        operations = []
+        for activity, activity_calories, activity_distance in zip(batch, calories.tolist(), distances.tolist()):
+            values = {}
+            if (recompute_all or activity.get('calories_burned') is None) \
+                    and activity.get('calories_burned') != activity_calories:
+                values['calories_burned'] = activity_calories
+            if (recompute_all or activity.get('distance') is None) \
+                    and activity.get('distance') != activity_distance:
+                values['distance'] = activity_distance
+            if values:
+                operations.append(UpdateOne({'_id': activity['_id']}, {'$set': values}))
+        if operations:
+            Activity.objects.mongo_bulk_write(operations, ordered=False)
+        scanned += len(batch)
+        updated += len(operations)
+    return scanned, updated
@@ -0,0 +1,76 @@
+import csv
+import heapq
+import json
+from operator import itemgetter
+from . import archive
+from .models import User
+from .repositories import ActivityRepository
+from .utils import batches
+
+
+# Activity exports stream from one server-side cursor: documents are read
+# batch_size at a time, rendered like /api/activities/ (related names are
+# resolved per batch) and written out as text chunks, so memory use does not
+# depend on the size of the export. Archived months are read from their files
+# and merged in date order with the collection.
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+OUTPUT_CHOICES = tuple(CONTENT_TYPES)
+
+
+def export_query(user_id=None, team_id=None, start=None, end=None):
+    """Build the Mongo filter of an export; team_id selects the team's current members"""
+    query = {}
+    if user_id:
+        query['user_id'] = user_id
+    if team_id:
+        member_ids = [str(user._id) for user in User.objects.filter(team_id=team_id).only('_id')]
+        if user_id:
+            member_ids = [member_id for member_id in member_ids if member_id == user_id]
+        query['user_id'] = {'$in': member_ids}
+    query.update(ActivityRepository.date_range(start, end))
+    return query
+
+
+def activity_rows(user_id=None, team_id=None, start=None, end=None, batch_size=1000):
+    """Yield the API representation of every matching activity in date order"""
+    repository = ActivityRepository()
+    query = export_query(user_id, team_id, start, end)
+    cursor = repository.collection.find(
+        query, {field: 1 for field in repository.fields}
+    ).sort('date', 1).batch_size(batch_size)
+    documents = heapq.merge(archive.find(query), cursor, key=itemgetter('date'))
+    for chunk in batches(documents, batch_size):
+        yield from repository.represent(chunk)
+
+
+class _Echo:
+    """A file-like object whose write() returns the line instead of storing it"""
+    def write(self, value):
+        return value
+
+
+def render_csv(rows, chunk_size=1000):
+    writer = csv.DictWriter(_Echo(), fieldnames=ActivityRepository.fields)
+    yield writer.writeheader()
+    for chunk in batches(rows, chunk_size):
+        yield ''.join(writer.writerow(row) for row in chunk)
+
+
+def render_ndjson(rows, chunk_size=1000):
+    for chunk in batches(rows, chunk_size):
+        yield ''.join(json.dumps(row, ensure_ascii=False, separators=(',', ':')) + '\n' for row in chunk)
+
+
+RENDERERS = {
+    'csv': render_csv,
+    'ndjson': render_ndjson,
+}
+
+
+def render(output, rows):
+    """Render rows as text chunks in the given output format"""
+    return RENDERERS[output](rows)
@@ -0,0 +1,71 @@
+from rest_framework.exceptions import ValidationError
+
+
+class SparseFieldsetSerializerMixin:
+    """Lets callers narrow a serializer to a subset of its fields with a fields= argument
+
+    Computed fields can declare the model fields they read in
+    Meta.projection_dependencies so the viewset can load only those columns.
+    """
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class SparseFieldsetMixin:
+    """Narrows list/retrieve output and the database projection to ?fields=a,b"""
+    fields_query_param = 'fields'
+
+    def get_requested_fields(self):
+        """Get the set of requested field names, or None to return every field"""
+        if not hasattr(self, '_requested_fields'):
+            self._requested_fields = self.parse_requested_fields()
+        return self._requested_fields
+
+    def parse_requested_fields(self):
+        if self.action not in ('list', 'retrieve'):
+            return None
+        value = self.request.query_params.get(self.fields_query_param)
+        if not value:
+            return None
+        requested = {name.strip() for name in value.split(',') if name.strip()}
+        readable = {
+            name for name, field in self.get_serializer_class()().fields.items()
+            if not field.write_only
+        }
+        unknown = requested - readable
+        if unknown:
+            raise ValidationError({self.fields_query_param: [
+                f"Unknown field(s): {', '.join(sorted(unknown))}. Available: {', '.join(sorted(readable))}."
+            ]})
+        return requested
+
+    def get_projection(self, fields):
+        """Get the model fields needed to render the given serializer fields"""
+        dependencies = getattr(self.get_serializer_class().Meta, 'projection_dependencies', {})
+        model_fields = {field.name for field in self.queryset.model._meta.concrete_fields}
+        projection = {'_id'}
+        for name in fields:
+            projection.update(dependencies.get(name, (name,) if name in model_fields else ()))
+        # Cursor pagination reads the ordering fields from every row
+        ordering = getattr(self.paginator, 'ordering', ())
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        projection.update(field.lstrip('-') for field in ordering)
+        return projection
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.get_requested_fields()
+        if fields:
+            queryset = queryset.only(*self.get_projection(fields))
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_requested_fields()
+        if fields:
+            kwargs.setdefault('fields', fields)
+        return super().get_serializer(*args, **kwargs)
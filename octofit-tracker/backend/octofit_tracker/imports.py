@@ -0,0 +1,42 @@
+from bson import ObjectId
+from rest_framework.exceptions import ParseError
+from .estimation import missing_estimates
+from .lookups import name_snapshots
+from .models import Activity
+from .serializers import ActivitySerializer
+from .utils import batches, partition_key
+from . import tracking
+
+
+def import_activities(rows, chunk_size=500, context=None):
+    """Validate and create activities chunk by chunk; return (created, errors)
+
+    rows may contain ParseError instances for lines the NDJSON parser could
+    not decode. Errors are reported as {'index', 'errors'} per rejected row.
+    """
+    created = 0
+    errors = []
+    for chunk in batches(enumerate(rows), chunk_size):
+        valid_rows = []
+        for index, row in chunk:
+            if isinstance(row, ParseError):
+                errors.append({'index': index, 'errors': {'non_field_errors': [row.detail]}})
+                continue
+            serializer = ActivitySerializer(data=row, context=context)
+            if serializer.is_valid():
+                valid_rows.append(serializer.validated_data)
+            else:
+                errors.append({'index': index, 'errors': serializer.errors})
+        snapshots = name_snapshots(row['user_id'] for row in valid_rows)
+        estimates = missing_estimates(valid_rows)
+        # bulk_create neither sets a missing _id nor calls save(), so rows get their ObjectId and partition key here
+        activities = [
+            Activity(_id=ObjectId(), month=partition_key(row['date']), **row, **estimate,
+                     **snapshots.get(row['user_id'], {}))
+            for row, estimate in zip(valid_rows, estimates)
+        ]
+        if activities:
+            Activity.objects.bulk_create(activities)
+            tracking.activities_changed(added=activities)
+            created += len(activities)
+    return created, errors
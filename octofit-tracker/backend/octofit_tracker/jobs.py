@@ -0,0 +1,248 @@
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from .models import Job, Leaderboard, Team, User
+from . import caching, denormalization, imports, leaderboard, periods, records, rollups
+
+logger = logging.getLogger(__name__)
+
+
+# Background jobs are rows of the jobs collection, so they can be polled
+# through the API and survive restarts. enqueue() stores a job and, when
+# OCTOFIT_JOBS_IN_PROCESS is on, hands it to a thread pool of this process;
+# otherwise (or for jobs left behind by a crashed process) the run_jobs
+# command picks it up. A job is claimed with an atomic status update, so a
+# job is never run twice at once even with several runners. A partial unique
+# index on dedup_key (see Job.Meta) keeps a deduplicated kind from being
+# queued twice by processes enqueueing it at the same moment.
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+HANDLERS = {}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def handler(kind, dedup=False, max_attempts=3):
+    """Register a job handler
+
+    With dedup, enqueueing a kind that is already queued or running returns
+    the pending job instead of adding another one.
+    """
+    def register(function):
+        HANDLERS[kind] = {'function': function, 'dedup': dedup, 'max_attempts': max_attempts}
+        return function
+    return register
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.OCTOFIT_JOB_WORKERS, thread_name_prefix='octofit-job'
+                )
+    return _executor
+
+
+def enqueue(kind, params=None, dedup_key=None):
+    """Store a job and schedule it; return the new job or the pending duplicate"""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind '{kind}'. Available: {', '.join(sorted(HANDLERS))}.")
+    if dedup_key is None and HANDLERS[kind]['dedup']:
+        dedup_key = kind
+    while True:
+        if dedup_key:
+            pending = Job.objects.filter(dedup_key=dedup_key, status__in=ACTIVE_STATUSES).first()
+            if pending is not None:
+                return pending
+        try:
+            job = _insert(kind, params or {}, dedup_key)
+        except DuplicateKeyError:
+            # Another process queued the same job since the lookup; return that one
+            continue
+        dispatch(job._id)
+        return job
+
+
+def _insert(kind, params, dedup_key):
+    """Insert a queued job; raise DuplicateKeyError if its dedup_key is already pending"""
+    now = timezone.now()
+    document = {
+        'kind': kind,
+        'params': params,
+        'dedup_key': dedup_key,
+        'status': 'queued',
+        'attempts': 0,
+        'max_attempts': HANDLERS[kind]['max_attempts'],
+        'result': {},
+        'error': None,
+        'run_after': now,
+        'created_at': now,
+        'started_at': None,
+        'finished_at': None,
+    }
+    document['_id'] = Job.objects.mongo_insert_one(document).inserted_id
+    return Job(**document)
+
+
+def dispatch(job_id, delay=0):
+    """Run a job on the in-process pool, after delay seconds if given"""
+    if not settings.OCTOFIT_JOBS_IN_PROCESS:
+        return
+    if delay:
+        timer = threading.Timer(delay, dispatch, (job_id,))
+        timer.daemon = True
+        timer.start()
+    else:
+        get_executor().submit(run, job_id)
+
+
+def claim(job_id=None):
+    """Atomically mark a due queued job as running and return its document"""
+    now = datetime.utcnow()
+    query = {'status': 'queued', 'run_after': {'$lte': now}}
+    if job_id is not None:
+        query['_id'] = job_id
+    return Job.objects.mongo_find_one_and_update(
+        query,
+        {'$set': {'status': 'running', 'started_at': now}, '$inc': {'attempts': 1}},
+        sort=[('run_after', 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def run(job_id=None):
+    """Claim and run one due job (the given one if job_id is set); return its id or None"""
+    try:
+        document = claim(job_id)
+        if document is None:
+            return None
+        try:
+            handler_spec = HANDLERS.get(document['kind'])
+            if handler_spec is None:
+                raise LookupError(f"No handler for job kind '{document['kind']}'")
+            result = handler_spec['function'](**document['params'])
+        except Exception as exc:
+            logger.exception('Job %s (%s) failed', document['_id'], document['kind'])
+            _failed(document, exc)
+        else:
+            Job.objects.mongo_update_one({'_id': document['_id']}, {'$set': {
+                'status': 'succeeded',
+                # Round-trip through JSON so lazy strings and the like are stored as plain values
+                'result': json.loads(json.dumps(result, default=str)),
+                'error': None,
+                'finished_at': datetime.utcnow(),
+            }})
+        return document['_id']
+    finally:
+        close_old_connections()
+
+
+def _failed(document, exc):
+    """Requeue a failed job with exponential backoff, or mark it failed for good"""
+    now = datetime.utcnow()
+    update = {'error': f'{type(exc).__name__}: {exc}'}
+    if document['attempts'] < document['max_attempts']:
+        delay = settings.OCTOFIT_JOB_RETRY_DELAY * 2 ** (document['attempts'] - 1)
+        update.update(status='queued', run_after=now + timedelta(seconds=delay))
+        Job.objects.mongo_update_one({'_id': document['_id']}, {'$set': update})
+        dispatch(document['_id'], delay)
+    else:
+        update.update(status='failed', finished_at=now)
+        Job.objects.mongo_update_one({'_id': document['_id']}, {'$set': update})
+
+
+def run_pending(limit=None):
+    """Run due jobs one after another in the calling thread; return how many ran"""
+    count = 0
+    while limit is None or count < limit:
+        if run() is None:
+            break
+        count += 1
+    return count
+
+
+def requeue_stale(timeout):
+    """Requeue jobs that have been running for more than timeout seconds; return how many
+
+    Such jobs were most likely abandoned by a process that died. Jobs without
+    attempts left are marked failed instead.
+    """
+    now = datetime.utcnow()
+    stale = {'status': 'running', 'started_at': {'$lt': now - timedelta(seconds=timeout)}}
+    Job.objects.mongo_update_many(
+        {**stale, '$expr': {'$gte': ['$attempts', '$max_attempts']}},
+        {'$set': {'status': 'failed', 'finished_at': now, 'error': 'Abandoned by its runner'}},
+    )
+    result = Job.objects.mongo_update_many(
+        stale,
+        {'$set': {'status': 'queued', 'run_after': now, 'error': 'Requeued after being abandoned by its runner'}},
+    )
+    return result.modified_count
+
+
+@handler('leaderboard.rebuild', dedup=True)
+def rebuild_leaderboards():
+    return {'entries': leaderboard.rebuild(), 'period_entries': periods.rebuild()}
+
+
+@handler('leaderboard.rerank', dedup=True)
+def rerank_leaderboards():
+    fixed = leaderboard.rerank(Leaderboard) + leaderboard.rerank_activity_types() + periods.rerank()
+    if fixed:
+        caching.invalidate('leaderboard')
+    return {'fixed': fixed}
+
+
+@handler('rollups.rebuild', dedup=True)
+def rebuild_rollups(batch_size=10000, with_leaderboard=False):
+    result = {'rollups': rollups.rebuild(batch_size=batch_size)}
+    if with_leaderboard:
+        result.update(rebuild_leaderboards())
+    return result
+
+
+@handler('user_stats.rebuild', dedup=True)
+def rebuild_user_stats(batch_size=1000):
+    return {'user_stats': records.rebuild(batch_size=batch_size)}
+
+
+# Name snapshots are rewritten in the background since a rename can touch every
+# activity of a user or team. The handlers read the current names when they
+# run and only then drop the cached responses, so no stale name is re-cached.
+@handler('names.propagate_user')
+def propagate_user_names(user_id):
+    user = User.objects.filter(_id=ObjectId(user_id)).first()
+    if user is None:
+        return {'propagated': False}
+    denormalization.propagate_user(user)
+    caching.invalidate('leaderboard')
+    return {'propagated': True}
+
+
+@handler('names.propagate_team')
+def propagate_team_names(team_id):
+    team = Team.objects.filter(_id=ObjectId(team_id)).first()
+    if team is None:
+        return {'propagated': False}
+    denormalization.propagate_team(team)
+    caching.invalidate('leaderboard')
+    return {'propagated': True}
+
+
+# A retried import would create the rows of the first attempt twice
+@handler('activities.import', max_attempts=1)
+def import_activities(rows):
+    created, errors = imports.import_activities(rows)
+    return {'created': created, 'errors': errors}
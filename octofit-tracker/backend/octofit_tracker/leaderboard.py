@@ -0,0 +1,282 @@
+import threading
+from bson import ObjectId
+from datetime import date, datetime, time
+from itertools import groupby
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from . import caching
+from .lookups import user_snapshots
+from .models import DailyActivityRollup, Leaderboard, ActivityTypeLeaderboard
+
+
+# Ranks are "competition" ranks: an entry's rank is one plus the number of
+# entries with strictly more calories, so ties share a rank. Under that rule a
+# change of one user's total only moves the entries whose totals lie between
+# the old and the new value, which keeps every update to a small window of the
+# total_calories index instead of rewriting the whole collection. The same
+# code keeps one ranking per activity type (ActivityTypeLeaderboard) and per
+# period window (periods.py).
+#
+# Totals are changed with an atomic $inc that returns the previous total, so
+# they stay exact with any number of writers. The rank shifts are $inc's too,
+# but their windows are read from totals that another process may be changing
+# at the same moment: lock keeps the ranks of one process exact, and updates
+# from several processes (gunicorn workers, run_jobs) can leave ranks off by
+# one until rerank() repairs them. run_jobs schedules that repair periodically.
+lock = threading.Lock()
+
+
+def _user_snapshot(user_id):
+    """Get the team_id and name snapshots of one user, blank if the user is unknown"""
+    return user_snapshots([user_id]).get(user_id, {'team_id': '', 'user_name': None, 'team_name': None})
+
+
+def _mongo_scope(scope):
+    """Translate ORM field values of a ranking scope to their stored form"""
+    return {
+        field: datetime.combine(value, time.min) if isinstance(value, date) and not isinstance(value, datetime) else value
+        for field, value in scope.items()
+    }
+
+
+def _shift_ranks(model, scope, low, high, step, exclude_user_id):
+    """Shift the rank of every other entry in scope whose total lies in [low, high)"""
+    bounds = {'$lt': high}
+    if low is not None:
+        bounds['$gte'] = low
+    model.objects.mongo_update_many(
+        {**scope, 'total_calories': bounds, 'user_id': {'$ne': exclude_user_id}},
+        {'$inc': {'rank': step}},
+    )
+
+
+def _increment(model, key, increments, defaults):
+    """Atomically add to the totals of the entry matching key, creating it if needed
+
+    Returns the total calories before the change, or None if the entry was created.
+    """
+    update = {'$inc': increments, '$set': {'updated_at': datetime.utcnow()}}
+    options = {'projection': {'total_calories': 1}, 'return_document': ReturnDocument.BEFORE}
+    previous = model.objects.mongo_find_one_and_update(key, update, **options)
+    if previous is None:
+        on_insert = {**_user_snapshot(key['user_id']), **(defaults or {}), 'rank': 0}
+        try:
+            previous = model.objects.mongo_find_one_and_update(
+                key, {**update, '$setOnInsert': on_insert}, upsert=True, **options,
+            )
+        except DuplicateKeyError:
+            # Another process created the entry in between
+            previous = model.objects.mongo_find_one_and_update(key, update, **options)
+    return previous['total_calories'] if previous is not None else None
+
+
+def update_ranked_entry(model, scope, user_id, calories, duration, defaults=None, counts=None):
+    """Add calories and duration to a user's entry in one ranking and re-rank the affected entries
+
+    model is Leaderboard or any model with the same ranking fields; scope
+    holds the field values that select one ranking of that model (empty for
+    the all-time leaderboard). defaults are set on newly created entries and
+    counts are added to other counters of the entry. The caller must hold
+    lock. Returns the new total.
+    """
+    mongo_scope = _mongo_scope(scope)
+    key = {**mongo_scope, 'user_id': user_id}
+    increments = {'total_calories': calories, 'total_duration': duration, **(counts or {})}
+    old_total = _increment(model, key, increments, defaults)
+    new_total = (old_total or 0) + calories
+
+    if old_total is None:
+        _shift_ranks(model, mongo_scope, None, new_total, 1, user_id)
+    elif new_total > old_total:
+        _shift_ranks(model, mongo_scope, old_total, new_total, 1, user_id)
+    elif new_total < old_total:
+        _shift_ranks(model, mongo_scope, new_total, old_total, -1, user_id)
+
+    rank = 1 + model.objects.mongo_count_documents(
+        {**mongo_scope, 'total_calories': {'$gt': new_total}, 'user_id': {'$ne': user_id}}
+    )
+    # If the total changed again meanwhile, that update sets the rank
+    model.objects.mongo_update_one({**key, 'total_calories': new_total}, {'$set': {'rank': rank}})
+    return new_total
+
+
+def rerank(model, scope=None):
+    """Recompute the ranks of one ranking from its totals and fix those that drifted; return how many"""
+    mongo_scope = _mongo_scope(scope or {})
+    with lock:
+        entries = model.objects.mongo_find(mongo_scope, {'total_calories': 1, 'rank': 1}).sort('total_calories', -1)
+        operations = [
+            UpdateOne({'_id': entry['_id'], 'total_calories': entry['total_calories']}, {'$set': {'rank': rank}})
+            for rank, entry in competition_ranks((entry['total_calories'], entry) for entry in entries)
+            if entry.get('rank') != rank
+        ]
+        if operations:
+            model.objects.mongo_bulk_write(operations, ordered=False)
+    return len(operations)
+
+
+def competition_ranks(totals):
+    """Yield (rank, item) for items sorted by descending total, giving ties the same rank"""
+    rank = 0
+    previous_total = None
+    for position, (total, item) in enumerate(totals, start=1):
+        if total != previous_total:
+            rank = position
+            previous_total = total
+        yield rank, item
+
+
+def apply_delta(user_id, calories, duration):
+    """Add calories and duration to a user's totals and re-rank the affected entries"""
+    with lock:
+        return update_ranked_entry(Leaderboard, {}, user_id, calories, duration)
+
+
+def apply_activity_changes(added=(), removed=()):
+    """Update the all-time and activity type leaderboards for activities that were added and/or removed"""
+    deltas = {}
+    type_deltas = {}
+    for activities, sign in ((added, 1), (removed, -1)):
+        for activity in activities:
+            calories, duration = deltas.get(activity.user_id, (0, 0))
+            deltas[activity.user_id] = (
+                calories + sign * activity.calories_burned,
+                duration + sign * activity.duration,
+            )
+            key = (activity.activity_type, activity.user_id)
+            calories, duration, count = type_deltas.get(key, (0, 0, 0))
+            type_deltas[key] = (
+                calories + sign * activity.calories_burned,
+                duration + sign * activity.duration,
+                count + sign,
+            )
+    for user_id, (calories, duration) in deltas.items():
+        if calories or duration:
+            apply_delta(user_id, calories, duration)
+    with lock:
+        for (activity_type, user_id), (calories, duration, count) in type_deltas.items():
+            if calories or duration or count:
+                update_ranked_entry(
+                    ActivityTypeLeaderboard, {'activity_type': activity_type}, user_id, calories, duration,
+                    counts={'total_activities': count},
+                )
+        # Entries left without activities have no calories either, so dropping them moves no rank
+        emptied = [
+            {'activity_type': activity_type, 'user_id': user_id}
+            for (activity_type, user_id), (_, _, count) in type_deltas.items() if count < 0
+        ]
+        if emptied:
+            ActivityTypeLeaderboard.objects.mongo_delete_many({'$or': emptied, 'total_activities': {'$lte': 0}})
+
+
+def rebuild():
+    """Recompute every all-time and activity type leaderboard entry from the daily activity rollups"""
+    rows = list(DailyActivityRollup.objects.mongo_aggregate([
+        {'$group': {
+            '_id': '$user_id',
+            'total_calories': {'$sum': '$calories'},
+            'total_duration': {'$sum': '$duration'},
+        }},
+        {'$sort': {'total_calories': -1}},
+    ]))
+    snapshots = user_snapshots(row['_id'] for row in rows)
+    entries = [
+        Leaderboard(
+            _id=ObjectId(),
+            user_id=row['_id'],
+            **snapshots.get(row['_id'], {'team_id': ''}),
+            total_calories=row['total_calories'],
+            total_duration=row['total_duration'],
+            rank=rank,
+        )
+        for rank, row in competition_ranks((row['total_calories'], row) for row in rows)
+    ]
+
+    with lock:
+        Leaderboard.objects.all().delete()
+        Leaderboard.objects.bulk_create(entries)
+    rebuild_activity_types(snapshots)
+    caching.invalidate('leaderboard')
+    return len(entries)
+
+
+def rebuild_activity_types(snapshots=None):
+    """Recompute the leaderboard of every activity type from the daily activity rollups; return the entry count"""
+    rows = list(DailyActivityRollup.objects.mongo_aggregate([
+        {'$group': {
+            '_id': {'activity_type': '$activity_type', 'user_id': '$user_id'},
+            'total_calories': {'$sum': '$calories'},
+            'total_duration': {'$sum': '$duration'},
+            'total_activities': {'$sum': '$count'},
+        }},
+        {'$sort': {'_id.activity_type': 1, 'total_calories': -1}},
+    ], allowDiskUse=True))
+    if snapshots is None:
+        snapshots = user_snapshots(row['_id']['user_id'] for row in rows)
+    entries = []
+    for activity_type, type_rows in groupby(rows, key=lambda row: row['_id']['activity_type']):
+        for rank, row in competition_ranks((row['total_calories'], row) for row in type_rows):
+            entries.append(ActivityTypeLeaderboard(
+                _id=ObjectId(),
+                activity_type=activity_type,
+                user_id=row['_id']['user_id'],
+                **snapshots.get(row['_id']['user_id'], {'team_id': ''}),
+                total_calories=row['total_calories'],
+                total_duration=row['total_duration'],
+                total_activities=row['total_activities'],
+                rank=rank,
+            ))
+
+    with lock:
+        ActivityTypeLeaderboard.objects.mongo_delete_many({})
+        ActivityTypeLeaderboard.objects.bulk_create(entries, batch_size=1000)
+    return len(entries)
+
+
+def rerank_activity_types():
+    """Repair the ranks of every activity type leaderboard; return how many were fixed"""
+    activity_types = ActivityTypeLeaderboard.objects.mongo_distinct('activity_type')
+    return sum(rerank(ActivityTypeLeaderboard, {'activity_type': activity_type}) for activity_type in activity_types)
+
+
+def _top(entries, k, team_id):
+    """Get the k best-ranked of entries, ranked within one team if team_id is given"""
+    if team_id:
+        entries = entries.filter(team_id=team_id)
+    entries = list(entries.order_by('rank', '_id')[:k])
+    if team_id:
+        # A team's best entries come in rank order, so they are ranked among themselves
+        for rank, entry in competition_ranks((entry.total_calories, entry) for entry in entries):
+            entry.rank = rank
+    return entries
+
+
+def top(k, team_id=None):
+    """Get the k best-ranked entries, optionally within one team, from the rank indexes"""
+    return _top(Leaderboard.objects.all(), k, team_id)
+
+
+def around(user_id, radius):
+    """Get a user's entry with up to radius entries on each side, or None if the user is unranked
+
+    Neighbours are found with two keyset reads on (rank, _id) so the cost does
+    not depend on the user's position.
+    """
+    entry = Leaderboard.objects.filter(user_id=user_id).only('_id', 'rank').first()
+    if entry is None:
+        return None
+    windows = {}
+    for side, operator, direction in (('above', '$lt', -1), ('below', '$gt', 1)):
+        cursor = Leaderboard.objects.mongo_find(
+            {'$or': [{'rank': {operator: entry.rank}}, {'rank': entry.rank, '_id': {operator: entry._id}}]},
+            {'_id': 1},
+        ).sort([('rank', direction), ('_id', direction)]).limit(radius)
+        windows[side] = [document['_id'] for document in cursor]
+    ids = windows['above'][::-1] + [entry._id] + windows['below']
+    entries = {item._id: item for item in Leaderboard.objects.filter(_id__in=ids)}
+    return [entries[object_id] for object_id in ids if object_id in entries]
+
+
+def top_by_activity_type(activity_type, k, team_id=None):
+    """Get the k best-ranked entries of one activity type, optionally within one team, from the rank indexes"""
+    return _top(ActivityTypeLeaderboard.objects.filter(activity_type=activity_type), k, team_id)
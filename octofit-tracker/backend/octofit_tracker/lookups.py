@@ -0,0 +1,99 @@
+from bson import ObjectId
+from bson.errors import InvalidId
+from .models import User, Team, DailyActivityRollup
+
+
+def to_object_ids(values):
+    """Convert id strings to ObjectIds, skipping anything that is not a valid id"""
+    object_ids = set()
+    for value in values:
+        try:
+            object_ids.add(ObjectId(value))
+        except (InvalidId, TypeError):
+            continue
+    return list(object_ids)
+
+
+def user_names(user_ids):
+    """Map user id strings to user names with a single query"""
+    object_ids = to_object_ids(user_ids)
+    if not object_ids:
+        return {}
+    users = User.objects.filter(_id__in=object_ids).only('_id', 'name')
+    return {str(user._id): user.name for user in users}
+
+
+def team_names(team_ids):
+    """Map team id strings to team names with a single query"""
+    object_ids = to_object_ids(team_ids)
+    if not object_ids:
+        return {}
+    teams = Team.objects.filter(_id__in=object_ids).only('_id', 'name')
+    return {str(team._id): team.name for team in teams}
+
+
+def activity_counts(user_ids):
+    """Map user id strings to their number of activities with a single aggregation over the daily rollups"""
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return {}
+    rows = DailyActivityRollup.objects.mongo_aggregate([
+        {'$match': {'user_id': {'$in': user_ids}}},
+        {'$group': {'_id': '$user_id', 'count': {'$sum': '$count'}}},
+    ])
+    return {row['_id']: row['count'] for row in rows}
+
+
+def member_counts(team_ids):
+    """Map team id strings to their number of members with a single aggregation"""
+    team_ids = list(set(team_ids))
+    if not team_ids:
+        return {}
+    rows = User.objects.mongo_aggregate([
+        {'$match': {'team_id': {'$in': team_ids}}},
+        {'$group': {'_id': '$team_id', 'count': {'$sum': 1}}},
+    ])
+    return {row['_id']: row['count'] for row in rows}
+
+
+def user_team_ids(user_ids):
+    """Map user id strings to their team_id with a single query"""
+    object_ids = to_object_ids(user_ids)
+    if not object_ids:
+        return {}
+    users = User.objects.filter(_id__in=object_ids).only('_id', 'team_id')
+    return {str(user._id): user.team_id for user in users}
+
+
+def user_weights(user_ids):
+    """Map user id strings to their weight in kilograms with a single query, skipping users without one"""
+    object_ids = to_object_ids(user_ids)
+    if not object_ids:
+        return {}
+    users = User.objects.mongo_find({'_id': {'$in': object_ids}, 'weight': {'$ne': None}}, {'weight': 1})
+    return {str(user['_id']): user['weight'] for user in users}
+
+
+def user_snapshots(user_ids):
+    """Map user id strings to their team_id ('' if none) and the user and team names with two queries"""
+    object_ids = to_object_ids(user_ids)
+    if not object_ids:
+        return {}
+    users = list(User.objects.filter(_id__in=object_ids).only('_id', 'name', 'team_id'))
+    teams = team_names(user.team_id for user in users)
+    return {
+        str(user._id): {
+            'team_id': user.team_id or '',
+            'user_name': user.name,
+            'team_name': teams.get(user.team_id),
+        }
+        for user in users
+    }
+
+
+def name_snapshots(user_ids):
+    """Map user id strings to the user and team names stored on denormalized documents"""
+    return {
+        user_id: {'user_name': snapshot['user_name'], 'team_name': snapshot['team_name']}
+        for user_id, snapshot in user_snapshots(user_ids).items()
+    }
@@ -0,0 +1,41 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from octofit_tracker import archive
+
+
+class Command(BaseCommand):
+    help = ('Move the months of activities older than OCTOFIT_ACTIVITY_RETENTION_MONTHS into compressed '
+            'NDJSON files, keeping rollups, leaderboards and user stats as they are')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Activities read, written and deleted at a time')
+        parser.add_argument('--list', action='store_true',
+                            help='Only list the archived months and the retention cutoff')
+        parser.add_argument('--backfill', action='store_true',
+                            help='Only set the partition key of activities stored before it existed, '
+                                 'which date-bounded reads otherwise skip')
+
+    def handle(self, *args, **options):
+        cutoff = archive.cutoff_month()
+        if options['list']:
+            for month in archive.archived_months():
+                self.stdout.write(f'{month}  {archive.archive_path(month)}')
+            self.stdout.write(f'Months before {cutoff} are archived '
+                              f'({settings.OCTOFIT_ACTIVITY_RETENTION_MONTHS} months kept)')
+            return
+
+        if options['backfill']:
+            count = archive.backfill_partition_keys(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Set the partition key of {count} activities'))
+            return
+
+        started = time.perf_counter()
+        moved = archive.archive(batch_size=options['batch_size'])
+        for month, count in moved.items():
+            self.stdout.write(f'Archived {count} activities of {month} to {archive.archive_path(month)}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {sum(moved.values())} activities from {len(moved)} months before {cutoff} '
+            f'in {time.perf_counter() - started:.1f}s'
+        ))
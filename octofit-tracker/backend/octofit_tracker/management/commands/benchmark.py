@@ -0,0 +1,474 @@
+import io
+import json
+import platform
+import re
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from django.test import Client, override_settings
+from django.utils import timezone as django_timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import ListSerializer
+from octofit_tracker import estimation, recommendations
+from octofit_tracker.caching import api_cache
+from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
+from octofit_tracker.renderers import FastJSONRenderer
+from octofit_tracker.serializers import ActivitySerializer, LeaderboardSerializer, WorkoutSerializer, BatchedListSerializer
+from octofit_tracker.utils import percentile
+from bson import ObjectId
+
+
+# Endpoints timed by the suite target, as (name, method, path). Paths are
+# formatted with the ids of a sample user and activity of the dataset. Writes
+# come last so they do not change what the reads see.
+SUITE_ENDPOINTS = [
+    ('users list', 'GET', '/api/users/?page_size=100'),
+    ('user retrieve', 'GET', '/api/users/{user_id}/'),
+    ('teams list', 'GET', '/api/teams/?page_size=100'),
+    ('activities list', 'GET', '/api/activities/?page_size=100'),
+    ('activity retrieve', 'GET', '/api/activities/{activity_id}/'),
+    ('activity stats', 'GET', '/api/activities/stats/?group_by=team&bucket=month'),
+    ('leaderboard list', 'GET', '/api/leaderboard/?page_size=100'),
+    ('leaderboard top', 'GET', '/api/leaderboard/top/?k=10'),
+    ('leaderboard around', 'GET', '/api/leaderboard/around/?user_id={user_id}'),
+    ('leaderboard period', 'GET', '/api/leaderboard/period/?period=week'),
+    ('workouts list', 'GET', '/api/workouts/'),
+    ('activity create', 'POST', '/api/activities/'),
+]
+
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def use_mongomock():
+    """Point djongo and the pymongo repositories at one in-memory mongomock client
+
+    Separate mongomock clients do not share data, so both get the same one.
+    """
+    try:
+        import mongomock
+    except ImportError:
+        raise CommandError('--mongomock requires the mongomock package (pip install mongomock).')
+    from djongo import database
+    from octofit_tracker import repositories
+    client = mongomock.MongoClient()
+    connections.close_all()
+    database.clients.clear()
+    database.MongoClient = lambda *args, **kwargs: client
+    repositories.MongoClient = lambda *args, **kwargs: client
+    repositories._client = None
+    return client
+
+
+class Command(BaseCommand):
+    help = 'Benchmark API endpoints against the octofit_db database (replaces existing data)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('target', choices=['teams', 'native', 'load', 'suite', 'serializers', 'recommendations', 'estimation'], help='Which benchmark to run')
+        parser.add_argument('--sizes', default='100,1000,5000',
+                            help='Comma-separated dataset sizes to benchmark')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Number of timed requests per size')
+        parser.add_argument('--wsgi-url', default='http://localhost:8000',
+                            help='Base URL of a running WSGI server (load target)')
+        parser.add_argument('--asgi-url', default='http://localhost:8001',
+                            help='Base URL of a running ASGI server (load target)')
+        parser.add_argument('--concurrency', default='1,16,64',
+                            help='Comma-separated numbers of concurrent clients (load target)')
+        parser.add_argument('--duration', type=float, default=10,
+                            help='Seconds to run each load level (load target)')
+        parser.add_argument('--transports', default='client,wsgi',
+                            help='Comma-separated transports: client (Django test client) and/or '
+                                 'wsgi (a real threaded WSGI server on a free port) (suite target)')
+        parser.add_argument('--output', help='Write the results as JSON to this file (suite target)')
+        parser.add_argument('--compare', help='Compare with the JSON results of an earlier run (suite target)')
+        parser.add_argument('--threshold', type=float, default=1.25,
+                            help='Fail when a p50 latency grows by more than this factor (with --compare)')
+        parser.add_argument('--mongomock', action='store_true',
+                            help='Run against an in-memory mongomock database instead of mongod '
+                                 '(no query counts; latencies are not comparable with mongod runs)')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('--sizes must be a comma-separated list of integers')
+        if options['mongomock']:
+            use_mongomock()
+        self.client = Client(HTTP_HOST='localhost')
+        self.repeat = options['repeat']
+        self.options = options
+        getattr(self, f"benchmark_{options['target']}")(sizes)
+
+    def time_requests(self, url, repeat=None, clear_cache=False):
+        """Request a URL repeatedly and return the latencies in milliseconds"""
+        self.client.get(url)  # warm-up
+        samples = []
+        for _ in range(repeat or self.repeat):
+            if clear_cache:
+                api_cache().clear()
+            start = time.perf_counter()
+            response = self.client.get(url)
+            samples.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                raise CommandError(f'GET {url} returned {response.status_code}')
+        return samples
+
+    def report(self, label, samples, rows):
+        median = statistics.median(samples)
+        self.stdout.write(
+            f'{label:>10}  p50 {median:8.2f} ms  p95 {percentile(samples, 0.95):8.2f} ms  '
+            f'{median / max(rows, 1) * 1000:8.2f} us/row'
+        )
+
+    def benchmark_teams(self, sizes):
+        """Time /api/teams/ as the number of teams grows, five members per team"""
+        self.stdout.write(self.style.WARNING('Deleting existing users and teams...'))
+        self.stdout.write('       teams  latency of one full page of /api/teams/')
+        for size in sizes:
+            User.objects.all().delete()
+            Team.objects.all().delete()
+            teams = [Team(_id=ObjectId(), name=f'Team {i}') for i in range(size)]
+            Team.objects.bulk_create(teams, batch_size=1000)
+            User.objects.bulk_create([
+                User(_id=ObjectId(), name=f'Member {i}-{j}', email=f'member{i}-{j}@example.com',
+                     password='benchmark', team_id=str(team._id))
+                for i, team in enumerate(teams) for j in range(5)
+            ], batch_size=1000)
+
+            page_size = min(size, settings.OCTOFIT_MAX_PAGE_SIZE)
+            samples = self.time_requests(f'/api/teams/?page_size={page_size}')
+            self.report(str(size), samples, page_size)
+
+    def seed_activities(self, activity_count, activities_per_user=100):
+        """Replace the database contents with a synthetic dataset of about activity_count activities"""
+        users = max(1, activity_count // activities_per_user)
+        call_command('populate_db', users=users, activities_per_user=min(activity_count, activities_per_user),
+                     stdout=io.StringIO())
+        return users
+
+    def benchmark_native(self, sizes):
+        """Compare req/s of the djongo and pymongo read paths"""
+        self.stdout.write(self.style.WARNING('Replacing existing data with synthetic datasets...'))
+        urls = ['/api/activities/?page_size=100', '/api/leaderboard/?page_size=100', '/api/users/?page_size=100']
+        for size in sizes:
+            self.seed_activities(size)
+            self.stdout.write(f'\n{size} activities')
+            for url in urls:
+                rates = {}
+                for native in (False, True):
+                    with override_settings(OCTOFIT_NATIVE_READS=native):
+                        samples = self.time_requests(url, clear_cache=True)
+                    rates[native] = 1000 / statistics.mean(samples)
+                self.stdout.write(
+                    f'  {url:<36} djongo {rates[False]:8.1f} req/s  pymongo {rates[True]:8.1f} req/s  '
+                    f'x{rates[True] / rates[False]:.2f}'
+                )
+
+    def run_load(self, url, concurrency, duration):
+        """Hit a URL from concurrent clients for duration seconds; return (req/s, latencies, errors)"""
+        deadline = time.perf_counter() + duration
+        samples = []
+        errors = []
+        lock = threading.Lock()
+
+        def worker():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    with urllib.request.urlopen(url) as response:
+                        response.read()
+                except OSError as exc:
+                    with lock:
+                        errors.append(exc)
+                    continue
+                with lock:
+                    samples.append((time.perf_counter() - start) * 1000)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for _ in range(concurrency):
+                pool.submit(worker)
+        return len(samples) / (time.perf_counter() - started), samples, errors
+
+    def benchmark_load(self, sizes):
+        """Compare throughput of a one-process WSGI server and a one-process ASGI server
+
+        Start both against the same database first, for example:
+            gunicorn -w 1 --threads 8 -b :8000 octofit_tracker.wsgi
+            uvicorn --workers 1 --port 8001 octofit_tracker.asgi:application
+        """
+        paths = [
+            ('/api/leaderboard/?page_size=100', '/api/async/leaderboard/?page_size=100'),
+            ('/api/activities/?page_size=100', '/api/async/activities/?page_size=100'),
+            ('/api/activities/stats/?group_by=team', '/api/async/activities/stats/?group_by=team'),
+        ]
+        levels = [int(level) for level in self.options['concurrency'].split(',')]
+        for wsgi_path, asgi_path in paths:
+            self.stdout.write(f'\n{wsgi_path}')
+            for level in levels:
+                line = f'  {level:>4} clients'
+                for label, url in (('wsgi', self.options['wsgi_url'] + wsgi_path),
+                                   ('asgi', self.options['asgi_url'] + asgi_path)):
+                    rate, samples, errors = self.run_load(url, level, self.options['duration'])
+                    p95 = percentile(samples, 0.95) if samples else float('nan')
+                    line += f'  {label} {rate:8.1f} req/s p95 {p95:8.2f} ms'
+                    if errors:
+                        line += f' ({len(errors)} errors)'
+                self.stdout.write(line)
+
+    def sample_instances(self, size):
+        """Build unsaved activities, leaderboard entries and workouts shaped like populate_db's"""
+        now = django_timezone.now()
+        types = ['Running', 'Cycling', 'Swimming', 'Walking', 'Strength Training']
+        activities = [
+            Activity(_id=ObjectId(), user_id=str(ObjectId()), user_name=f'User {i}', activity_type=types[i % 5],
+                     duration=30 + i % 60, distance=round(1 + i % 50 * 0.25, 2), calories_burned=240 + i % 400,
+                     date=now.date(), notes=None if i % 3 else 'Felt great', created_at=now)
+            for i in range(size)
+        ]
+        entries = [
+            Leaderboard(_id=ObjectId(), user_id=str(ObjectId()), user_name=f'User {i}', team_id=str(ObjectId()),
+                        team_name=f'Team {i % 10}', total_calories=100000 - i, total_duration=5000 - i % 5000,
+                        rank=i + 1, updated_at=now)
+            for i in range(size)
+        ]
+        workouts = [
+            Workout(_id=ObjectId(), name=f'Workout {i}', description='Intervals and recovery', difficulty='Medium',
+                    duration=20 + i % 40, calories_estimate=150 + i % 300, activity_type=types[i % 5], created_at=now)
+            for i in range(size)
+        ]
+        return [('activities', ActivitySerializer, activities), ('leaderboard', LeaderboardSerializer, entries),
+                ('workouts', WorkoutSerializer, workouts)]
+
+    def time_rendering(self, render):
+        """Run render repeatedly and return the latencies in milliseconds and the last output"""
+        samples = []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            content = render()
+            samples.append((time.perf_counter() - start) * 1000)
+        return samples, content
+
+    def benchmark_serializers(self, sizes):
+        """Compare DRF's list serializers and JSONRenderer with the fast list path and orjson
+
+        Rows are built in memory, so only the leaderboard's activity counts
+        touch the database. Both paths must produce the same JSON document.
+        """
+        self.stdout.write('   rows  resource      drf serialize+render   fast serialize+render')
+        for size in sizes:
+            for label, serializer_class, instances in self.sample_instances(size):
+                baseline_class = BatchedListSerializer if hasattr(serializer_class, 'prefetch') else ListSerializer
+                drf, drf_content = self.time_rendering(lambda: JSONRenderer().render(
+                    baseline_class(instances, child=serializer_class()).data
+                ))
+                fast, fast_content = self.time_rendering(lambda: FastJSONRenderer().render(
+                    serializer_class(instances, many=True).data
+                ))
+                if json.loads(drf_content) != json.loads(fast_content):
+                    raise CommandError(f'The fast path renders {label} differently')
+                drf_median = statistics.median(drf)
+                fast_median = statistics.median(fast)
+                self.stdout.write(
+                    f'{size:>7}  {label:<12} {drf_median:10.2f} ms {drf_median / size * 1000:7.2f} us/row  '
+                    f'{fast_median:10.2f} ms {fast_median / size * 1000:7.2f} us/row  x{drf_median / fast_median:.2f}'
+                )
+
+    def benchmark_recommendations(self, sizes):
+        """Time top-10 workout scoring against in-memory catalogs of the given sizes
+
+        Only the NumPy scoring is timed; profiles are synthetic, so no
+        database is needed.
+        """
+        recommendations.require_numpy()
+        types = ['Running', 'Cycling', 'Swimming', 'Weightlifting', 'Boxing', 'Yoga', 'CrossFit']
+        difficulties = list(recommendations.DIFFICULTY_LEVELS)
+        profiles = [
+            ({types[i % 7]: 60 + i % 90, types[(i + 3) % 7]: 30}, 20 + i % 80, 150 + i % 600, (i % 5) / 4)
+            for i in range(1000)
+        ]
+        self.stdout.write('  workouts  1 user           1000 users')
+        for size in sizes:
+            catalog = recommendations.Catalog([
+                {'_id': ObjectId(), 'activity_type': types[i % 7], 'duration': 15 + i % 90,
+                 'calories_estimate': 100 + i % 700, 'difficulty': difficulties[i % 3]}
+                for i in range(size)
+            ])
+            single, _ = self.time_rendering(lambda: catalog.top(profiles[:1], 10))
+            batch, _ = self.time_rendering(lambda: catalog.top(profiles, 10))
+            self.stdout.write(
+                f'{size:>10}  {statistics.median(single):8.2f} ms  '
+                f'{statistics.median(batch):10.2f} ms ({statistics.median(batch):.2f} us/user)'
+            )
+
+    def benchmark_estimation(self, sizes):
+        """Time the NumPy calorie and distance estimates for batches of the given sizes
+
+        Only the computation is timed, not the reads and writes around it.
+        """
+        estimation.require_numpy()
+        types = list(estimation.MET_VALUES)
+        for size in sizes:
+            activity_types = [types[i % len(types)] for i in range(size)]
+            durations = [15 + i % 105 for i in range(size)]
+            weights = [None if i % 4 == 0 else 50 + i % 50 for i in range(size)]
+            samples, _ = self.time_rendering(lambda: estimation.estimate_batch(activity_types, durations, weights))
+            median = statistics.median(samples)
+            self.stdout.write(
+                f'{size:>10}  p50 {median:8.2f} ms  {size / median * 60_000:>14,.0f} activities/min'
+            )
+
+    def benchmark_suite(self, sizes):
+        """Time every endpoint in SUITE_ENDPOINTS per dataset size and transport
+
+        Responses are not served from the API cache, and every request is
+        profiled so the query count per request can be read from its
+        Server-Timing header.
+        """
+        transports = self.options['transports'].split(',')
+        unknown = set(transports) - {'client', 'wsgi'}
+        if unknown:
+            raise CommandError(f"Unknown transport(s): {', '.join(sorted(unknown))}")
+        self.stdout.write(self.style.WARNING('Replacing existing data with synthetic datasets...'))
+        results = []
+        server = self.start_wsgi_server() if 'wsgi' in transports else None
+        try:
+            with override_settings(OCTOFIT_PROFILING_SAMPLE_RATE=1.0):
+                for size in sizes:
+                    self.seed_activities(size)
+                    ids = {
+                        'user_id': str(User.objects.mongo_find_one({}, {'_id': 1})['_id']),
+                        'activity_id': str(Activity.objects.mongo_find_one({}, {'_id': 1})['_id']),
+                    }
+                    self.stdout.write(f'\n{size} activities')
+                    for transport in transports:
+                        for name, method, path in SUITE_ENDPOINTS:
+                            result = self.time_endpoint(transport, server, method, path.format(**ids), ids)
+                            result.update(dataset=size, transport=transport, endpoint=name)
+                            results.append(result)
+                            self.report_suite_result(result)
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+        report = {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'mongomock': self.options['mongomock'],
+            'native_reads': settings.OCTOFIT_NATIVE_READS,
+            'repeat': self.repeat,
+            'results': results,
+        }
+        if self.options['output']:
+            with open(self.options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"\nWrote {len(results)} results to {self.options['output']}"))
+        if self.options['compare']:
+            self.compare_results(results)
+
+    def start_wsgi_server(self):
+        """Serve the project on a free local port from a background thread"""
+        server = ThreadedWSGIServer(('localhost', 0), QuietWSGIRequestHandler, allow_reuse_address=False)
+        server.set_app(get_wsgi_application())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        server.base_url = f'http://localhost:{server.server_port}'
+        return server
+
+    def send(self, transport, server, method, path, body):
+        """Send one request; return (status, Server-Timing header)"""
+        data = json.dumps(body).encode() if body is not None else None
+        if transport == 'client':
+            response = self.client.generic(method, path, data or '', content_type='application/json')
+            return response.status_code, response.get('Server-Timing', '')
+        request = urllib.request.Request(
+            server.base_url + path, data=data, method=method,
+            headers={'Content-Type': 'application/json', 'Accept': 'application/json'},
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status, response.headers.get('Server-Timing', '')
+        except urllib.error.HTTPError as exc:
+            return exc.code, exc.headers.get('Server-Timing', '')
+
+    def time_endpoint(self, transport, server, method, path, ids):
+        """Send repeat requests (plus a warm-up) and summarize latency, throughput and queries"""
+        body = None
+        if method == 'POST':
+            body = {'user_id': ids['user_id'], 'activity_type': 'Running', 'duration': 30,
+                    'distance': 5.0, 'calories_burned': 300, 'date': datetime.utcnow().date().isoformat()}
+        samples = []
+        queries = []
+        errors = 0
+        self.send(transport, server, method, path, body)  # warm-up
+        for _ in range(self.repeat):
+            api_cache().clear()
+            start = time.perf_counter()
+            status, server_timing = self.send(transport, server, method, path, body)
+            samples.append((time.perf_counter() - start) * 1000)
+            if status >= 400:
+                errors += 1
+            match = SERVER_TIMING_QUERIES.search(server_timing)
+            if match:
+                queries.append(int(match.group(1)))
+        return {
+            'method': method,
+            'path': path,
+            'requests': len(samples),
+            'errors': errors,
+            'req_per_s': round(1000 / statistics.mean(samples), 2),
+            'p50_ms': round(percentile(samples, 0.5), 3),
+            'p95_ms': round(percentile(samples, 0.95), 3),
+            'p99_ms': round(percentile(samples, 0.99), 3),
+            'queries_per_request': round(statistics.mean(queries), 2) if queries else None,
+        }
+
+    def report_suite_result(self, result):
+        queries = result['queries_per_request']
+        line = (
+            f"  {result['transport']:<6} {result['endpoint']:<20} {result['req_per_s']:8.1f} req/s  "
+            f"p50 {result['p50_ms']:8.2f} ms  p95 {result['p95_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms  "
+            f"{queries if queries is not None else '-':>6} queries"
+        )
+        if result['errors']:
+            line += f" ({result['errors']} errors)"
+        self.stdout.write(line)
+
+    def compare_results(self, results):
+        """Compare p50 latencies with a baseline run and fail on regressions beyond --threshold"""
+        with open(self.options['compare']) as baseline_file:
+            baseline = {
+                (row['dataset'], row['transport'], row['endpoint']): row
+                for row in json.load(baseline_file)['results']
+            }
+        regressions = 0
+        self.stdout.write(f"\nCompared with {self.options['compare']} (p50 now / before):")
+        for result in results:
+            before = baseline.get((result['dataset'], result['transport'], result['endpoint']))
+            if before is None:
+                continue
+            ratio = result['p50_ms'] / max(before['p50_ms'], 1e-9)
+            line = f"  {result['dataset']:>8} {result['transport']:<6} {result['endpoint']:<20} x{ratio:.2f}"
+            if ratio > self.options['threshold']:
+                regressions += 1
+                self.stdout.write(self.style.ERROR(line + '  REGRESSION'))
+            else:
+                self.stdout.write(line)
+        if regressions:
+            raise CommandError(f'{regressions} endpoint(s) regressed by more than x{self.options["threshold"]}')
@@ -0,0 +1,33 @@
+import time
+from django.core.management.base import BaseCommand
+from octofit_tracker import caching, estimation, leaderboard, periods, records, rollups
+
+
+class Command(BaseCommand):
+    help = 'Fill in (or recompute) the calories and distances of stored activities from the estimation tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', dest='recompute_all',
+                            help='Recompute every activity instead of only those missing calories or a distance')
+        parser.add_argument('--batch-size', type=int, default=50000,
+                            help='Activities estimated and written per batch')
+
+    def handle(self, *args, **options):
+        estimation.require_numpy()
+        started = time.perf_counter()
+        scanned, updated = estimation.reestimate(options['recompute_all'], options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Estimated {scanned} activities and updated {updated} in {elapsed:.1f}s '
+            f'({scanned / max(elapsed, 1e-9):,.0f} activities/sec)'
+        ))
+        if not updated:
+            return
+        # Totals changed under the derived collections, so rebuild them from the activities
+        self.stdout.write('Rebuilding daily rollups, leaderboards and user stats...')
+        rollups.rebuild()
+        entry_count = leaderboard.rebuild()
+        periods.rebuild()
+        records.rebuild()
+        caching.invalidate('leaderboard')
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {entry_count} leaderboard entries'))
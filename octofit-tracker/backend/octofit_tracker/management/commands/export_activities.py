@@ -0,0 +1,54 @@
+import sys
+import time
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from octofit_tracker import exports
+
+
+class Command(BaseCommand):
+    help = 'Stream activities as NDJSON or CSV to a file or to stdout'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-format', choices=exports.OUTPUT_CHOICES, default='ndjson',
+                            help='Output format')
+        parser.add_argument('--output', default='-',
+                            help='File to write to; - writes to stdout')
+        parser.add_argument('--user-id', help='Only export activities of this user')
+        parser.add_argument('--team-id', help="Only export activities of this team's members")
+        parser.add_argument('--start', type=date.fromisoformat, help='First date to export (YYYY-MM-DD)')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last date to export (YYYY-MM-DD)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Activities read from the cursor at a time')
+
+    def handle(self, *args, **options):
+        if options['start'] and options['end'] and options['start'] > options['end']:
+            raise CommandError('--start must not be after --end')
+        count = 0
+
+        def counted(rows):
+            nonlocal count
+            for row in rows:
+                count += 1
+                yield row
+
+        started = time.perf_counter()
+        rows = exports.activity_rows(
+            user_id=options['user_id'],
+            team_id=options['team_id'],
+            start=options['start'],
+            end=options['end'],
+            batch_size=options['batch_size'],
+        )
+        chunks = exports.render(options['output_format'], counted(rows))
+        if options['output'] == '-':
+            for chunk in chunks:
+                sys.stdout.write(chunk)
+            sys.stdout.flush()
+        else:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                for chunk in chunks:
+                    output.write(chunk)
+        # Progress goes to stderr so that stdout only carries the export
+        self.stderr.write(self.style.SUCCESS(
+            f'Exported {count} activities in {time.perf_counter() - started:.1f}s'
+        ))
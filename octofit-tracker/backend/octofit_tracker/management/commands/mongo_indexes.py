@@ -0,0 +1,195 @@
+from datetime import datetime
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db.models import UniqueConstraint
+from octofit_tracker.models import User, Activity, DailyActivityRollup, Leaderboard, PeriodLeaderboard, ActivityTypeLeaderboard, UserStats, Job
+from bson import ObjectId
+
+
+# Indexes created as TTL indexes, mapped to their expireAfterSeconds. Their
+# documents are removed once the indexed datetime lies that far in the past.
+TTL_INDEXES = {
+    'period_lb_expiry_idx': 0,
+}
+
+# Indexes created as unique indexes over the documents matching a filter,
+# mapped to their partialFilterExpression. Django cannot declare these on
+# djongo, so they are listed in Meta.indexes as plain indexes.
+PARTIAL_UNIQUE_INDEXES = {
+    'jobs_dedup_pending_uniq': {'dedup_key': {'$type': 'string'}, 'status': {'$in': ['queued', 'running']}},
+}
+
+# Options compared by "verify" and by "create" before it replaces an index
+INDEX_OPTIONS = ('unique', 'expireAfterSeconds', 'partialFilterExpression')
+
+# Query shapes issued by the API, checked by the "report" action. Each entry is
+# (description, model, filter, sort).
+API_QUERIES = [
+    ('GET /api/<collection>/ cursor page', Activity,
+     {'_id': {'$gt': ObjectId()}}, [('_id', 1)]),
+    ('Activities of a user in a date range', Activity,
+     {'user_id': 'user', 'date': {'$gte': datetime(2000, 1, 1)}}, None),
+    ('Activities in a date range', Activity,
+     {'date': {'$gte': datetime(2000, 1, 1)}}, None),
+    ('GET /api/activities/export/', Activity,
+     {}, [('date', 1)]),
+    ('GET /api/activities/export/?start=&end=', Activity,
+     {'month': {'$gte': '2000-01', '$lte': '2000-02'}, 'date': {'$gte': datetime(2000, 1, 1)}}, [('date', 1)]),
+    ('GET /api/activities/export/?team_id=', Activity,
+     {'user_id': {'$in': ['user']}}, [('date', 1)]),
+    ('Activities of a month (archive_activities)', Activity,
+     {'month': '2000-01'}, [('date', 1), ('_id', 1)]),
+    ('Personal bests of a user', Activity,
+     {'user_id': 'user', 'distance': {'$gt': 0}}, None),
+    ('GET /api/users/<id>/stats/', UserStats,
+     {'user_id': 'user'}, None),
+    ('Member counts per team (team list)', User,
+     {'team_id': {'$in': ['team']}}, None),
+    ('GET /api/leaderboard/ cursor page', Leaderboard,
+     {'rank': {'$gt': 0}}, [('rank', 1), ('_id', 1)]),
+    ('GET /api/leaderboard/top/?team_id=', Leaderboard,
+     {'team_id': 'team'}, [('rank', 1), ('_id', 1)]),
+    ('GET /api/leaderboard/around/ window', Leaderboard,
+     {'$or': [{'rank': {'$lt': 1}}, {'rank': 1, '_id': {'$lt': ObjectId()}}]}, [('rank', -1), ('_id', -1)]),
+    ('GET /api/leaderboard/period/ page', PeriodLeaderboard,
+     {'period': 'week', 'period_start': datetime(2000, 1, 3)}, [('rank', 1), ('_id', 1)]),
+    ('Period leaderboard re-rank window', PeriodLeaderboard,
+     {'period': 'week', 'period_start': datetime(2000, 1, 3), 'total_calories': {'$gte': 0, '$lt': 1},
+      'user_id': {'$ne': 'user'}}, None),
+    ('Leaderboard entry of a user', Leaderboard,
+     {'user_id': 'user'}, None),
+    ('Leaderboard re-rank window', Leaderboard,
+     {'total_calories': {'$gte': 0, '$lt': 1}, 'user_id': {'$ne': 'user'}}, None),
+    ('Rollup upsert on activity write', DailyActivityRollup,
+     {'user_id': 'user', 'date': datetime(2000, 1, 1), 'activity_type': 'Running'}, None),
+    ('Rollups of a user (user stats recompute)', DailyActivityRollup,
+     {'user_id': 'user'}, [('date', 1)]),
+    ('Activity counts per user (leaderboard list)', DailyActivityRollup,
+     {'user_id': {'$in': ['user']}}, None),
+    ('GET /api/activities/stats/ for a team', DailyActivityRollup,
+     {'team_id': 'team', 'date': {'$gte': datetime(2000, 1, 1)}}, None),
+    ('GET /api/activities/stats/ for a date range', DailyActivityRollup,
+     {'date': {'$gte': datetime(2000, 1, 1)}}, None),
+    ('GET /api/leaderboard/top/?activity_type=', ActivityTypeLeaderboard,
+     {'activity_type': 'Running'}, [('rank', 1), ('_id', 1)]),
+    ('GET /api/leaderboard/top/?activity_type=&team_id=', ActivityTypeLeaderboard,
+     {'activity_type': 'Running', 'team_id': 'team'}, [('rank', 1), ('_id', 1)]),
+    ('Activity type leaderboard re-rank window', ActivityTypeLeaderboard,
+     {'activity_type': 'Running', 'total_calories': {'$gte': 0, '$lt': 1}, 'user_id': {'$ne': 'user'}}, None),
+    ('Pending job of a dedup key (enqueue)', Job,
+     {'dedup_key': 'leaderboard.rebuild', 'status': {'$in': ['queued', 'running']}}, None),
+]
+
+
+def index_keys(model, index):
+    """Translate a Django index declaration into a list of Mongo index keys"""
+    keys = []
+    for field_name in index.fields:
+        direction = -1 if field_name.startswith('-') else 1
+        column = model._meta.get_field(field_name.lstrip('-')).column
+        keys.append((column, direction))
+    return keys
+
+
+def index_options(index):
+    """Get the Mongo options of a declared index"""
+    options = {}
+    if isinstance(index, UniqueConstraint) or index.name in PARTIAL_UNIQUE_INDEXES:
+        options['unique'] = True
+    if index.name in TTL_INDEXES:
+        options['expireAfterSeconds'] = TTL_INDEXES[index.name]
+    if index.name in PARTIAL_UNIQUE_INDEXES:
+        options['partialFilterExpression'] = PARTIAL_UNIQUE_INDEXES[index.name]
+    return options
+
+
+def index_differences(existing, keys, options):
+    """List what differs between an index from index_information() and a declaration"""
+    differences = []
+    if [tuple(key) for key in existing['key']] != keys:
+        differences.append(f'key {existing["key"]} != {keys}')
+    for name in INDEX_OPTIONS:
+        if existing.get(name) != options.get(name):
+            differences.append(f'{name} {existing.get(name)} != {options.get(name)}')
+    return differences
+
+
+def plan_stages(plan):
+    """Yield the stage names of an explain() plan tree"""
+    yield plan.get('stage')
+    for child in ('inputStage', 'queryPlan'):
+        if child in plan:
+            yield from plan_stages(plan[child])
+    for child in plan.get('inputStages', []):
+        yield from plan_stages(child)
+
+
+class Command(BaseCommand):
+    help = 'Create, verify or drop the MongoDB indexes declared on the octofit models'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['create', 'verify', 'drop', 'report'],
+                            help='create/drop the declared indexes, verify they exist, '
+                                 'or report which API queries still scan whole collections')
+
+    def handle(self, *args, **options):
+        getattr(self, options['action'])()
+
+    def declared_indexes(self):
+        """Yield (model, index) for every Meta.indexes entry and unique constraint"""
+        for model in apps.get_app_config('octofit_tracker').get_models():
+            for index in model._meta.indexes:
+                yield model, index
+            for constraint in model._meta.constraints:
+                if isinstance(constraint, UniqueConstraint):
+                    yield model, constraint
+
+    def create(self):
+        for model, index in self.declared_indexes():
+            keys = index_keys(model, index)
+            options = index_options(index)
+            existing = model.objects.mongo_index_information().get(index.name)
+            if existing is not None and index_differences(existing, keys, options):
+                # migrate creates Meta.indexes without the Mongo-only options above
+                model.objects.mongo_drop_index(index.name)
+            model.objects.mongo_create_index(keys, name=index.name, **options)
+            self.stdout.write(self.style.SUCCESS(f'Created {model._meta.db_table}.{index.name}'))
+
+    def verify(self):
+        missing = 0
+        for model, index in self.declared_indexes():
+            existing = model.objects.mongo_index_information().get(index.name)
+            if existing is None:
+                missing += 1
+                self.stdout.write(self.style.ERROR(f'Missing {model._meta.db_table}.{index.name}'))
+                continue
+            differences = index_differences(existing, index_keys(model, index), index_options(index))
+            if differences:
+                missing += 1
+                self.stdout.write(self.style.ERROR(
+                    f'Mismatched {model._meta.db_table}.{index.name}: {"; ".join(differences)}'
+                ))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'OK {model._meta.db_table}.{index.name}'))
+        if missing:
+            self.stdout.write(self.style.WARNING(f'{missing} index(es) missing; run "mongo_indexes create"'))
+
+    def drop(self):
+        for model, index in self.declared_indexes():
+            if index.name in model.objects.mongo_index_information():
+                model.objects.mongo_drop_index(index.name)
+                self.stdout.write(self.style.WARNING(f'Dropped {model._meta.db_table}.{index.name}'))
+
+    def report(self):
+        scans = 0
+        for description, model, query, sort in API_QUERIES:
+            cursor = model.objects.mongo_find(query)
+            if sort:
+                cursor = cursor.sort(sort)
+            plan = cursor.explain()['queryPlanner']['winningPlan']
+            if 'COLLSCAN' in set(plan_stages(plan)):
+                scans += 1
+                self.stdout.write(self.style.ERROR(f'COLLSCAN  {description} ({model._meta.db_table})'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'IXSCAN    {description} ({model._meta.db_table})'))
+        self.stdout.write(f'{scans} of {len(API_QUERIES)} API queries scan a whole collection')
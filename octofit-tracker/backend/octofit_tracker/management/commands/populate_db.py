@@ -1,24 +1,128 @@
 from django.core.management.base import BaseCommand
-from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
-from datetime import date, timedelta
+from octofit_tracker.models import User, Team, Activity, DailyActivityRollup, Leaderboard, PeriodLeaderboard, ActivityTypeLeaderboard, UserStats, Workout
+from octofit_tracker import archive, caching, leaderboard, periods, records, rollups
+from octofit_tracker.estimation import estimate_calories, estimate_distance
+from octofit_tracker.utils import batches, partition_key
+from datetime import date, datetime, timedelta
 from bson import ObjectId
+import random
+import time
+
+
+WORKOUTS = [
+    {
+        'name': 'Super Soldier Circuit',
+        'description': 'High-intensity circuit training worthy of Captain America',
+        'difficulty': 'Hard',
+        'duration': 45,
+        'calories_estimate': 500,
+        'activity_type': 'CrossFit'
+    },
+    {
+        'name': 'Speedster Sprint',
+        'description': 'Lightning-fast interval training inspired by The Flash',
+        'difficulty': 'Hard',
+        'duration': 30,
+        'calories_estimate': 400,
+        'activity_type': 'Running'
+    },
+    {
+        'name': 'Warrior Yoga',
+        'description': 'Flexibility and strength training fit for Wonder Woman',
+        'difficulty': 'Medium',
+        'duration': 60,
+        'calories_estimate': 300,
+        'activity_type': 'Yoga'
+    },
+    {
+        'name': 'Hulk Smash Weights',
+        'description': 'Heavy lifting program to build incredible strength',
+        'difficulty': 'Hard',
+        'duration': 50,
+        'calories_estimate': 450,
+        'activity_type': 'Weightlifting'
+    },
+    {
+        'name': 'Atlantean Swim',
+        'description': 'Intense swimming workout from the depths of Atlantis',
+        'difficulty': 'Medium',
+        'duration': 40,
+        'calories_estimate': 350,
+        'activity_type': 'Swimming'
+    },
+    {
+        'name': 'Dark Knight Martial Arts',
+        'description': 'Combat training routine from the Batcave',
+        'difficulty': 'Hard',
+        'duration': 55,
+        'calories_estimate': 480,
+        'activity_type': 'Boxing'
+    },
+    {
+        'name': 'Asgardian Endurance',
+        'description': 'Legendary endurance training from the halls of Asgard',
+        'difficulty': 'Hard',
+        'duration': 70,
+        'calories_estimate': 600,
+        'activity_type': 'CrossFit'
+    },
+    {
+        'name': 'Kryptonian Power Cycle',
+        'description': 'High-powered cycling workout with super strength',
+        'difficulty': 'Medium',
+        'duration': 45,
+        'calories_estimate': 400,
+        'activity_type': 'Cycling'
+    },
+]
+
+SYNTHETIC_ACTIVITY_TYPES = ['Running', 'Cycling', 'Swimming', 'Weightlifting', 'Boxing', 'Yoga', 'CrossFit']
 
 
 class Command(BaseCommand):
     help = 'Populate the octofit_db database with test data'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int,
+                            help='Generate N synthetic users instead of the superhero dataset')
+        parser.add_argument('--teams', type=int, default=10,
+                            help='Number of synthetic teams (with --users)')
+        parser.add_argument('--activities-per-user', type=int, default=100,
+                            help='Number of synthetic activities per user (with --users)')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Random seed for the synthetic data (with --users)')
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Documents per insert_many batch (with --users)')
+
     def handle(self, *args, **options):
         self.stdout.write(self.style.WARNING('Deleting existing data...'))
         
         # Delete all existing data
         User.objects.all().delete()
         Team.objects.all().delete()
-        Activity.objects.all().delete()
+        # A raw delete skips the activity signals; the derived collections are cleared below
+        Activity.objects.mongo_delete_many({})
         Leaderboard.objects.all().delete()
         Workout.objects.all().delete()
+        DailyActivityRollup.objects.mongo_delete_many({})
+        PeriodLeaderboard.objects.mongo_delete_many({})
+        ActivityTypeLeaderboard.objects.mongo_delete_many({})
+        UserStats.objects.mongo_delete_many({})
+        archive.clear()
+        caching.invalidate('teams', 'leaderboard', 'workouts')
         
         self.stdout.write(self.style.SUCCESS('Existing data deleted'))
         
+        if options['users'] is not None:
+            self.populate_synthetic(
+                users=options['users'],
+                teams=options['teams'],
+                activities_per_user=options['activities_per_user'],
+                seed=options['seed'],
+                batch_size=options['batch_size'],
+            )
+            return
+        
         # Create teams
         self.stdout.write('Creating teams...')
         team_marvel = Team.objects.create(
@@ -39,31 +143,36 @@ class Command(BaseCommand):
             name='Tony Stark',
             email='ironman@marvel.com',
             password='stark123',
-            team_id=str(team_marvel._id)
+            team_id=str(team_marvel._id),
+            weight=84.0
         )
         captain_america = User.objects.create(
             name='Steve Rogers',
             email='cap@marvel.com',
             password='shield123',
-            team_id=str(team_marvel._id)
+            team_id=str(team_marvel._id),
+            weight=100.0
         )
         thor = User.objects.create(
             name='Thor Odinson',
             email='thor@marvel.com',
             password='asgard123',
-            team_id=str(team_marvel._id)
+            team_id=str(team_marvel._id),
+            weight=132.0
         )
         black_widow = User.objects.create(
             name='Natasha Romanoff',
             email='blackwidow@marvel.com',
             password='widow123',
-            team_id=str(team_marvel._id)
+            team_id=str(team_marvel._id),
+            weight=59.0
         )
         hulk = User.objects.create(
             name='Bruce Banner',
             email='hulk@marvel.com',
             password='smash123',
-            team_id=str(team_marvel._id)
+            team_id=str(team_marvel._id),
+            weight=80.0
         )
         
         # Team DC heroes
@@ -71,36 +180,42 @@ class Command(BaseCommand):
             name='Clark Kent',
             email='superman@dc.com',
             password='krypton123',
-            team_id=str(team_dc._id)
+            team_id=str(team_dc._id),
+            weight=107.0
         )
         batman = User.objects.create(
             name='Bruce Wayne',
             email='batman@dc.com',
             password='gotham123',
-            team_id=str(team_dc._id)
+            team_id=str(team_dc._id),
+            weight=95.0
         )
         wonder_woman = User.objects.create(
             name='Diana Prince',
             email='wonderwoman@dc.com',
             password='themyscira123',
-            team_id=str(team_dc._id)
+            team_id=str(team_dc._id),
+            weight=75.0
         )
         flash = User.objects.create(
             name='Barry Allen',
             email='flash@dc.com',
             password='speedforce123',
-            team_id=str(team_dc._id)
+            team_id=str(team_dc._id),
+            weight=80.0
         )
         aquaman = User.objects.create(
             name='Arthur Curry',
             email='aquaman@dc.com',
             password='atlantis123',
-            team_id=str(team_dc._id)
+            team_id=str(team_dc._id),
+            weight=147.0
         )
         
         marvel_heroes = [iron_man, captain_america, thor, black_widow, hulk]
         dc_heroes = [superman, batman, wonder_woman, flash, aquaman]
         all_heroes = marvel_heroes + dc_heroes
+        team_names = {str(team._id): team.name for team in (team_marvel, team_dc)}
         
         self.stdout.write(self.style.SUCCESS(f'Created {len(all_heroes)} users'))
         
@@ -115,134 +230,30 @@ class Command(BaseCommand):
             for j in range(num_activities):
                 activity_type = activity_types[j % len(activity_types)]
                 duration = 30 + (j * 15) + (i * 5)
-                calories = duration * 8 + (i * 20)
                 days_ago = j + (i * 2)
                 
-                # Calculate distance based on activity type
-                if activity_type in ['Running', 'Cycling']:
-                    distance = (duration / 60) * (15 if activity_type == 'Cycling' else 8)  # km per hour average
-                elif activity_type == 'Swimming':
-                    distance = (duration / 60) * 2.5  # km per hour average for swimming
-                else:
-                    distance = 0.0
-                
                 Activity.objects.create(
                     user_id=str(hero._id),
+                    user_name=hero.name,
+                    team_name=team_names[hero.team_id],
                     activity_type=activity_type,
                     duration=duration,
-                    distance=round(distance, 2),
-                    calories_burned=calories,
+                    distance=estimate_distance(activity_type, duration),
+                    calories_burned=estimate_calories(activity_type, duration, hero.weight),
                     date=date.today() - timedelta(days=days_ago),
                     notes=f'{hero.name} crushing {activity_type}!'
                 )
                 activity_count += 1
         
+        # The daily rollups, leaderboards and user stats followed each save
         self.stdout.write(self.style.SUCCESS(f'Created {activity_count} activities'))
         
         # Create workouts
         self.stdout.write('Creating workouts...')
-        workouts_data = [
-            {
-                'name': 'Super Soldier Circuit',
-                'description': 'High-intensity circuit training worthy of Captain America',
-                'difficulty': 'Hard',
-                'duration': 45,
-                'calories_estimate': 500,
-                'activity_type': 'CrossFit'
-            },
-            {
-                'name': 'Speedster Sprint',
-                'description': 'Lightning-fast interval training inspired by The Flash',
-                'difficulty': 'Hard',
-                'duration': 30,
-                'calories_estimate': 400,
-                'activity_type': 'Running'
-            },
-            {
-                'name': 'Warrior Yoga',
-                'description': 'Flexibility and strength training fit for Wonder Woman',
-                'difficulty': 'Medium',
-                'duration': 60,
-                'calories_estimate': 300,
-                'activity_type': 'Yoga'
-            },
-            {
-                'name': 'Hulk Smash Weights',
-                'description': 'Heavy lifting program to build incredible strength',
-                'difficulty': 'Hard',
-                'duration': 50,
-                'calories_estimate': 450,
-                'activity_type': 'Weightlifting'
-            },
-            {
-                'name': 'Atlantean Swim',
-                'description': 'Intense swimming workout from the depths of Atlantis',
-                'difficulty': 'Medium',
-                'duration': 40,
-                'calories_estimate': 350,
-                'activity_type': 'Swimming'
-            },
-            {
-                'name': 'Dark Knight Martial Arts',
-                'description': 'Combat training routine from the Batcave',
-                'difficulty': 'Hard',
-                'duration': 55,
-                'calories_estimate': 480,
-                'activity_type': 'Boxing'
-            },
-            {
-                'name': 'Asgardian Endurance',
-                'description': 'Legendary endurance training from the halls of Asgard',
-                'difficulty': 'Hard',
-                'duration': 70,
-                'calories_estimate': 600,
-                'activity_type': 'CrossFit'
-            },
-            {
-                'name': 'Kryptonian Power Cycle',
-                'description': 'High-powered cycling workout with super strength',
-                'difficulty': 'Medium',
-                'duration': 45,
-                'calories_estimate': 400,
-                'activity_type': 'Cycling'
-            },
-        ]
-        
-        for workout_data in workouts_data:
+        for workout_data in WORKOUTS:
             Workout.objects.create(**workout_data)
         
-        self.stdout.write(self.style.SUCCESS(f'Created {len(workouts_data)} workouts'))
-        
-        # Calculate and create leaderboard entries
-        self.stdout.write('Creating leaderboard entries...')
-        leaderboard_data = []
-        
-        for hero in all_heroes:
-            activities = Activity.objects.filter(user_id=str(hero._id))
-            total_calories = sum(activity.calories_burned for activity in activities)
-            total_duration = sum(activity.duration for activity in activities)
-            
-            leaderboard_data.append({
-                'user_id': str(hero._id),
-                'team_id': hero.team_id,
-                'total_calories': total_calories,
-                'total_duration': total_duration,
-                'hero': hero
-            })
-        
-        # Sort by total calories (descending) and assign ranks
-        leaderboard_data.sort(key=lambda x: x['total_calories'], reverse=True)
-        
-        for rank, data in enumerate(leaderboard_data, start=1):
-            Leaderboard.objects.create(
-                user_id=data['user_id'],
-                team_id=data['team_id'],
-                total_calories=data['total_calories'],
-                total_duration=data['total_duration'],
-                rank=rank
-            )
-        
-        self.stdout.write(self.style.SUCCESS(f'Created {len(leaderboard_data)} leaderboard entries'))
+        self.stdout.write(self.style.SUCCESS(f'Created {len(WORKOUTS)} workouts'))
         
         # Print summary
         self.stdout.write(self.style.SUCCESS('\n=== Database Population Complete ==='))
@@ -260,3 +271,93 @@ class Command(BaseCommand):
             self.stdout.write(
                 f'{entry.rank}. {hero.name} - {entry.total_calories} calories, {entry.total_duration} minutes'
             )
+
+    def insert(self, model, documents, batch_size):
+        """Insert documents into the model's collection in batches and return the count"""
+        count = 0
+        for batch in batches(documents, batch_size):
+            model.objects.mongo_insert_many(batch, ordered=False)
+            count += len(batch)
+        return count
+
+    def populate_synthetic(self, users, teams, activities_per_user, seed, batch_size):
+        """Generate a deterministic synthetic dataset with batched inserts"""
+        rng = random.Random(seed)
+        started = time.perf_counter()
+        # djongo stores datetimes as naive UTC and dates as naive UTC midnights
+        now = datetime.utcnow()
+        today = datetime.combine(date.today(), datetime.min.time())
+        document_count = 0
+
+        self.stdout.write(f'Creating {teams} teams and {users} users...')
+        team_ids = [str(ObjectId()) for _ in range(teams)]
+        document_count += self.insert(Team, (
+            {'_id': ObjectId(team_id), 'name': f'Team {i + 1}',
+             'description': f'Synthetic team {i + 1}', 'created_at': now}
+            for i, team_id in enumerate(team_ids)
+        ), batch_size)
+        team_names = {team_id: f'Team {i + 1}' for i, team_id in enumerate(team_ids)}
+        user_teams = {str(ObjectId()): rng.choice(team_ids) if team_ids else None for _ in range(users)}
+        user_names = {user_id: f'Athlete {i + 1}' for i, user_id in enumerate(user_teams)}
+        user_weights = {user_id: round(rng.uniform(50, 100), 1) for user_id in user_teams}
+        document_count += self.insert(User, (
+            {'_id': ObjectId(user_id), 'name': user_names[user_id],
+             'email': f'athlete{i + 1}@octofit.test', 'password': 'synthetic',
+             'team_id': team_id, 'weight': user_weights[user_id], 'created_at': now}
+            for i, (user_id, team_id) in enumerate(user_teams.items())
+        ), batch_size)
+
+        self.stdout.write(f'Creating {users * activities_per_user} activities...')
+        totals = {user_id: [0, 0] for user_id in user_teams}
+
+        def activities():
+            for user_id, user_totals in totals.items():
+                for _ in range(activities_per_user):
+                    activity_type = rng.choice(SYNTHETIC_ACTIVITY_TYPES)
+                    duration = rng.randint(15, 120)
+                    day = today - timedelta(days=rng.randrange(365))
+                    calories = estimate_calories(activity_type, duration, user_weights[user_id])
+                    user_totals[0] += calories
+                    user_totals[1] += duration
+                    yield {
+                        '_id': ObjectId(),
+                        'user_id': user_id,
+                        'user_name': user_names[user_id],
+                        'team_name': team_names.get(user_teams[user_id]),
+                        'activity_type': activity_type,
+                        'duration': duration,
+                        'distance': estimate_distance(activity_type, duration),
+                        'calories_burned': calories,
+                        'date': day,
+                        'notes': None,
+                        'month': partition_key(day),
+                        'created_at': now,
+                    }
+
+        document_count += self.insert(Activity, activities(), batch_size)
+        self.stdout.write('Building daily rollups...')
+        document_count += rollups.rebuild(batch_size=batch_size)
+
+        self.stdout.write('Creating workouts and leaderboard entries...')
+        document_count += self.insert(Workout, (
+            dict(workout, _id=ObjectId(), created_at=now) for workout in WORKOUTS
+        ), batch_size)
+
+        ranked = sorted(((calories, user_id) for user_id, (calories, _) in totals.items()), reverse=True)
+        document_count += self.insert(Leaderboard, (
+            {'_id': ObjectId(), 'user_id': user_id, 'team_id': user_teams[user_id] or '',
+             'user_name': user_names[user_id], 'team_name': team_names.get(user_teams[user_id]),
+             'total_calories': totals[user_id][0], 'total_duration': totals[user_id][1],
+             'rank': rank, 'updated_at': now}
+            for rank, user_id in leaderboard.competition_ranks(ranked)
+        ), batch_size)
+        document_count += leaderboard.rebuild_activity_types()
+        self.stdout.write('Building period leaderboards...')
+        document_count += periods.rebuild()
+        self.stdout.write('Building user stats...')
+        document_count += records.rebuild(batch_size=batch_size)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS('\n=== Synthetic Population Complete ==='))
+        self.stdout.write(f'Documents: {document_count} in {elapsed:.1f}s '
+                          f'({document_count / max(elapsed, 1e-9):,.0f} docs/sec)')
@@ -0,0 +1,31 @@
+import time
+from django.core.management.base import BaseCommand
+from octofit_tracker import leaderboard, periods, records, rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily activity rollups (and optionally the leaderboard) from raw activities'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Rollup documents per insert_many batch')
+        parser.add_argument('--with-leaderboard', action='store_true',
+                            help='Rebuild the all-time and period leaderboards from the new rollups afterwards')
+        parser.add_argument('--with-user-stats', action='store_true',
+                            help='Rebuild the streaks, personal bests and weekly totals of every user afterwards')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        self.stdout.write('Rebuilding daily activity rollups...')
+        count = rollups.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {count} rollups in {time.perf_counter() - started:.1f}s'
+        ))
+        if options['with_leaderboard']:
+            entry_count = leaderboard.rebuild()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {entry_count} leaderboard entries'))
+            entry_count = periods.rebuild()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {entry_count} period leaderboard entries'))
+        if options['with_user_stats']:
+            stats_count = records.rebuild()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt the stats of {stats_count} users'))
@@ -0,0 +1,50 @@
+import json
+import sys
+import time
+from django.core.management.base import BaseCommand
+from octofit_tracker import recommendations
+from octofit_tracker.models import User
+from octofit_tracker.utils import batches
+
+
+class Command(BaseCommand):
+    help = 'Score the workout catalog for many users at once and write their top workouts as NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', action='append', dest='user_ids',
+                            help='Only recommend for this user (repeatable); every user by default')
+        parser.add_argument('--limit', type=int, default=5,
+                            help='Workouts per user')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Users profiled and scored at a time')
+        parser.add_argument('--output', default='-',
+                            help='File to write to; - writes to stdout')
+
+    def handle(self, *args, **options):
+        recommendations.require_numpy()
+        if options['user_ids']:
+            user_ids = iter(options['user_ids'])
+        else:
+            user_ids = (str(user['_id']) for user in User.objects.mongo_find({}, {'_id': 1}).sort('_id', 1))
+
+        started = time.perf_counter()
+        count = 0
+        output = sys.stdout if options['output'] == '-' else open(options['output'], 'w', encoding='utf-8')
+        try:
+            for batch in batches(user_ids, options['batch_size']):
+                ranked = recommendations.recommend(batch, options['limit'])
+                output.write(''.join(
+                    json.dumps({
+                        'user_id': user_id,
+                        'workouts': [{'_id': str(workout_id), 'score': round(score, 4)} for workout_id, score in ranked[user_id]],
+                    }) + '\n'
+                    for user_id in batch
+                ))
+                count += len(batch)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        # Progress goes to stderr so that stdout only carries the recommendations
+        self.stderr.write(self.style.SUCCESS(
+            f'Recommended workouts for {count} users in {time.perf_counter() - started:.1f}s'
+        ))
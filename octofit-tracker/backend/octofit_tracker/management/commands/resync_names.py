@@ -0,0 +1,20 @@
+import time
+from django.core.management.base import BaseCommand
+from octofit_tracker import caching, denormalization
+
+
+class Command(BaseCommand):
+    help = 'Rewrite the user and team name snapshots stored on activities and leaderboard entries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Users per bulk_write batch')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        self.stdout.write('Resyncing name snapshots...')
+        count = denormalization.resync(batch_size=options['batch_size'])
+        caching.invalidate('leaderboard')
+        self.stdout.write(self.style.SUCCESS(
+            f'Resynced the documents of {count} users in {time.perf_counter() - started:.1f}s'
+        ))
@@ -0,0 +1,35 @@
+import time
+from django.core.management.base import BaseCommand
+from octofit_tracker import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (for deployments with OCTOFIT_JOBS_IN_PROCESS off)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Run the jobs that are due now and exit')
+        parser.add_argument('--poll-interval', type=float, default=2,
+                            help='Seconds to wait between polls when the queue is empty')
+        parser.add_argument('--stale-after', type=float, default=3600,
+                            help='Requeue jobs that have been running for this many seconds')
+        parser.add_argument('--rerank-every', type=float, default=300,
+                            help='Queue a leaderboard.rerank job this often (seconds; 0 disables it) to repair '
+                                 'ranks left off by concurrent updates from several processes')
+
+    def handle(self, *args, **options):
+        next_rerank = time.monotonic() + options['rerank_every']
+        while True:
+            if options['rerank_every'] and time.monotonic() >= next_rerank:
+                jobs.enqueue('leaderboard.rerank')
+                next_rerank = time.monotonic() + options['rerank_every']
+            requeued = jobs.requeue_stale(options['stale_after'])
+            if requeued:
+                self.stdout.write(self.style.WARNING(f'Requeued {requeued} abandoned job(s)'))
+            count = jobs.run_pending()
+            if count:
+                self.stdout.write(self.style.SUCCESS(f'Ran {count} job(s)'))
+            if options['once']:
+                return
+            if not count:
+                time.sleep(options['poll_interval'])
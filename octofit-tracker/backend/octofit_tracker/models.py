@@ -1,4 +1,6 @@
+from django.utils import timezone
 from djongo import models
+from .utils import partition_key
 
 
 class User(models.Model):
@@ -7,10 +9,16 @@ class User(models.Model):
     email = models.EmailField(unique=True)
     password = models.CharField(max_length=255)
     team_id = models.CharField(max_length=100, null=True, blank=True)
+    weight = models.FloatField(null=True, blank=True)  # in kilograms, used to estimate calories
     created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = models.DjongoManager()
     
     class Meta:
         db_table = 'users'
+        indexes = [
+            models.Index(fields=['team_id'], name='users_team_id_idx'),
+        ]
     
     def __str__(self):
         return self.name
@@ -21,6 +29,8 @@ class Team(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = models.DjongoManager()
     
     class Meta:
         db_table = 'teams'
@@ -32,37 +42,205 @@ class Team(models.Model):
 class Activity(models.Model):
     _id = models.ObjectIdField()
     user_id = models.CharField(max_length=100)
+    # Snapshots of the owner's names, kept in sync by octofit_tracker.denormalization
+    user_name = models.CharField(max_length=100, null=True, blank=True)
+    team_name = models.CharField(max_length=100, null=True, blank=True)
     activity_type = models.CharField(max_length=50)
     duration = models.IntegerField()  # in minutes
     distance = models.FloatField(default=0.0)  # in kilometers
     calories_burned = models.IntegerField()
     date = models.DateField()
     notes = models.TextField(null=True, blank=True)
+    # Partition key, the month of date. Date-bounded reads select months through it and months
+    # past the retention window are moved to octofit_tracker.archive
+    month = models.CharField(max_length=7, editable=False, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = models.DjongoManager()
     
     class Meta:
         db_table = 'activities'
+        indexes = [
+            models.Index(fields=['user_id', 'date'], name='activities_user_date_idx'),
+            models.Index(fields=['date'], name='activities_date_idx'),
+            models.Index(fields=['month', 'date', '_id'], name='activities_month_date_idx'),
+        ]
     
     def __str__(self):
         return f"{self.activity_type} - {self.duration} mins"
+    
+    def save(self, *args, **kwargs):
+        # date may still be an ISO string or a datetime when not set through a serializer
+        self.date = self._meta.get_field('date').to_python(self.date)
+        self.month = partition_key(self.date)
+        super().save(*args, **kwargs)
+
+
+class DailyActivityRollup(models.Model):
+    """Activity totals per user, day and activity type, maintained on every activity write"""
+    _id = models.ObjectIdField()
+    user_id = models.CharField(max_length=100)
+    team_id = models.CharField(max_length=100, null=True, blank=True)
+    date = models.DateField()
+    activity_type = models.CharField(max_length=50)
+    count = models.IntegerField(default=0)
+    duration = models.IntegerField(default=0)  # in minutes
+    distance = models.FloatField(default=0.0)  # in kilometers
+    calories = models.IntegerField(default=0)
+
+    objects = models.DjongoManager()
+    
+    class Meta:
+        db_table = 'daily_activity_rollup'
+        constraints = [
+            models.UniqueConstraint(fields=['user_id', 'date', 'activity_type'], name='rollup_user_date_type_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['date'], name='rollup_date_idx'),
+            models.Index(fields=['team_id', 'date'], name='rollup_team_date_idx'),
+            models.Index(fields=['activity_type', 'team_id'], name='rollup_type_team_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.date} {self.activity_type} - {self.count} activities"
 
 
 class Leaderboard(models.Model):
     _id = models.ObjectIdField()
     user_id = models.CharField(max_length=100)
     team_id = models.CharField(max_length=100)
+    # Snapshots of the user and team names, kept in sync by octofit_tracker.denormalization
+    user_name = models.CharField(max_length=100, null=True, blank=True)
+    team_name = models.CharField(max_length=100, null=True, blank=True)
     total_calories = models.IntegerField()
     total_duration = models.IntegerField()  # in minutes
     rank = models.IntegerField()
     updated_at = models.DateTimeField(auto_now=True)
+
+    objects = models.DjongoManager()
     
     class Meta:
         db_table = 'leaderboard'
+        indexes = [
+            models.Index(fields=['rank'], name='leaderboard_rank_idx'),
+            models.Index(fields=['total_calories'], name='leaderboard_calories_idx'),
+            models.Index(fields=['team_id', 'rank'], name='leaderboard_team_rank_idx'),
+        ]
+        constraints = [
+            # Lets concurrent upserts of a user's first entry fail instead of creating two
+            models.UniqueConstraint(fields=['user_id'], name='leaderboard_user_uniq'),
+        ]
     
     def __str__(self):
         return f"Rank {self.rank} - {self.total_calories} calories"
 
 
+class PeriodLeaderboard(models.Model):
+    """Leaderboard of one day, week or month, maintained on every activity write
+
+    Windows are keyed by (period, period_start) so a new period starts a new
+    ranking by itself; expires_at drives a TTL index that drops old windows.
+    """
+    PERIOD_CHOICES = [('day', 'Day'), ('week', 'Week'), ('month', 'Month')]
+
+    _id = models.ObjectIdField()
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES)
+    period_start = models.DateField()
+    user_id = models.CharField(max_length=100)
+    team_id = models.CharField(max_length=100)
+    user_name = models.CharField(max_length=100, null=True, blank=True)
+    team_name = models.CharField(max_length=100, null=True, blank=True)
+    total_calories = models.IntegerField()
+    total_duration = models.IntegerField()  # in minutes
+    rank = models.IntegerField()
+    expires_at = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = models.DjongoManager()
+    
+    class Meta:
+        db_table = 'period_leaderboard'
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'period_start', 'user_id'], name='period_lb_user_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['period', 'period_start', 'rank'], name='period_lb_rank_idx'),
+            models.Index(fields=['period', 'period_start', 'total_calories'], name='period_lb_calories_idx'),
+            models.Index(fields=['expires_at'], name='period_lb_expiry_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.period} of {self.period_start}: rank {self.rank} - {self.total_calories} calories"
+
+
+class ActivityTypeLeaderboard(models.Model):
+    """Leaderboard of one activity type, maintained on every activity write
+
+    Entries are keyed by (activity_type, user_id) and ranked within their
+    activity type like the all-time leaderboard.
+    """
+    _id = models.ObjectIdField()
+    activity_type = models.CharField(max_length=50)
+    user_id = models.CharField(max_length=100)
+    team_id = models.CharField(max_length=100)
+    user_name = models.CharField(max_length=100, null=True, blank=True)
+    team_name = models.CharField(max_length=100, null=True, blank=True)
+    total_calories = models.IntegerField()
+    total_duration = models.IntegerField()  # in minutes
+    total_activities = models.IntegerField(default=0)
+    rank = models.IntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = models.DjongoManager()
+    
+    class Meta:
+        db_table = 'activity_type_leaderboard'
+        constraints = [
+            models.UniqueConstraint(fields=['activity_type', 'user_id'], name='type_lb_user_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['activity_type', 'rank'], name='type_lb_rank_idx'),
+            models.Index(fields=['activity_type', 'total_calories'], name='type_lb_calories_idx'),
+            models.Index(fields=['activity_type', 'team_id', 'rank'], name='type_lb_team_rank_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.activity_type}: rank {self.rank} - {self.total_calories} calories"
+
+
+class UserStats(models.Model):
+    """Streaks, personal bests and recent weekly totals of one user, maintained on every activity write
+
+    current_streak is the run of consecutive active days ending on
+    last_active_date; readers treat it as broken once a whole day has passed
+    without activity. personal_bests maps an activity type to its best
+    distance and calories_burned ({value, activity_id, date}); weekly_totals
+    maps ISO weeks (2024-W09) to count, duration, distance and calories.
+    """
+    _id = models.ObjectIdField()
+    user_id = models.CharField(max_length=100)
+    current_streak = models.IntegerField(default=0)
+    longest_streak = models.IntegerField(default=0)
+    last_active_date = models.DateField(null=True, blank=True)
+    personal_bests = models.JSONField(default=dict)
+    weekly_totals = models.JSONField(default=dict)
+    # Incremented by every write of octofit_tracker.records, which only writes over the version it read
+    version = models.IntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = models.DjongoManager()
+    
+    class Meta:
+        db_table = 'user_stats'
+        verbose_name_plural = 'user stats'
+        constraints = [
+            models.UniqueConstraint(fields=['user_id'], name='user_stats_user_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id}: streak {self.current_streak}, longest {self.longest_streak}"
+
+
 class Workout(models.Model):
     _id = models.ObjectIdField()
     name = models.CharField(max_length=100)
@@ -72,9 +250,50 @@ class Workout(models.Model):
     calories_estimate = models.IntegerField()
     activity_type = models.CharField(max_length=50)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = models.DjongoManager()
     
     class Meta:
         db_table = 'workouts'
     
     def __str__(self):
         return self.name
+
+
+class Job(models.Model):
+    """A unit of background work run by octofit_tracker.jobs"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+
+    _id = models.ObjectIdField()
+    kind = models.CharField(max_length=100)
+    params = models.JSONField(default=dict)
+    dedup_key = models.CharField(max_length=200, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    # djongo cannot save a null JSONField, so a job without a result has an empty one
+    result = models.JSONField(default=dict, blank=True)
+    error = models.TextField(null=True, blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    objects = models.DjongoManager()
+    
+    class Meta:
+        db_table = 'jobs'
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='jobs_due_idx'),
+            models.Index(fields=['dedup_key', 'status'], name='jobs_dedup_idx'),
+            # Unique among pending jobs only, see mongo_indexes.PARTIAL_UNIQUE_INDEXES
+            models.Index(fields=['dedup_key'], name='jobs_dedup_pending_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} ({self.status})"
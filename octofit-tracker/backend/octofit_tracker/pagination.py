@@ -0,0 +1,36 @@
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+
+
+class ObjectIdCursorPagination(CursorPagination):
+    """Keyset pagination on the ObjectId primary key, which increases with insertion time"""
+    ordering = '_id'
+    page_size_query_param = 'page_size'
+    max_page_size = settings.OCTOFIT_MAX_PAGE_SIZE
+    
+    def decode_cursor(self, request):
+        """Decode the cursor and convert its position back to the ordering field's type"""
+        cursor = super().decode_cursor(request)
+        if cursor is None or cursor.position is None:
+            return cursor
+        return cursor._replace(position=self.parse_position(cursor.position))
+    
+    def parse_position(self, position):
+        try:
+            return ObjectId(position)
+        except (InvalidId, TypeError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class RankCursorPagination(ObjectIdCursorPagination):
+    """Keyset pagination on the leaderboard rank"""
+    ordering = ('rank', '_id')
+    
+    def parse_position(self, position):
+        try:
+            return int(position)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
@@ -0,0 +1,119 @@
+from datetime import date, datetime, time, timedelta, timezone
+from bson import ObjectId
+from django.conf import settings
+from . import leaderboard
+from .lookups import user_snapshots
+from .models import DailyActivityRollup, PeriodLeaderboard
+
+
+# Day, week and month leaderboards. Every activity counts towards the windows
+# that contain its date, so windows roll over by themselves when a new period
+# starts. Each window gets an expires_at once it is first written, and the TTL
+# index on that field drops it after OCTOFIT_PERIOD_LEADERBOARD_RETENTION newer
+# windows of the same period have started. Writes to windows that are already
+# expired are ignored so they are not brought back.
+
+PERIODS = [period for period, _ in PeriodLeaderboard.PERIOD_CHOICES]
+
+
+def period_start(period, day):
+    """Get the first day of the period containing day (weeks start on Monday)"""
+    if period == 'day':
+        return day
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def shift(period, start, count):
+    """Get the start of the period count periods after start (before it if count is negative)"""
+    if period == 'day':
+        return start + timedelta(days=count)
+    if period == 'week':
+        return start + timedelta(weeks=count)
+    months = start.year * 12 + start.month - 1 + count
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def expires_at(period, start):
+    retention = settings.OCTOFIT_PERIOD_LEADERBOARD_RETENTION[period]
+    return datetime.combine(shift(period, start, retention + 1), time.min, tzinfo=timezone.utc)
+
+
+def oldest_start(period, today=None):
+    """Get the start of the oldest window of a period that is still kept"""
+    current = period_start(period, today or datetime.utcnow().date())
+    return shift(period, current, -settings.OCTOFIT_PERIOD_LEADERBOARD_RETENTION[period])
+
+
+def apply_activity_changes(added=(), removed=()):
+    """Update the period leaderboards for activities that were added and/or removed"""
+    deltas = {}
+    for activities, sign in ((added, 1), (removed, -1)):
+        for activity in activities:
+            for period in PERIODS:
+                key = (period, period_start(period, activity.date), activity.user_id)
+                calories, duration = deltas.get(key, (0, 0))
+                deltas[key] = (
+                    calories + sign * activity.calories_burned,
+                    duration + sign * activity.duration,
+                )
+    now = datetime.now(timezone.utc)
+    with leaderboard.lock:
+        for (period, start, user_id), (calories, duration) in deltas.items():
+            expiry = expires_at(period, start)
+            if (calories or duration) and expiry > now:
+                leaderboard.update_ranked_entry(
+                    PeriodLeaderboard, {'period': period, 'period_start': start},
+                    user_id, calories, duration, defaults={'expires_at': expiry},
+                )
+
+
+def rerank():
+    """Repair the ranks of every period window; return how many were fixed"""
+    windows = PeriodLeaderboard.objects.mongo_aggregate([
+        {'$group': {'_id': {'period': '$period', 'period_start': '$period_start'}}},
+    ])
+    return sum(leaderboard.rerank(PeriodLeaderboard, window['_id']) for window in windows)
+
+
+def rebuild():
+    """Recompute every kept period window from the daily activity rollups"""
+    oldest = {period: oldest_start(period) for period in PERIODS}
+    totals = {}
+    rollups = DailyActivityRollup.objects.mongo_find(
+        {'date': {'$gte': datetime.combine(min(oldest.values()), time.min)}},
+        {'user_id': 1, 'date': 1, 'calories': 1, 'duration': 1},
+    )
+    for rollup in rollups:
+        day = rollup['date'].date()
+        for period in PERIODS:
+            start = period_start(period, day)
+            if start < oldest[period]:
+                continue
+            window = totals.setdefault((period, start), {})
+            calories, duration = window.get(rollup['user_id'], (0, 0))
+            window[rollup['user_id']] = (calories + rollup['calories'], duration + rollup['duration'])
+
+    snapshots = user_snapshots({user_id for window in totals.values() for user_id in window})
+    entries = []
+    for (period, start), window in totals.items():
+        ranked = sorted(window.items(), key=lambda item: item[1][0], reverse=True)
+        pairs = ((calories, (user_id, calories, duration)) for user_id, (calories, duration) in ranked)
+        for rank, (user_id, calories, duration) in leaderboard.competition_ranks(pairs):
+            entries.append(PeriodLeaderboard(
+                _id=ObjectId(),
+                period=period,
+                period_start=start,
+                user_id=user_id,
+                **snapshots.get(user_id, {'team_id': ''}),
+                total_calories=calories,
+                total_duration=duration,
+                rank=rank,
+                expires_at=expires_at(period, start),
+            ))
+
+    with leaderboard.lock:
+        PeriodLeaderboard.objects.mongo_delete_many({})
+        PeriodLeaderboard.objects.bulk_create(entries, batch_size=1000)
+    return len(entries)
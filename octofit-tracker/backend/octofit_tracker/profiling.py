@@ -0,0 +1,226 @@
+import asyncio
+import contextvars
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from django.conf import settings
+from pymongo import monitoring
+from .utils import percentile
+
+
+# Per-request profiling. A sampled request gets a RequestProfile in a context
+# variable; a pymongo command listener adds every command the request issues
+# to it (djongo and the pymongo repositories share the driver, so both are
+# counted). Serializers and the native repositories time building the response
+# data with serializing(), less the queries run meanwhile, and the middleware
+# times rendering it to JSON. The middleware reports the totals in a
+# Server-Timing header and keeps the last OCTOFIT_PROFILING_WINDOW samples per
+# route in memory for /api/_metrics. Metrics are per process.
+#
+# Requests that are not sampled only pay for one random() call, and commands
+# outside a sampled request for one context variable lookup. Motor runs
+# commands on executor threads without the request context, so the async
+# views report their latency and size but not their queries.
+
+_current_profile = contextvars.ContextVar('octofit_request_profile', default=None)
+
+METRICS = ('latency_ms', 'db_ms', 'queries', 'serialize_ms', 'render_ms', 'response_bytes')
+
+_samples = defaultdict(lambda: deque(maxlen=settings.OCTOFIT_PROFILING_WINDOW))
+_samples_lock = threading.Lock()
+
+
+class RequestProfile:
+    __slots__ = ('started', 'queries', 'db_time', 'serializing', 'serialize_time', 'render_started', 'render_time',
+                 'response_bytes')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializing = False
+        self.serialize_time = 0.0
+        self.render_started = None
+        self.render_time = 0.0
+        self.response_bytes = 0
+
+    def elapsed(self):
+        return (time.perf_counter() - self.started) * 1000
+
+
+class QueryListener(monitoring.CommandListener):
+    """Adds the duration of every Mongo command to the profile of the current request"""
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.record(event)
+
+    def failed(self, event):
+        self.record(event)
+
+    def record(self, event):
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.queries += 1
+            profile.db_time += event.duration_micros / 1000
+
+
+def register_listener():
+    """Register the query listener; it only applies to clients created afterwards"""
+    monitoring.register(QueryListener())
+
+
+@contextmanager
+def serializing():
+    """Add the time spent in the block, less its queries, to the serialization time of the current request
+
+    Nested blocks only count once.
+    """
+    profile = _current_profile.get()
+    if profile is None or profile.serializing:
+        yield
+        return
+    profile.serializing = True
+    started = time.perf_counter()
+    db_time = profile.db_time
+    try:
+        yield
+    finally:
+        profile.serializing = False
+        profile.serialize_time += (time.perf_counter() - started) * 1000 - (profile.db_time - db_time)
+
+
+def route_name(request):
+    match = request.resolver_match
+    return f'{request.method} {match.view_name if match else "unmatched"}'
+
+
+def record(route, profile, latency):
+    with _samples_lock:
+        _samples[route].append(
+            (latency, profile.db_time, profile.queries, profile.serialize_time, profile.render_time,
+             profile.response_bytes)
+        )
+
+
+def metrics():
+    """Summarize the recorded samples as p50/p95/p99 of every metric per route"""
+    with _samples_lock:
+        samples = {route: list(route_samples) for route, route_samples in _samples.items()}
+    return {
+        route: {
+            'count': len(rows),
+            **{
+                metric: {
+                    f'p{int(fraction * 100)}': round(percentile(values, fraction), 2)
+                    for fraction in (0.5, 0.95, 0.99)
+                }
+                for metric, values in zip(METRICS, zip(*rows))
+            },
+        }
+        for route, rows in sorted(samples.items())
+    }
+
+
+def reset():
+    with _samples_lock:
+        _samples.clear()
+
+
+def server_timing(profile, latency):
+    return (
+        f'db;dur={profile.db_time:.2f};desc="{profile.queries} queries", '
+        f'serialize;dur={profile.serialize_time:.2f}, '
+        f'render;dur={profile.render_time:.2f}, '
+        f'total;dur={latency:.2f}'
+    )
+
+
+def _start(request):
+    if random.random() >= settings.OCTOFIT_PROFILING_SAMPLE_RATE:
+        return None, None
+    profile = RequestProfile()
+    return profile, _current_profile.set(profile)
+
+
+def _finish(request, response, profile):
+    route = route_name(request)
+    if not response.streaming:
+        profile.response_bytes = len(response.content)
+        latency = profile.elapsed()
+        response['Server-Timing'] = server_timing(profile, latency)
+        record(route, profile, latency)
+        return response
+    # The header goes out before the body, so it covers the time to the first byte;
+    # the recorded sample covers the whole stream.
+    response['Server-Timing'] = server_timing(profile, profile.elapsed())
+    response.streaming_content = _profiled_stream(
+        response.streaming_content, profile, lambda: record(route, profile, profile.elapsed())
+    )
+    return response
+
+
+def _profiled_stream(content, profile, finished):
+    """Count the bytes and queries of a streaming body; call finished once it is consumed"""
+    iterator = iter(content)
+    try:
+        while True:
+            token = _current_profile.set(profile)
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _current_profile.reset(token)
+            profile.response_bytes += len(chunk)
+            yield chunk
+    finally:
+        finished()
+
+
+class ProfilingMiddleware:
+    """Profiles a sample of requests; see the module comment"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Mark the instance as a coroutine function, as Django's MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        profile, token = _start(request)
+        if profile is None:
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        return _finish(request, response, profile)
+
+    async def __acall__(self, request):
+        profile, token = _start(request)
+        if profile is None:
+            return await self.get_response(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        return _finish(request, response, profile)
+
+    def process_template_response(self, request, response):
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.render_started = time.perf_counter()
+
+            def rendered(response):
+                profile.render_time = (time.perf_counter() - profile.render_started) * 1000
+            response.add_post_render_callback(rendered)
+        return response
@@ -0,0 +1,201 @@
+import threading
+import time as clock
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from . import caching
+from .models import DailyActivityRollup, Workout
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for workout recommendations
+    np = None
+
+
+# Workout recommendations. The catalog is kept in memory as a feature matrix
+# (one-hot activity type, duration, calories and difficulty per workout) and
+# is reloaded whenever the 'workouts' cache generation changes, which every
+# write through the API and populate_db bumps. The generation only reaches
+# other worker processes through a shared cache (OCTOFIT_REDIS_URL), so each
+# load also checks the collection's count and newest _id, and the catalog is
+# reloaded at least every OCTOFIT_RECOMMENDATION_CATALOG_TTL seconds to pick
+# up edits made elsewhere. A user is described by the same
+# features, taken from their daily rollups of the last
+# OCTOFIT_RECOMMENDATION_DAYS days. A workout scores
+#
+#     TYPE_WEIGHT * share of the user's recent minutes in its activity type
+#     - sum over the numeric features of weight * (user value - workout value)**2
+#
+# which expands into one matrix product for a whole batch of users.
+
+DIFFICULTY_LEVELS = {'Easy': 0.0, 'Medium': 0.5, 'Hard': 1.0}
+TYPE_WEIGHT = 1.0
+# Scales bring the numeric features to about 0-1; weights set their influence
+NUMERIC_SCALES = (60.0, 500.0, 1.0)  # duration, calories, difficulty
+NUMERIC_WEIGHTS = (0.5, 0.5, 1.0)
+# Profile of users without recent activity: 30 easy minutes burning about 200 kcal
+DEFAULT_PROFILE = (30.0, 200.0, 0.0)
+# Upper bound of users x workouts scored at once, to bound the score matrix memory
+SCORE_CELLS = 4_000_000
+
+
+def require_numpy():
+    if np is None:
+        raise ImproperlyConfigured('Workout recommendations require the numpy package.')
+
+
+def intensity_level(calories, minutes):
+    """Map calories per minute to the difficulty scale: 6 kcal/min or less is easy, 10 or more hard"""
+    if not minutes:
+        return DEFAULT_PROFILE[2]
+    return min(max((calories / minutes - 6) / 4, 0.0), 1.0)
+
+
+class Catalog:
+    """The workout catalog as a feature matrix, one row per workout"""
+    def __init__(self, workouts, generation=None, fingerprint=None):
+        require_numpy()
+        workouts = list(workouts)
+        self.generation = generation
+        self.fingerprint = fingerprint
+        self.loaded_at = clock.monotonic()
+        self.ids = [workout['_id'] for workout in workouts]
+        self.types = sorted({workout['activity_type'] for workout in workouts})
+        self.type_index = {activity_type: index for index, activity_type in enumerate(self.types)}
+
+        one_hot = np.zeros((len(workouts), len(self.types)), dtype=np.float32)
+        one_hot[np.arange(len(workouts)), [self.type_index[workout['activity_type']] for workout in workouts]] = 1
+        numeric = np.array([
+            (workout['duration'], workout['calories_estimate'], DIFFICULTY_LEVELS.get(workout['difficulty'], 0.5))
+            for workout in workouts
+        ], dtype=np.float32).reshape(len(workouts), 3) / np.float32(NUMERIC_SCALES)
+        # Columns match user vectors [TYPE_WEIGHT * type shares, 2 * weights * numeric, -1]
+        self.features = np.hstack([
+            one_hot,
+            numeric,
+            (np.float32(NUMERIC_WEIGHTS) * numeric ** 2).sum(axis=1, keepdims=True),
+        ])
+
+    @classmethod
+    def load(cls, generation=None, fingerprint=None):
+        fields = {'_id': 1, 'activity_type': 1, 'duration': 1, 'calories_estimate': 1, 'difficulty': 1}
+        return cls(Workout.objects.mongo_find({}, fields), generation, fingerprint)
+
+    def is_current(self, generation, fingerprint):
+        return (
+            self.generation == generation
+            and self.fingerprint == fingerprint
+            and clock.monotonic() - self.loaded_at < settings.OCTOFIT_RECOMMENDATION_CATALOG_TTL
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def user_vectors(self, profiles):
+        """Build the matrix of user vectors and the per-user score offsets from profiles
+
+        A profile is ({activity type: minutes}, duration, calories, difficulty).
+        """
+        vectors = np.zeros((len(profiles), len(self.types) + 4), dtype=np.float32)
+        numeric = np.array([profile[1:] for profile in profiles], dtype=np.float32).reshape(len(profiles), 3)
+        numeric /= np.float32(NUMERIC_SCALES)
+        weights = np.float32(NUMERIC_WEIGHTS)
+        for row, (minutes, *_) in enumerate(profiles):
+            total = sum(minutes.values())
+            for activity_type, value in minutes.items():
+                if total and activity_type in self.type_index:
+                    vectors[row, self.type_index[activity_type]] = TYPE_WEIGHT * value / total
+        vectors[:, len(self.types):-1] = 2 * weights * numeric
+        vectors[:, -1] = -1
+        offsets = -(weights * numeric ** 2).sum(axis=1)
+        return vectors, offsets
+
+    def top(self, profiles, limit):
+        """Get the limit best (workout id, score) pairs for every profile, best first"""
+        if not len(self) or not profiles:
+            return [[] for _ in profiles]
+        vectors, offsets = self.user_vectors(profiles)
+        limit = min(limit, len(self))
+        chunk_size = max(1, SCORE_CELLS // len(self))
+        ranked = []
+        for start in range(0, len(profiles), chunk_size):
+            scores = vectors[start:start + chunk_size] @ self.features.T
+            scores += offsets[start:start + chunk_size, None]
+            if limit < len(self):
+                best = np.argpartition(-scores, limit - 1, axis=1)[:, :limit]
+            else:
+                best = np.broadcast_to(np.arange(len(self)), scores.shape)
+            best_scores = np.take_along_axis(scores, best, axis=1)
+            order = np.argsort(-best_scores, axis=1, kind='stable')
+            best = np.take_along_axis(best, order, axis=1)
+            best_scores = np.take_along_axis(best_scores, order, axis=1)
+            for indexes, values in zip(best, best_scores):
+                ranked.append([(self.ids[index], float(value)) for index, value in zip(indexes, values)])
+        return ranked
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def workouts_fingerprint():
+    """Get the number of workouts and the newest workout id, which change when another process adds or deletes some"""
+    newest = Workout.objects.mongo_find_one({}, {'_id': 1}, sort=[('_id', -1)])
+    return Workout.objects.mongo_count_documents({}), newest['_id'] if newest else None
+
+
+def get_catalog():
+    """Get the in-memory catalog, reloading it if workouts changed since it was built"""
+    global _catalog
+    current = caching.generation('workouts')
+    fingerprint = workouts_fingerprint()
+    if _catalog is None or not _catalog.is_current(current, fingerprint):
+        with _catalog_lock:
+            if _catalog is None or not _catalog.is_current(current, fingerprint):
+                _catalog = Catalog.load(current, fingerprint)
+    return _catalog
+
+
+def profiles(user_ids, today=None):
+    """Describe users by their activity of the last OCTOFIT_RECOMMENDATION_DAYS days with one aggregation"""
+    today = today or datetime.utcnow().date()
+    since = datetime.combine(today - timedelta(days=settings.OCTOFIT_RECOMMENDATION_DAYS), time.min)
+    rows = DailyActivityRollup.objects.mongo_aggregate([
+        {'$match': {'user_id': {'$in': list(set(user_ids))}, 'date': {'$gte': since}}},
+        {'$group': {
+            '_id': {'user_id': '$user_id', 'activity_type': '$activity_type'},
+            'count': {'$sum': '$count'},
+            'duration': {'$sum': '$duration'},
+            'calories': {'$sum': '$calories'},
+        }},
+    ])
+    totals = {}
+    for row in rows:
+        user = totals.setdefault(row['_id']['user_id'], {'minutes': {}, 'count': 0, 'duration': 0, 'calories': 0})
+        user['minutes'][row['_id']['activity_type']] = row['duration']
+        user['count'] += row['count']
+        user['duration'] += row['duration']
+        user['calories'] += row['calories']
+
+    result = {}
+    for user_id in user_ids:
+        user = totals.get(user_id)
+        if not user or not user['count']:
+            result[user_id] = ({}, *DEFAULT_PROFILE)
+            continue
+        result[user_id] = (
+            user['minutes'],
+            user['duration'] / user['count'],
+            user['calories'] / user['count'],
+            intensity_level(user['calories'], user['duration']),
+        )
+    return result
+
+
+def recommend(user_ids, limit=10):
+    """Map each user id to their limit best (workout id, score) pairs, scoring all users at once"""
+    user_ids = list(user_ids)
+    catalog = get_catalog()
+    user_profiles = profiles(user_ids)
+    ranked = catalog.top([user_profiles[user_id] for user_id in user_ids], limit)
+    return dict(zip(user_ids, ranked))
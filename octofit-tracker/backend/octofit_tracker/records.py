@@ -0,0 +1,267 @@
+from datetime import datetime, time, timedelta
+from itertools import groupby
+from operator import itemgetter
+from django.conf import settings
+from pymongo.errors import DuplicateKeyError
+from .archive import archived_before
+from .models import Activity, DailyActivityRollup, UserStats
+from .utils import batches
+
+
+# Per-user streaks, personal bests and weekly totals, kept in one user_stats
+# document per user so a profile view is a single read. Activities that are
+# added on or after the user's last active day are folded into the stored
+# document; removals and activities dated before it (back-filled history,
+# edits) recompute the user's document from their daily rollups and their
+# best activities, which only touches that user's documents. Records set by
+# archived activities are carried over from the stored documents.
+#
+# Several processes (gunicorn workers, run_jobs) may update the same user at
+# once. Every document carries a version that each write increments, and a
+# write only lands if the document is still at the version it was computed
+# from; otherwise it is computed again from the document that won.
+
+RECORD_METRICS = ('distance', 'calories_burned')
+TOTAL_FIELDS = ('count', 'duration', 'distance', 'calories')
+
+
+def _day(value):
+    """djongo stores dates as naive datetimes at midnight"""
+    return datetime.combine(value, time.min)
+
+
+def week_key(day):
+    """Get the ISO week of a day, as used by the stats endpoint (2024-W09)"""
+    return day.strftime('%G-W%V')
+
+
+def oldest_week(today):
+    """Get the oldest ISO week whose totals are kept"""
+    return week_key(today - timedelta(weeks=settings.OCTOFIT_USER_STATS_WEEKS - 1))
+
+
+def _record(activity_id, value, day):
+    return {'value': value, 'activity_id': str(activity_id), 'date': day.isoformat()}
+
+
+def _add_totals(weekly_totals, week, count, duration, distance, calories):
+    totals = weekly_totals.setdefault(week, {'count': 0, 'duration': 0, 'distance': 0.0, 'calories': 0})
+    totals['count'] += count
+    totals['duration'] += duration
+    totals['distance'] += distance
+    totals['calories'] += calories
+
+
+def summarize(rollups, personal_bests, today):
+    """Build the stats of one user from their daily rollups in date order"""
+    oldest = oldest_week(today)
+    days = []
+    weekly_totals = {}
+    for rollup in rollups:
+        day = rollup['date'].date()
+        if not days or days[-1] != day:
+            days.append(day)
+        week = week_key(day)
+        if week >= oldest:
+            _add_totals(weekly_totals, week, *(rollup[field] for field in TOTAL_FIELDS))
+    current_streak = longest_streak = 0
+    for previous, day in zip([None] + days, days):
+        current_streak = current_streak + 1 if previous == day - timedelta(days=1) else 1
+        longest_streak = max(longest_streak, current_streak)
+    return {
+        'current_streak': current_streak,
+        'longest_streak': longest_streak,
+        'last_active_date': days[-1] if days else None,
+        'personal_bests': personal_bests,
+        'weekly_totals': weekly_totals,
+    }
+
+
+def best_activities(match):
+    """Map user ids to {activity type: {metric: record}} over the activities matching a filter"""
+    personal_bests = {}
+    for metric in RECORD_METRICS:
+        rows = Activity.objects.mongo_aggregate([
+            {'$match': {**match, metric: {'$gt': 0}}},
+            # The first activity to reach a best keeps it, as in _fold
+            {'$sort': {metric: -1, '_id': 1}},
+            {'$group': {
+                '_id': {'user_id': '$user_id', 'activity_type': '$activity_type'},
+                'activity_id': {'$first': '$_id'},
+                'value': {'$first': f'${metric}'},
+                'date': {'$first': '$date'},
+            }},
+        ], allowDiskUse=True)
+        for row in rows:
+            user_bests = personal_bests.setdefault(row['_id']['user_id'], {})
+            type_bests = user_bests.setdefault(row['_id']['activity_type'], {})
+            type_bests[metric] = _record(row['activity_id'], row['value'], row['date'].date())
+    return personal_bests
+
+
+def _archived_bests(personal_bests, before):
+    """Keep the records dated before the end of the archived months, which best_activities() no longer sees"""
+    day = before.date().isoformat()
+    kept = {}
+    for activity_type, type_bests in personal_bests.items():
+        for metric, record in type_bests.items():
+            if record['date'] < day:
+                kept.setdefault(activity_type, {})[metric] = record
+    return kept
+
+
+def _merge_bests(kept, personal_bests):
+    """Add records to kept ones where they are higher; the earlier, kept record wins ties as in _fold"""
+    merged = {activity_type: dict(type_bests) for activity_type, type_bests in kept.items()}
+    for activity_type, type_bests in personal_bests.items():
+        for metric, record in type_bests.items():
+            current = merged.setdefault(activity_type, {}).get(metric)
+            if current is None or record['value'] > current['value']:
+                merged[activity_type][metric] = record
+    return merged
+
+
+def _to_document(user_id, stats, version=0):
+    last_active_date = stats['last_active_date']
+    return {
+        'user_id': user_id,
+        **stats,
+        'last_active_date': _day(last_active_date) if last_active_date else None,
+        'version': version,
+        'updated_at': datetime.utcnow(),
+    }
+
+
+def _from_document(document):
+    last_active_date = document.get('last_active_date')
+    return {
+        'current_streak': document.get('current_streak', 0),
+        'longest_streak': document.get('longest_streak', 0),
+        'last_active_date': last_active_date.date() if last_active_date else None,
+        'personal_bests': document.get('personal_bests') or {},
+        'weekly_totals': document.get('weekly_totals') or {},
+    }
+
+
+def _fold(stats, activities, today):
+    """Add activities to stats in date order; return False if one is dated before the last active day"""
+    oldest = oldest_week(today)
+    for activity in sorted(activities, key=lambda activity: activity.date):
+        last = stats['last_active_date']
+        if last is not None and activity.date < last:
+            return False
+        if last is None or activity.date > last + timedelta(days=1):
+            stats['current_streak'] = 1
+        elif activity.date == last + timedelta(days=1):
+            stats['current_streak'] += 1
+        stats['last_active_date'] = activity.date
+        stats['longest_streak'] = max(stats['longest_streak'], stats['current_streak'])
+
+        week = week_key(activity.date)
+        if week >= oldest:
+            _add_totals(stats['weekly_totals'], week, 1, activity.duration, activity.distance or 0.0,
+                        activity.calories_burned)
+
+        type_bests = stats['personal_bests'].get(activity.activity_type, {})
+        for metric in RECORD_METRICS:
+            value = getattr(activity, metric)
+            if value and value > 0 and (metric not in type_bests or value > type_bests[metric]['value']):
+                type_bests[metric] = _record(activity._id, value, activity.date)
+        if type_bests:
+            stats['personal_bests'][activity.activity_type] = type_bests
+    stats['weekly_totals'] = {
+        week: totals for week, totals in stats['weekly_totals'].items() if week >= oldest
+    }
+    return True
+
+
+def _store(user_id, stats, current):
+    """Write a user's stats unless their document changed since it was read as current (None if absent)
+
+    Stats without an active day delete the document. Returns False if
+    another writer got there first.
+    """
+    if current is None:
+        if stats['last_active_date'] is None:
+            return True
+        try:
+            UserStats.objects.mongo_insert_one(_to_document(user_id, stats))
+        except DuplicateKeyError:
+            return False
+        return True
+    unchanged = {'_id': current['_id'], 'version': current.get('version')}
+    if stats['last_active_date'] is None:
+        return UserStats.objects.mongo_delete_one(unchanged).deleted_count == 1
+    document = _to_document(user_id, stats, (current.get('version') or 0) + 1)
+    return UserStats.objects.mongo_replace_one(unchanged, document).matched_count == 1
+
+
+def recompute(user_id, today=None):
+    """Rebuild one user's stats from their rollups and activities; return them, or None without activities"""
+    today = today or datetime.utcnow().date()
+    archived = archived_before()
+    while True:
+        current = UserStats.objects.mongo_find_one({'user_id': user_id})
+        rollups = DailyActivityRollup.objects.mongo_find(
+            {'user_id': user_id}, {'date': 1, **{field: 1 for field in TOTAL_FIELDS}},
+        ).sort('date', 1)
+        personal_bests = best_activities({'user_id': user_id}).get(user_id, {})
+        if archived and current is not None:
+            personal_bests = _merge_bests(_archived_bests(current.get('personal_bests') or {}, archived), personal_bests)
+        stats = summarize(rollups, personal_bests, today)
+        if _store(user_id, stats, current):
+            return stats if stats['last_active_date'] is not None else None
+
+
+def _fold_stored(user_id, activities, today):
+    """Fold activities into a user's stored stats; return False if they need recompute() instead"""
+    while True:
+        current = UserStats.objects.mongo_find_one({'user_id': user_id})
+        if current is None:
+            return False
+        stats = _from_document(current)
+        if not _fold(stats, activities, today):
+            return False
+        if _store(user_id, stats, current):
+            return True
+
+
+def apply_activity_changes(added=(), removed=()):
+    """Update the stats of every user whose activities were added and/or removed
+
+    Runs after the daily rollups have been updated, which recompute() reads.
+    """
+    changes = {}
+    for activities, position in ((added, 0), (removed, 1)):
+        for activity in activities:
+            changes.setdefault(activity.user_id, ([], []))[position].append(activity)
+    today = datetime.utcnow().date()
+    for user_id, (user_added, user_removed) in changes.items():
+        if user_removed or not _fold_stored(user_id, user_added, today):
+            recompute(user_id, today)
+
+
+def rebuild(batch_size=1000):
+    """Recompute the stats of every user from the daily rollups and activities; return how many were written"""
+    today = datetime.utcnow().date()
+    personal_bests = best_activities({})
+    archived = archived_before()
+    if archived:
+        for document in UserStats.objects.mongo_find({}, {'user_id': 1, 'personal_bests': 1}):
+            personal_bests[document['user_id']] = _merge_bests(
+                _archived_bests(document.get('personal_bests') or {}, archived),
+                personal_bests.get(document['user_id'], {}),
+            )
+    rollups = DailyActivityRollup.objects.mongo_find(
+        {}, {'user_id': 1, 'date': 1, **{field: 1 for field in TOTAL_FIELDS}},
+    ).sort([('user_id', 1), ('date', 1)])
+    documents = (
+        _to_document(user_id, summarize(user_rollups, personal_bests.get(user_id, {}), today))
+        for user_id, user_rollups in groupby(rollups, key=itemgetter('user_id'))
+    )
+    UserStats.objects.mongo_delete_many({})
+    count = 0
+    for batch in batches(documents, batch_size):
+        UserStats.objects.mongo_insert_many(batch, ordered=False)
+        count += len(batch)
+    return count
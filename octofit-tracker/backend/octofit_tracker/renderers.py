@@ -0,0 +1,40 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # orjson only speeds rendering up; DRF's renderer is used without it
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """Renders compact JSON with orjson, producing the same documents as DRF's JSONRenderer
+
+    Indented output (the browsable API, indent= in the Accept header) and
+    data orjson cannot encode go through DRF's renderer. Values orjson does
+    not know, such as datetimes and lazy strings, are encoded by DRF's JSON
+    encoder. Floats may be spelled differently (1e16 rather than 1e+16), and
+    NaN and infinity, which DRF refuses, are rendered as null.
+    """
+    _default = JSONRenderer.encoder_class().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or data is None
+            or not self.compact
+            or self.ensure_ascii
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self._default,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+            )
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Escape U+2028 and U+2029 like DRF so the output stays a JavaScript subset
+        if b'\xe2\x80' in ret:
+            ret = ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+        return ret
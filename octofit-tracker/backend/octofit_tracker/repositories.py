@@ -0,0 +1,332 @@
+import threading
+from datetime import datetime, time, timezone
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+from django.db import connections
+from pymongo import ASCENDING, DESCENDING, MongoClient
+from rest_framework import serializers
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from . import archive, profiling
+from .fieldsets import SparseFieldsetMixin
+from .lookups import to_object_ids
+from .models import User, Team, Activity, DailyActivityRollup, Leaderboard
+from .utils import partition_key
+
+
+# Read-only repositories that query MongoDB through pymongo directly instead of
+# going through djongo's SQL translation. They return the same representation
+# as the DRF serializers and are enabled with settings.OCTOFIT_NATIVE_READS.
+
+_client = None
+_client_lock = threading.Lock()
+
+_datetime_field = serializers.DateTimeField()
+
+
+def get_database():
+    """Get the octofit database from a MongoClient shared by the whole process"""
+    global _client
+    settings_dict = connections['default'].settings_dict
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(**settings_dict.get('CLIENT', {}))
+    return _client[settings_dict['NAME']]
+
+
+def format_datetime(value):
+    """Format a naive UTC datetime from Mongo exactly like DRF's DateTimeField"""
+    if value is None:
+        return None
+    return _datetime_field.to_representation(value.replace(tzinfo=timezone.utc))
+
+
+def format_date(value):
+    """djongo stores dates as naive datetimes at midnight"""
+    return value.date().isoformat() if value is not None else None
+
+
+class MongoQuery:
+    """A lazy, immutable query over a collection
+
+    Implements the part of the QuerySet API that DRF's CursorPagination relies
+    on (filter, order_by and slicing), so the regular paginators work with
+    native reads unchanged.
+    """
+    operators = {'gt': '$gt', 'gte': '$gte', 'lt': '$lt', 'lte': '$lte', 'in': '$in'}
+
+    def __init__(self, collection, query=None, sort=None, projection=None):
+        self.collection = collection
+        self.query = query or {}
+        self.sort = sort or []
+        self.projection = projection
+
+    def _clone(self, **changes):
+        attributes = {
+            'query': self.query,
+            'sort': self.sort,
+            'projection': self.projection,
+            **changes,
+        }
+        return MongoQuery(self.collection, **attributes)
+
+    def filter(self, **lookups):
+        query = dict(self.query)
+        for lookup, value in lookups.items():
+            field, _, operator = lookup.partition('__')
+            if operator:
+                query[field] = {**query.get(field, {}), self.operators[operator]: value}
+            else:
+                query[field] = value
+        return self._clone(query=query)
+
+    def order_by(self, *fields):
+        return self._clone(sort=[
+            (field.lstrip('-'), DESCENDING if field.startswith('-') else ASCENDING)
+            for field in fields
+        ])
+
+    def only(self, *fields):
+        return self._clone(projection={field: 1 for field in fields})
+
+    def cursor(self, skip=0, limit=0):
+        cursor = self.collection.find(self.query, self.projection)
+        if self.sort:
+            cursor = cursor.sort(self.sort)
+        return cursor.skip(skip).limit(limit)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step is not None:
+            raise TypeError('MongoQuery only supports slicing without a step')
+        start = key.start or 0
+        if key.stop is None:
+            return list(self.cursor(skip=start))
+        if key.stop <= start:
+            return []
+        return list(self.cursor(skip=start, limit=key.stop - start))
+
+    def __iter__(self):
+        return iter(self.cursor())
+
+
+class Repository:
+    """Reads one collection and renders documents like the model's serializer
+
+    Related values are declared rather than fetched inline so that the sync
+    and async read paths can resolve them with their own drivers:
+    name_lookups maps an output field to (model, document field) and is
+    resolved against the model's name field, except for documents that store
+    a snapshot of the name under the output field itself; count_lookups maps
+    an output field to the document field whose activities are counted.
+    """
+    model = None
+    fields = ()
+    name_lookups = {}
+    count_lookups = {}
+
+    def __init__(self, database=None):
+        self._database = database
+
+    @property
+    def database(self):
+        if self._database is None:
+            self._database = get_database()
+        return self._database
+
+    @property
+    def collection(self):
+        return self.collection_for(self.model)
+
+    def collection_for(self, model):
+        return self.database[model._meta.db_table]
+
+    def query(self, projection=None):
+        return MongoQuery(self.collection).only(*(projection or self.fields))
+
+    def get(self, pk, fields=None, projection=None):
+        """Get the representation of one document, or None if it does not exist"""
+        try:
+            object_id = ObjectId(pk)
+        except (InvalidId, TypeError):
+            return None
+        document = self.collection.find_one(
+            {'_id': object_id}, {field: 1 for field in projection or self.fields}
+        )
+        return self.represent([document], fields)[0] if document else None
+
+    def lookup_plan(self, fields=None):
+        """List the (output field, kind, model, document field) lookups needed for fields"""
+        plan = [(name, 'names', model, source) for name, (model, source) in self.name_lookups.items()]
+        plan += [(name, 'counts', None, source) for name, source in self.count_lookups.items()]
+        return [lookup for lookup in plan if not fields or lookup[0] in fields]
+
+    def lookup_ids(self, documents, lookup):
+        """Get the ids a lookup has to resolve for a page of documents"""
+        name, kind, model, source = lookup
+        if kind == 'names':
+            return [document.get(source) for document in documents if not document.get(name)]
+        return [document.get(source) for document in documents]
+
+    def resolve(self, documents, fields=None):
+        """Run the lookups needed for fields and map output field to {id: value}"""
+        related = {}
+        for lookup in self.lookup_plan(fields):
+            name, kind, model, source = lookup
+            ids = self.lookup_ids(documents, lookup)
+            related[name] = self.names(model, ids) if kind == 'names' else self.activity_counts(ids)
+        return related
+
+    def related_name(self, document, related, name, source, default):
+        """Get a stored name snapshot, or the resolved name of the document's source id"""
+        return document.get(name) or related.get(name, {}).get(document.get(source), default)
+
+    def names(self, model, ids):
+        """Map id strings to the name field of a collection with a single query"""
+        object_ids = to_object_ids(ids)
+        if not object_ids:
+            return {}
+        documents = self.collection_for(model).find({'_id': {'$in': object_ids}}, {'name': 1})
+        return {str(document['_id']): document['name'] for document in documents}
+
+    def activity_counts(self, user_ids):
+        """Map user id strings to their number of activities using the daily rollups"""
+        rows = self.collection_for(DailyActivityRollup).aggregate(activity_count_pipeline(user_ids))
+        return {row['_id']: row['count'] for row in rows}
+
+    def represent(self, documents, fields=None, related=None):
+        """Build the API representation, narrowed to the requested fields if given"""
+        with profiling.serializing():
+            documents = list(documents)
+            if related is None:
+                related = self.resolve(documents, fields)
+            rows = [self.shape(document, related) for document in documents]
+            if fields:
+                rows = [{name: value for name, value in row.items() if name in fields} for row in rows]
+        return rows
+
+    def shape(self, document, related):
+        """Render one document given the resolved related values"""
+        raise NotImplementedError
+
+
+def activity_count_pipeline(user_ids):
+    return [
+        {'$match': {'user_id': {'$in': list(set(user_ids))}}},
+        {'$group': {'_id': '$user_id', 'count': {'$sum': '$count'}}},
+    ]
+
+
+class UserRepository(Repository):
+    model = User
+    fields = ('_id', 'name', 'email', 'team_id', 'weight', 'created_at')
+
+    def shape(self, document, related):
+        return {
+            '_id': str(document['_id']),
+            'name': document.get('name'),
+            'email': document.get('email'),
+            'team_id': document.get('team_id'),
+            'weight': document.get('weight'),
+            'created_at': format_datetime(document.get('created_at')),
+        }
+
+
+class ActivityRepository(Repository):
+    model = Activity
+    fields = ('_id', 'user_id', 'user_name', 'activity_type', 'duration', 'distance', 'calories_burned',
+              'date', 'notes', 'created_at')
+    name_lookups = {'user_name': (User, 'user_id')}
+
+    @staticmethod
+    def date_range(start=None, end=None):
+        """Filter activities dated from start to end (both optional), narrowed to their months first
+
+        The month partition key leads the (month, date, _id) index, so the
+        range only reads the index of the months it covers. While activities
+        stored before the key existed lack it ("archive_activities --backfill"
+        sets it), the range filters on the date alone so they are still found.
+        """
+        query = {}
+        partitioned = (start or end) and not archive.partition_keys_missing()
+        if start:
+            if partitioned:
+                query.setdefault('month', {})['$gte'] = partition_key(start)
+            query.setdefault('date', {})['$gte'] = datetime.combine(start, time.min)
+        if end:
+            if partitioned:
+                query.setdefault('month', {})['$lte'] = partition_key(end)
+            query.setdefault('date', {})['$lte'] = datetime.combine(end, time.min)
+        return query
+
+    def shape(self, document, related):
+        user_id = document.get('user_id')
+        return {
+            '_id': str(document['_id']),
+            'user_id': user_id,
+            'user_name': self.related_name(document, related, 'user_name', 'user_id', f"User {user_id}"),
+            'activity_type': document.get('activity_type'),
+            'duration': document.get('duration'),
+            'distance': document.get('distance'),
+            'calories_burned': document.get('calories_burned'),
+            'date': format_date(document.get('date')),
+            'notes': document.get('notes'),
+            'created_at': format_datetime(document.get('created_at')),
+        }
+
+
+class LeaderboardRepository(Repository):
+    model = Leaderboard
+    fields = ('_id', 'user_id', 'user_name', 'team_id', 'team_name', 'total_calories', 'total_duration', 'rank', 'updated_at')
+    name_lookups = {'user_name': (User, 'user_id'), 'team_name': (Team, 'team_id')}
+    count_lookups = {'total_activities': 'user_id'}
+
+    def shape(self, document, related):
+        user_id = document.get('user_id')
+        team_id = document.get('team_id')
+        return {
+            '_id': str(document['_id']),
+            'user_id': user_id,
+            'user_name': self.related_name(document, related, 'user_name', 'user_id', "Unknown User"),
+            'team_id': team_id,
+            'team_name': self.related_name(document, related, 'team_name', 'team_id', "N/A"),
+            'total_calories': document.get('total_calories'),
+            'total_points': document.get('total_calories'),
+            'total_duration': document.get('total_duration'),
+            'total_activities': related.get('total_activities', {}).get(user_id, 0),
+            'rank': document.get('rank'),
+            'updated_at': format_datetime(document.get('updated_at')),
+        }
+
+
+class NativeReadMixin(SparseFieldsetMixin):
+    """Serves list and retrieve from a pymongo repository when OCTOFIT_NATIVE_READS is on"""
+    repository_class = None
+
+    def native_reads_enabled(self):
+        return settings.OCTOFIT_NATIVE_READS
+
+    def list(self, request, *args, **kwargs):
+        if not self.native_reads_enabled():
+            return super().list(request, *args, **kwargs)
+        repository = self.repository_class()
+        fields = self.get_requested_fields()
+        query = repository.query(self.get_projection(fields) if fields else None)
+        page = self.paginate_queryset(query)
+        if page is None:
+            return Response(repository.represent(query, fields))
+        return self.get_paginated_response(repository.represent(page, fields))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.native_reads_enabled():
+            return super().retrieve(request, *args, **kwargs)
+        fields = self.get_requested_fields()
+        data = self.repository_class().get(
+            kwargs[self.lookup_url_kwarg or self.lookup_field],
+            fields=fields,
+            projection=self.get_projection(fields) if fields else None,
+        )
+        if data is None:
+            raise NotFound()
+        return Response(data)
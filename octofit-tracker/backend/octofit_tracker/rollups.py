@@ -0,0 +1,78 @@
+from datetime import datetime, time
+from pymongo import UpdateOne
+from .archive import archived_before
+from .lookups import user_team_ids
+from .models import Activity, DailyActivityRollup
+from .utils import batches
+
+
+def _day(value):
+    """djongo stores dates as naive datetimes at midnight"""
+    return datetime.combine(value, time.min)
+
+
+def apply_activity_changes(added=(), removed=()):
+    """Update the daily rollups for activities that were added and/or removed"""
+    deltas = {}
+    for activities, sign in ((added, 1), (removed, -1)):
+        for activity in activities:
+            key = (activity.user_id, _day(activity.date), activity.activity_type)
+            delta = deltas.setdefault(key, [0, 0, 0.0, 0])
+            delta[0] += sign
+            delta[1] += sign * activity.duration
+            delta[2] += sign * (activity.distance or 0.0)
+            delta[3] += sign * activity.calories_burned
+    deltas = {key: delta for key, delta in deltas.items() if any(delta)}
+    if not deltas:
+        return
+
+    teams = user_team_ids(user_id for user_id, _, _ in deltas)
+    keys = []
+    operations = []
+    for (user_id, day, activity_type), (count, duration, distance, calories) in deltas.items():
+        key = {'user_id': user_id, 'date': day, 'activity_type': activity_type}
+        keys.append(key)
+        operations.append(UpdateOne(key, {
+            '$inc': {'count': count, 'duration': duration, 'distance': distance, 'calories': calories},
+            '$set': {'team_id': teams.get(user_id)},
+        }, upsert=True))
+    DailyActivityRollup.objects.mongo_bulk_write(operations, ordered=False)
+    DailyActivityRollup.objects.mongo_delete_many({'$or': keys, 'count': {'$lte': 0}})
+
+
+def rebuild(batch_size=10000):
+    """Recompute the daily rollups from the activities collection
+
+    Rollups of archived months are kept as they are, since their activities
+    are no longer in the collection.
+    """
+    archived = archived_before()
+    match = {'date': {'$gte': archived}} if archived else {}
+    rows = Activity.objects.mongo_aggregate([
+        {'$match': match},
+        {'$group': {
+            '_id': {'user_id': '$user_id', 'date': '$date', 'activity_type': '$activity_type'},
+            'count': {'$sum': 1},
+            'duration': {'$sum': '$duration'},
+            'distance': {'$sum': '$distance'},
+            'calories': {'$sum': '$calories_burned'},
+        }},
+    ], allowDiskUse=True)
+
+    DailyActivityRollup.objects.mongo_delete_many(match)
+    total = 0
+    for batch in batches(rows, batch_size):
+        teams = user_team_ids(row['_id']['user_id'] for row in batch)
+        DailyActivityRollup.objects.mongo_insert_many([
+            {
+                **row['_id'],
+                'team_id': teams.get(row['_id']['user_id']),
+                'count': row['count'],
+                'duration': row['duration'],
+                'distance': row['distance'],
+                'calories': row['calories'],
+            }
+            for row in batch
+        ], ordered=False)
+        total += len(batch)
+    return total
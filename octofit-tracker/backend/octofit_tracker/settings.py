@@ -54,6 +54,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'octofit_tracker.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -153,3 +154,73 @@ CORS_ALLOW_METHODS = [
     'PUT',
 ]
 CORS_ALLOW_HEADERS = ['*']
+
+# REST framework settings
+# List endpoints use keyset pagination so deep pages cost the same as the first
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'octofit_tracker.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'octofit_tracker.pagination.ObjectIdCursorPagination',
+    'PAGE_SIZE': int(os.environ.get('OCTOFIT_PAGE_SIZE', 100)),
+}
+OCTOFIT_MAX_PAGE_SIZE = int(os.environ.get('OCTOFIT_MAX_PAGE_SIZE', 1000))
+
+# Serve user, activity and leaderboard reads through pymongo instead of djongo
+OCTOFIT_NATIVE_READS = os.environ.get('OCTOFIT_NATIVE_READS', '').lower() in ('1', 'true', 'yes')
+
+# Cache for read-heavy API responses (leaderboard, teams, workouts)
+# Local memory is per process; set OCTOFIT_REDIS_URL to share the cache and its
+# invalidations between worker processes.
+OCTOFIT_API_CACHE = 'api'
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'octofit-api',
+        'TIMEOUT': int(os.environ.get('OCTOFIT_API_CACHE_TIMEOUT', 60)),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+if os.environ.get('OCTOFIT_REDIS_URL'):
+    CACHES['api'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('OCTOFIT_REDIS_URL'),
+        'TIMEOUT': int(os.environ.get('OCTOFIT_API_CACHE_TIMEOUT', 60)),
+    }
+
+# Number of past windows kept per period leaderboard before the TTL index drops them
+OCTOFIT_PERIOD_LEADERBOARD_RETENTION = {
+    'day': int(os.environ.get('OCTOFIT_DAILY_LEADERBOARDS_KEPT', 14)),
+    'week': int(os.environ.get('OCTOFIT_WEEKLY_LEADERBOARDS_KEPT', 12)),
+    'month': int(os.environ.get('OCTOFIT_MONTHLY_LEADERBOARDS_KEPT', 12)),
+}
+
+# Number of recent ISO weeks whose totals are kept in each user's stats
+OCTOFIT_USER_STATS_WEEKS = int(os.environ.get('OCTOFIT_USER_STATS_WEEKS', 12))
+
+# Days of activity that describe a user to the workout recommendations
+OCTOFIT_RECOMMENDATION_DAYS = int(os.environ.get('OCTOFIT_RECOMMENDATION_DAYS', 28))
+# Seconds a worker keeps its in-memory workout catalog before reloading it. Writes
+# through the API reload it at once, in every worker only with OCTOFIT_REDIS_URL.
+OCTOFIT_RECOMMENDATION_CATALOG_TTL = float(os.environ.get('OCTOFIT_RECOMMENDATION_CATALOG_TTL', 300))
+
+# Months of activities kept in the activities collection (the current one
+# included); "manage.py archive_activities" moves older months to compressed
+# files in OCTOFIT_ARCHIVE_DIR, where exports still read them
+OCTOFIT_ACTIVITY_RETENTION_MONTHS = int(os.environ.get('OCTOFIT_ACTIVITY_RETENTION_MONTHS', 24))
+OCTOFIT_ARCHIVE_DIR = os.environ.get('OCTOFIT_ARCHIVE_DIR', str(BASE_DIR / 'archive'))
+
+# Background jobs (octofit_tracker.jobs). With OCTOFIT_JOBS_IN_PROCESS off, jobs
+# are only stored and a separate "manage.py run_jobs" process runs them.
+OCTOFIT_JOBS_IN_PROCESS = os.environ.get('OCTOFIT_JOBS_IN_PROCESS', 'true').lower() in ('1', 'true', 'yes')
+OCTOFIT_JOB_WORKERS = int(os.environ.get('OCTOFIT_JOB_WORKERS', 2))
+OCTOFIT_JOB_RETRY_DELAY = float(os.environ.get('OCTOFIT_JOB_RETRY_DELAY', 5))
+
+# Share of requests profiled by octofit_tracker.profiling (0 disables it), and
+# the number of recent samples per route kept for /api/_metrics
+OCTOFIT_PROFILING_SAMPLE_RATE = float(os.environ.get('OCTOFIT_PROFILING_SAMPLE_RATE', 1.0 if DEBUG else 0.0))
+OCTOFIT_PROFILING_WINDOW = int(os.environ.get('OCTOFIT_PROFILING_WINDOW', 1000))
@@ -0,0 +1,99 @@
+from datetime import datetime, time
+from .lookups import user_names, team_names
+from .models import User, Team, DailyActivityRollup
+
+
+BUCKET_FORMATS = {
+    'day': '%Y-%m-%d',
+    'week': '%G-W%V',
+    'month': '%Y-%m',
+}
+GROUP_KEYS = {
+    'user': '$user_id',
+    'team': '$team_id',
+    'activity_type': '$activity_type',
+}
+GROUP_BY_CHOICES = tuple(GROUP_KEYS)
+METRICS = ('count', 'duration', 'distance', 'calories')
+
+
+def build_pipeline(bucket, group_by, start=None, end=None, user_id=None, team_id=None, activity_type=None):
+    """Build the aggregation over the daily rollups that sums metrics per group key and period"""
+    match = {}
+    if start or end:
+        match['date'] = {}
+        if start:
+            match['date']['$gte'] = datetime.combine(start, time.min)
+        if end:
+            match['date']['$lte'] = datetime.combine(end, time.min)
+    if user_id:
+        match['user_id'] = user_id
+    if team_id:
+        match['team_id'] = team_id
+    if activity_type:
+        match['activity_type'] = activity_type
+    return [
+        {'$match': match},
+        {'$group': {
+            '_id': {
+                'key': GROUP_KEYS[group_by],
+                'period': {'$dateToString': {'format': BUCKET_FORMATS[bucket], 'date': '$date'}},
+            },
+            'count': {'$sum': '$count'},
+            'duration': {'$sum': '$duration'},
+            'distance': {'$sum': '$distance'},
+            'calories': {'$sum': '$calories'},
+        }},
+    ]
+
+
+# Models whose names label each group; activity types label themselves
+GROUP_NAME_MODELS = {
+    'user': User,
+    'team': Team,
+}
+
+
+def fold_points(rows):
+    """Collect aggregation rows into {group key: {period: metrics}}"""
+    points = {}
+    for row in rows:
+        key, period = row['_id']['key'], row['_id']['period']
+        point = points.setdefault(key, {}).setdefault(period, dict.fromkeys(METRICS, 0))
+        for metric in METRICS:
+            point[metric] += row[metric]
+    return points
+
+
+def build_series(points, names):
+    """Turn folded points into one sorted time series per group"""
+    series = []
+    for key in sorted(points, key=lambda key: str(key)):
+        series.append({
+            'key': key,
+            'name': names.get(key, 'N/A'),
+            'points': [
+                {'period': period, **metrics, 'distance': round(metrics['distance'], 2)}
+                for period, metrics in sorted(points[key].items())
+            ],
+        })
+    return series
+
+
+def shape_series(rows, group_by):
+    """Turn aggregation rows into one sorted time series per group"""
+    points = fold_points(rows)
+    if group_by == 'user':
+        names = user_names(points)
+    elif group_by == 'team':
+        names = team_names(points)
+    else:
+        names = {key: key for key in points}
+    return build_series(points, names)
+
+
+def activity_stats(bucket='week', group_by='user', start=None, end=None,
+                   user_id=None, team_id=None, activity_type=None):
+    """Compute per-group activity totals bucketed by day, week or month"""
+    pipeline = build_pipeline(bucket, group_by, start, end, user_id, team_id, activity_type)
+    return shape_series(DailyActivityRollup.objects.mongo_aggregate(pipeline), group_by)
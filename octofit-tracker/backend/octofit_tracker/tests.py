@@ -1,8 +1,24 @@
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from djongo import database
 from rest_framework.test import APITestCase
 from rest_framework import status
-from .models import User, Team, Activity, Leaderboard, Workout
-from datetime import date
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import ListSerializer
+from .caching import api_cache
+from .models import User, Team, Activity, DailyActivityRollup, Leaderboard, PeriodLeaderboard, ActivityTypeLeaderboard, UserStats, Workout, Job
+from .renderers import FastJSONRenderer
+from .serializers import ActivitySerializer, LeaderboardSerializer, WorkoutSerializer
+from . import archive, async_views, estimation, jobs, leaderboard, periods, profiling, recommendations, records, repositories, rollups
+from .management.commands import benchmark, mongo_indexes
+from datetime import date, datetime, timedelta
+import importlib.util
+import io
+import json
+import tempfile
+from unittest import mock, skipUnless
 
 
 class UserModelTest(TestCase):
@@ -133,6 +149,24 @@ class TeamAPITest(APITestCase):
         self.assertEqual(Team.objects.get().name, 'API Test Team')
 
 
+class TeamMemberCountTest(APITestCase):
+    def test_member_counts_in_list(self):
+        """Test that the team list reports member counts computed in one aggregation"""
+        api_cache().clear()
+        full_team = Team.objects.create(name="Full Team")
+        empty_team = Team.objects.create(name="Empty Team")
+        for i in range(3):
+            User.objects.create(
+                name=f"Member {i}",
+                email=f"member{i}@example.com",
+                password="password123",
+                team_id=str(full_team._id)
+            )
+        response = self.client.get('/api/teams/')
+        counts = {team['name']: team['member_count'] for team in response.data['results']}
+        self.assertEqual(counts, {"Full Team": 3, "Empty Team": 0})
+
+
 class ActivityAPITest(APITestCase):
     def test_create_activity(self):
         """Test creating an activity via API"""
@@ -167,6 +201,1065 @@ class LeaderboardAPITest(APITestCase):
         self.assertEqual(Leaderboard.objects.get().total_calories, 2000)
 
 
+class LeaderboardListQueryTest(APITestCase):
+    def setUp(self):
+        api_cache().clear()
+        self.team = Team.objects.create(name="Query Team")
+    
+    def _add_entries(self, count):
+        for i in range(count):
+            user = User.objects.create(
+                name=f"Hero {i}",
+                email=f"hero{i}-{Leaderboard.objects.count()}@example.com",
+                password="password123",
+                team_id=str(self.team._id)
+            )
+            Activity.objects.create(
+                user_id=str(user._id),
+                activity_type="Running",
+                duration=30,
+                calories_burned=300,
+                date=date.today()
+            )
+            Leaderboard.objects.create(
+                user_id=str(user._id),
+                team_id=str(self.team._id),
+                total_calories=300,
+                total_duration=30,
+                rank=1
+            )
+    
+    def _list_query_count(self):
+        api_cache().clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/leaderboard/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries.captured_queries)
+    
+    def test_names_are_resolved(self):
+        """Test that batched lookups still resolve user and team names"""
+        self._add_entries(1)
+        rollups.rebuild()
+        response = self.client.get('/api/leaderboard/')
+        entry = response.data['results'][0]
+        self.assertEqual(entry['user_name'], "Hero 0")
+        self.assertEqual(entry['team_name'], "Query Team")
+        self.assertEqual(entry['total_activities'], 1)
+    
+    def test_query_count_is_constant(self):
+        """Test that listing the leaderboard does not issue per-row queries"""
+        self._add_entries(2)
+        small_page_queries = self._list_query_count()
+        self._add_entries(10)
+        large_page_queries = self._list_query_count()
+        self.assertEqual(small_page_queries, large_page_queries)
+
+
+class ActivityBulkAPITest(APITestCase):
+    def _row(self, calories):
+        return {
+            'user_id': 'bulk_user',
+            'activity_type': 'Running',
+            'duration': 30,
+            'calories_burned': calories,
+            'date': str(date.today())
+        }
+    
+    def test_bulk_json_array_reports_row_errors(self):
+        """Test that valid rows are inserted and invalid rows are reported by index"""
+        rows = [self._row(100), {'activity_type': 'Running'}, self._row(200)]
+        response = self.client.post('/api/activities/bulk/', rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1])
+        self.assertEqual(Activity.objects.count(), 2)
+        self.assertEqual(Leaderboard.objects.get(user_id='bulk_user').total_calories, 300)
+    
+    def test_bulk_ndjson_stream(self):
+        """Test that an NDJSON body is ingested line by line"""
+        body = '\n'.join(json.dumps(self._row(100)) for _ in range(3)) + '\nnot json\n'
+        response = self.client.post('/api/activities/bulk/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual(response.data['errors'][0]['index'], 3)
+
+
+class ActivityStatsAPITest(APITestCase):
+    def setUp(self):
+        self.team = Team.objects.create(name="Stats Team")
+        self.user = User.objects.create(
+            name="Stats User",
+            email="stats@example.com",
+            password="password123",
+            team_id=str(self.team._id)
+        )
+        for calories in (100, 250):
+            self.client.post('/api/activities/', {
+                'user_id': str(self.user._id),
+                'activity_type': 'Running',
+                'duration': 30,
+                'distance': 5.0,
+                'calories_burned': calories,
+                'date': '2024-03-05'
+            }, format='json')
+    
+    def test_team_stats_by_day(self):
+        """Test that statistics are summed per team and day in the database"""
+        response = self.client.get('/api/activities/stats/', {'group_by': 'team', 'bucket': 'day'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        series = response.data['series']
+        self.assertEqual(len(series), 1)
+        self.assertEqual(series[0]['name'], "Stats Team")
+        self.assertEqual(series[0]['points'], [
+            {'period': '2024-03-05', 'count': 2, 'duration': 60, 'distance': 10.0, 'calories': 350}
+        ])
+    
+    def test_invalid_bucket(self):
+        """Test that unknown buckets are rejected"""
+        response = self.client.get('/api/activities/stats/', {'bucket': 'decade'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class DailyActivityRollupTest(APITestCase):
+    def _post_activity(self, calories):
+        return self.client.post('/api/activities/', {
+            'user_id': 'rollup_user',
+            'activity_type': 'Yoga',
+            'duration': 20,
+            'calories_burned': calories,
+            'date': '2024-03-05'
+        }, format='json')
+    
+    def test_rollup_follows_writes(self):
+        """Test that activity writes keep the daily rollup in step"""
+        self._post_activity(100)
+        response = self._post_activity(150)
+        rollup = DailyActivityRollup.objects.get(user_id='rollup_user')
+        self.assertEqual((rollup.count, rollup.duration, rollup.calories), (2, 40, 250))
+        
+        self.client.delete(f"/api/activities/{response.data['_id']}/")
+        rollup = DailyActivityRollup.objects.get(user_id='rollup_user')
+        self.assertEqual((rollup.count, rollup.duration, rollup.calories), (1, 20, 100))
+    
+    def test_rebuild_matches_incremental(self):
+        """Test that a rebuild produces the same totals as incremental maintenance"""
+        self._post_activity(100)
+        self._post_activity(150)
+        rollups.rebuild()
+        rollup = DailyActivityRollup.objects.get(user_id='rollup_user')
+        self.assertEqual((rollup.count, rollup.duration, rollup.calories), (2, 40, 250))
+
+
+class LeaderboardUpdateTest(APITestCase):
+    def _post_activity(self, user_id, calories):
+        return self.client.post('/api/activities/', {
+            'user_id': user_id,
+            'activity_type': 'Running',
+            'duration': 30,
+            'calories_burned': calories,
+            'date': str(date.today())
+        }, format='json')
+    
+    def test_activity_writes_update_totals_and_ranks(self):
+        """Test that creating and deleting activities keeps the leaderboard live"""
+        self._post_activity('user_a', 300)
+        self._post_activity('user_b', 200)
+        self._post_activity('user_b', 200)
+        
+        user_a = Leaderboard.objects.get(user_id='user_a')
+        user_b = Leaderboard.objects.get(user_id='user_b')
+        self.assertEqual(user_b.total_calories, 400)
+        self.assertEqual(user_b.total_duration, 60)
+        self.assertEqual(user_b.rank, 1)
+        self.assertEqual(user_a.rank, 2)
+        
+        activity = Activity.objects.filter(user_id='user_b').first()
+        response = self.client.delete(f'/api/activities/{activity._id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(Leaderboard.objects.get(user_id='user_a').rank, 1)
+        self.assertEqual(Leaderboard.objects.get(user_id='user_b').rank, 2)
+    
+    def test_orm_writes_update_derived_data(self):
+        """Test that saves and deletes outside the API (admin, scripts) keep the derived collections live"""
+        self._post_activity('user_a', 300)
+        activity = Activity.objects.create(user_id='user_b', activity_type='Running', duration=30,
+                                           calories_burned=200, date=str(date.today()))
+        self.assertEqual(Leaderboard.objects.get(user_id='user_b').total_calories, 200)
+        
+        activity.calories_burned = 500
+        activity.save()
+        self.assertEqual(Leaderboard.objects.get(user_id='user_b').total_calories, 500)
+        self.assertEqual(Leaderboard.objects.get(user_id='user_b').rank, 1)
+        self.assertEqual(DailyActivityRollup.objects.get(user_id='user_b').calories, 500)
+        
+        Activity.objects.filter(user_id='user_b').delete()
+        self.assertEqual(DailyActivityRollup.objects.filter(user_id='user_b').count(), 0)
+        entry = Leaderboard.objects.get(user_id='user_b')
+        self.assertEqual((entry.total_calories, entry.rank), (0, 2))
+        self.assertEqual(Leaderboard.objects.get(user_id='user_a').rank, 1)
+    
+    def test_rerank_repairs_drifted_ranks(self):
+        """Test that the rerank job fixes ranks left off by concurrent writers and keeps the totals"""
+        for user_id, calories in (('user_a', 300), ('user_b', 200), ('user_c', 200)):
+            self._post_activity(user_id, calories)
+        Leaderboard.objects.mongo_update_many({'user_id': {'$in': ['user_b', 'user_c']}}, {'$inc': {'rank': 1}})
+        PeriodLeaderboard.objects.mongo_update_many({'user_id': 'user_a'}, {'$set': {'rank': 3}})
+        
+        self.assertEqual(jobs.rerank_leaderboards(), {'fixed': 5})
+        ranks = dict(Leaderboard.objects.values_list('user_id', 'rank'))
+        self.assertEqual(ranks, {'user_a': 1, 'user_b': 2, 'user_c': 2})
+        self.assertEqual(set(PeriodLeaderboard.objects.filter(user_id='user_a').values_list('rank', flat=True)), {1})
+        self.assertEqual(jobs.rerank_leaderboards(), {'fixed': 0})
+
+
+class PaginationTest(APITestCase):
+    def test_activities_are_paginated_by_cursor(self):
+        """Test that list endpoints return cursor pages that cover every row once"""
+        for i in range(5):
+            Activity.objects.create(
+                user_id="test_user_id",
+                activity_type="Running",
+                duration=10 + i,
+                calories_burned=100,
+                date=date.today()
+            )
+        response = self.client.get('/api/activities/', {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        seen = [item['_id'] for item in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            seen.extend(item['_id'] for item in response.data['results'])
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(len(set(seen)), 5)
+    
+    def test_invalid_cursor(self):
+        """Test that a malformed cursor is rejected"""
+        response = self.client.get('/api/activities/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ResponseCacheTest(APITestCase):
+    def setUp(self):
+        api_cache().clear()
+        Workout.objects.create(
+            name="Cached Run",
+            description="A run served from cache",
+            difficulty="Easy",
+            duration=20,
+            calories_estimate=200,
+            activity_type="Running"
+        )
+    
+    def test_cached_list_skips_database(self):
+        """Test that a repeated read is served from the cache"""
+        first = self.client.get('/api/workouts/')
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get('/api/workouts/')
+        self.assertEqual(len(queries.captured_queries), 0)
+        self.assertEqual(first.content, second.content)
+    
+    def test_etag_not_modified(self):
+        """Test that a matching If-None-Match returns 304"""
+        etag = self.client.get('/api/workouts/')['ETag']
+        response = self.client.get('/api/workouts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+    
+    def test_renderer_parameters_are_cached_apart(self):
+        """Test that an indented response is never served for a compact request or the other way round"""
+        indented = self.client.get('/api/workouts/', HTTP_ACCEPT='application/json; indent=4')
+        compact = self.client.get('/api/workouts/', HTTP_ACCEPT='application/json')
+        self.assertIn(b'\n    ', indented.content)
+        self.assertNotIn(b'\n', compact.content)
+        self.assertNotEqual(indented['ETag'], compact['ETag'])
+        self.assertEqual(self.client.get('/api/workouts/', HTTP_ACCEPT='application/json; indent=4').content,
+                         indented.content)
+        self.assertIn('Accept', compact['Vary'])
+    
+    def test_write_invalidates(self):
+        """Test that a write through the viewset invalidates cached lists"""
+        etag = self.client.get('/api/workouts/')['ETag']
+        self.client.post('/api/workouts/', {
+            'name': 'New Workout',
+            'description': 'Fresh',
+            'difficulty': 'Easy',
+            'duration': 10,
+            'calories_estimate': 50,
+            'activity_type': 'Yoga'
+        }, format='json')
+        response = self.client.get('/api/workouts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(json.loads(response.content)['results']), 2)
+
+
+class SparseFieldsetTest(APITestCase):
+    def setUp(self):
+        Activity.objects.create(
+            user_id="test_user_id",
+            activity_type="Running",
+            duration=30,
+            calories_burned=300,
+            date=date.today(),
+            notes="Long notes that mobile clients do not need"
+        )
+    
+    def test_fields_narrow_output(self):
+        """Test that ?fields= returns only the requested fields"""
+        response = self.client.get('/api/activities/', {'fields': 'activity_type,calories_burned'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0], {'activity_type': 'Running', 'calories_burned': 300})
+    
+    def test_fields_narrow_native_output(self):
+        """Test that the pymongo read path honours ?fields= as well"""
+        with override_settings(OCTOFIT_NATIVE_READS=True):
+            response = self.client.get('/api/activities/', {'fields': 'user_name,duration'})
+        self.assertEqual(response.data['results'][0], {'user_name': 'User test_user_id', 'duration': 30})
+    
+    def test_unknown_field(self):
+        """Test that unknown or write-only fields are rejected"""
+        response = self.client.get('/api/users/', {'fields': 'password'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class NativeReadTest(APITestCase):
+    def test_native_reads_match_serializers(self):
+        """Test that the pymongo read path returns the same representation as DRF"""
+        api_cache().clear()
+        team = Team.objects.create(name="Native Team")
+        user = User.objects.create(
+            name="Native User",
+            email="native@example.com",
+            password="password123",
+            team_id=str(team._id)
+        )
+        self.client.post('/api/activities/', {
+            'user_id': str(user._id),
+            'activity_type': 'Swimming',
+            'duration': 40,
+            'distance': 1.5,
+            'calories_burned': 320,
+            'date': '2024-03-05'
+        }, format='json')
+        for url in ('/api/activities/', '/api/leaderboard/', '/api/users/'):
+            api_cache().clear()
+            orm_response = self.client.get(url)
+            api_cache().clear()
+            with override_settings(OCTOFIT_NATIVE_READS=True):
+                native_response = self.client.get(url)
+            self.assertEqual(json.loads(orm_response.content), json.loads(native_response.content))
+        
+        activity_id = Activity.objects.get()._id
+        with override_settings(OCTOFIT_NATIVE_READS=True):
+            response = self.client.get(f'/api/activities/{activity_id}/')
+        self.assertEqual(response.data['user_name'], "Native User")
+
+
+@override_settings(OCTOFIT_JOBS_IN_PROCESS=False)
+class DenormalizedNamesTest(APITestCase):
+    def setUp(self):
+        api_cache().clear()
+        self.team = Team.objects.create(name="Snapshot Team")
+        self.user = User.objects.create(
+            name="Snapshot User",
+            email="snapshot@example.com",
+            password="password123",
+            team_id=str(self.team._id)
+        )
+        self.client.post('/api/activities/', {
+            'user_id': str(self.user._id),
+            'activity_type': 'Running',
+            'duration': 30,
+            'calories_burned': 300,
+            'date': '2024-03-05'
+        }, format='json')
+    
+    def test_names_are_stored_on_write(self):
+        """Test that new activities and leaderboard entries store name snapshots"""
+        activity = Activity.objects.get()
+        entry = Leaderboard.objects.get()
+        self.assertEqual((activity.user_name, activity.team_name), ("Snapshot User", "Snapshot Team"))
+        self.assertEqual((entry.user_name, entry.team_name), ("Snapshot User", "Snapshot Team"))
+    
+    def test_renames_propagate(self):
+        """Test that renaming a user or team rewrites the stored snapshots in a background job"""
+        self.client.patch(f'/api/users/{self.user._id}/', {'name': "Renamed User"}, format='json')
+        self.client.patch(f'/api/teams/{self.team._id}/', {'name': "Renamed Team"}, format='json')
+        response = self.client.get('/api/leaderboard/')
+        self.assertEqual(response.data['results'][0]['user_name'], "Snapshot User")
+        
+        self.assertEqual(jobs.run_pending(), 2)
+        response = self.client.get('/api/leaderboard/')
+        entry = response.data['results'][0]
+        self.assertEqual((entry['user_name'], entry['team_name']), ("Renamed User", "Renamed Team"))
+        activity = Activity.objects.get()
+        self.assertEqual((activity.user_name, activity.team_name), ("Renamed User", "Renamed Team"))
+
+
+class ActivityExportTest(APITestCase):
+    def setUp(self):
+        self.team = Team.objects.create(name="Export Team")
+        self.member = User.objects.create(name="Member", email="member@example.com", password="password123",
+                                          team_id=str(self.team._id))
+        self.other = User.objects.create(name="Other", email="other@example.com", password="password123")
+        for user, day in ((self.member, 5), (self.member, 20), (self.other, 6)):
+            self.client.post('/api/activities/', {
+                'user_id': str(user._id),
+                'activity_type': 'Running',
+                'duration': 30,
+                'calories_burned': 300,
+                'date': f'2024-03-{day:02d}'
+            }, format='json')
+    
+    def export(self, query):
+        response = self.client.get(f'/api/activities/export/?{query}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+    
+    def test_ndjson_export_filters_by_team_and_dates(self):
+        """Test that the NDJSON export streams the team's activities within the date range"""
+        content = self.export(f'team_id={self.team._id}&start=2024-03-01&end=2024-03-10')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([(row['user_name'], row['date']) for row in rows], [("Member", '2024-03-05')])
+    
+    def test_csv_export(self):
+        """Test that the CSV export has a header and one line per activity in date order"""
+        lines = self.export('output=csv').splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['_id', 'user_id', 'user_name'])
+        self.assertEqual([line.split(',')[2] for line in lines[1:]], ["Member", "Other", "Member"])
+    
+    def test_unknown_output_is_rejected(self):
+        """Test that an unknown output is rejected"""
+        response = self.client.get('/api/activities/export/?output=xml')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ActivityArchiveTest(APITestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.archive_settings = override_settings(OCTOFIT_ARCHIVE_DIR=directory.name)
+        self.archive_settings.enable()
+        self.addCleanup(self.archive_settings.disable)
+        self.user = User.objects.create(name="Veteran", email="veteran@example.com", password="password123")
+        for day, distance in (('2020-01-20', 12), ('2020-01-10', 5), ('2020-02-03', 3), (str(date.today()), 4)):
+            self.post(day, distance)
+    
+    def post(self, day, distance):
+        self.client.post('/api/activities/', {
+            'user_id': str(self.user._id), 'activity_type': 'Running', 'duration': 30,
+            'distance': distance, 'calories_burned': 300, 'date': day
+        }, format='json')
+    
+    def archive(self):
+        call_command('archive_activities', stdout=io.StringIO())
+    
+    def export_dates(self):
+        response = self.client.get('/api/activities/export/')
+        return [json.loads(line)['date'] for line in b''.join(response.streaming_content).decode().splitlines()]
+    
+    def test_archive_moves_old_months_and_keeps_totals(self):
+        """Test that old months move to files without changing the leaderboard, and that exports still read them"""
+        self.archive()
+        self.assertEqual(archive.archived_months(), ['2020-01', '2020-02'])
+        self.assertEqual(Activity.objects.count(), 1)
+        self.assertEqual(Leaderboard.objects.get(user_id=str(self.user._id)).total_calories, 1200)
+        self.assertEqual(self.export_dates(), ['2020-01-10', '2020-01-20', '2020-02-03', str(date.today())])
+        
+        rollups.rebuild()
+        leaderboard.rebuild()
+        records.rebuild()
+        self.assertEqual(Leaderboard.objects.get(user_id=str(self.user._id)).total_calories, 1200)
+        stats = self.client.get(f'/api/users/{self.user._id}/stats/').data
+        self.assertEqual(stats['personal_bests']['Running']['distance']['value'], 12)
+    
+    def test_partition_key_routes_date_ranges(self):
+        """Test that the partition key is set from string dates and selects the months of a date range"""
+        activity = Activity.objects.create(user_id=str(self.user._id), activity_type='Yoga', duration=20,
+                                           calories_burned=60, date='2020-03-04')
+        self.assertEqual(Activity.objects.get(_id=activity._id).month, '2020-03')
+        self.archive()
+        response = self.client.get('/api/activities/export/?start=2020-01-15&end=2020-03-31')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['date'] for row in rows], ['2020-01-20', '2020-02-03', '2020-03-04'])
+    
+    def test_date_ranges_find_activities_without_partition_key(self):
+        """Test that date ranges still find activities stored before the partition key existed"""
+        self.archive()
+        Activity.objects.mongo_insert_one({
+            'user_id': str(self.user._id), 'activity_type': 'Yoga', 'duration': 20,
+            'calories_burned': 60, 'date': datetime(2020, 3, 5),
+        })
+        self.assertTrue(archive.partition_keys_missing())
+        response = self.client.get('/api/activities/export/?start=2020-01-15&end=2020-03-31')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['date'] for row in rows], ['2020-01-20', '2020-02-03', '2020-03-05'])
+        
+        self.assertEqual(archive.backfill_partition_keys(), 1)
+        self.assertFalse(archive.partition_keys_missing())
+    
+    def test_backdated_activities_are_merged_into_their_archive(self):
+        """Test that activities added to an archived month are merged into its file in date order"""
+        self.archive()
+        self.post('2020-01-15', 1)
+        self.assertEqual(Activity.objects.get(date=date(2020, 1, 15)).month, '2020-01')
+        self.archive()
+        self.assertEqual([document['date'].day for document in archive.read_month('2020-01')], [10, 15, 20])
+        self.assertEqual(Activity.objects.count(), 1)
+        self.assertEqual(Leaderboard.objects.get(user_id=str(self.user._id)).total_calories, 1500)
+
+
+class UserStatsTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(name="Streaker", email="streaker@example.com", password="password123")
+        self.today = date.today()
+    
+    def log(self, days_ago, activity_type='Running', distance=5.0, calories=300):
+        response = self.client.post('/api/activities/', {
+            'user_id': str(self.user._id),
+            'activity_type': activity_type,
+            'duration': 30,
+            'distance': distance,
+            'calories_burned': calories,
+            'date': str(self.today - timedelta(days=days_ago))
+        }, format='json')
+        return response.data['_id']
+    
+    def stats(self):
+        return self.client.get(f'/api/users/{self.user._id}/stats/').data
+    
+    def test_streaks_and_bests_in_order(self):
+        """Test that activities logged in date order extend the streak and personal bests"""
+        for days_ago in (5, 2, 1, 0):
+            self.log(days_ago, distance=10 - days_ago)
+        self.log(0, activity_type='Cycling', distance=20, calories=500)
+        stats = self.stats()
+        self.assertEqual((stats['current_streak'], stats['longest_streak']), (3, 3))
+        self.assertEqual(stats['personal_bests']['Running']['distance']['value'], 10)
+        self.assertEqual(stats['personal_bests']['Cycling']['calories_burned']['value'], 500)
+        self.assertEqual(sum(week['count'] for week in stats['weekly_totals']), 5)
+        self.assertEqual(UserStats.objects.count(), 1)
+    
+    def test_out_of_order_writes_and_deletes_recompute(self):
+        """Test that back-filled and deleted activities recompute the stats"""
+        self.log(0)
+        self.log(1)
+        self.log(3)
+        self.assertEqual(self.stats()['longest_streak'], 2)
+        self.log(2)
+        self.assertEqual(self.stats()['longest_streak'], 4)
+        
+        best = self.log(10, distance=42)
+        self.assertEqual(self.stats()['personal_bests']['Running']['distance']['activity_id'], best)
+        self.client.delete(f'/api/activities/{best}/')
+        self.assertEqual(self.stats()['personal_bests']['Running']['distance']['value'], 5)
+    
+    def test_concurrent_writes_are_not_lost(self):
+        """Test that a write computed from a document another writer has since changed is redone, not applied"""
+        self.log(2)
+        store = records._store
+        raced = []
+        
+        def racing_store(*args):
+            if not raced:
+                raced.append(True)
+                self.log(1)  # another process updates the same user first
+            return store(*args)
+        
+        with mock.patch.object(records, '_store', racing_store):
+            self.log(0)
+        stats = self.stats()
+        self.assertEqual((stats['current_streak'], stats['longest_streak']), (3, 3))
+        self.assertEqual(sum(week['count'] for week in stats['weekly_totals']), 3)
+    
+    def test_user_without_activities(self):
+        """Test that users without activities get empty stats and unknown users a 404"""
+        stats = self.stats()
+        self.assertEqual((stats['current_streak'], stats['personal_bests'], stats['weekly_totals']), (0, {}, []))
+        response = self.client.get('/api/users/0123456789ab0123456789ab/stats/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class RecommendationTest(APITestCase):
+    def setUp(self):
+        api_cache().clear()
+        for name, activity_type, difficulty, duration, calories in (
+            ("Easy Spin", 'Cycling', 'Easy', 30, 200),
+            ("Hard Intervals", 'Running', 'Hard', 40, 480),
+            ("Long Run", 'Running', 'Medium', 90, 800),
+        ):
+            self.client.post('/api/workouts/', {
+                'name': name, 'description': name, 'difficulty': difficulty, 'duration': duration,
+                'calories_estimate': calories, 'activity_type': activity_type,
+            }, format='json')
+        self.runner = User.objects.create(name="Runner", email="runner@example.com", password="password123")
+        self.newcomer = User.objects.create(name="Newcomer", email="newcomer@example.com", password="password123")
+        for days_ago in range(3):
+            self.client.post('/api/activities/', {
+                'user_id': str(self.runner._id), 'activity_type': 'Running', 'duration': 40,
+                'calories_burned': 440, 'date': str(date.today() - timedelta(days=days_ago))
+            }, format='json')
+    
+    def names(self, user):
+        response = self.client.get(f'/api/users/{user._id}/recommendations/?limit=2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [workout['name'] for workout in response.data['results']]
+    
+    def test_recommendations_match_recent_activity(self):
+        """Test that workouts are ranked by how well they match the user's recent activity"""
+        self.assertEqual(self.names(self.runner), ["Hard Intervals", "Long Run"])
+        self.assertEqual(self.names(self.newcomer)[0], "Easy Spin")
+    
+    def test_catalog_follows_workout_writes_and_batches(self):
+        """Test that new workouts are scored and that many users are scored in one call"""
+        self.names(self.runner)
+        self.client.post('/api/workouts/', {
+            'name': "Tempo Run", 'description': "Steady", 'difficulty': 'Hard', 'duration': 40,
+            'calories_estimate': 440, 'activity_type': 'Running',
+        }, format='json')
+        self.assertEqual(self.names(self.runner)[0], "Tempo Run")
+        
+        ranked = recommendations.recommend([str(self.runner._id), str(self.newcomer._id)], limit=3)
+        self.assertEqual([len(workouts) for workouts in ranked.values()], [3, 3])
+    
+    def test_catalog_follows_writes_from_other_processes(self):
+        """Test that the catalog reloads when workouts change without bumping this process's cache generation"""
+        self.names(self.runner)
+        Workout.objects.mongo_insert_one({
+            'name': "Tempo Run", 'description': "Steady", 'difficulty': 'Hard', 'duration': 40,
+            'calories_estimate': 440, 'activity_type': 'Running',
+        })
+        self.assertEqual(self.names(self.runner)[0], "Tempo Run")
+        
+        Workout.objects.mongo_update_one({'name': "Tempo Run"}, {'$set': {'difficulty': 'Easy'}})
+        self.assertEqual(self.names(self.runner)[0], "Tempo Run")
+        with override_settings(OCTOFIT_RECOMMENDATION_CATALOG_TTL=0):
+            self.assertEqual(self.names(self.runner)[0], "Hard Intervals")
+
+
+class EstimationTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(name="Heavy", email="heavy@example.com", password="password123", weight=100)
+    
+    def test_create_fills_missing_calories_and_distance(self):
+        """Test that activities posted without calories or distance get estimates from the user's weight"""
+        response = self.client.post('/api/activities/', {
+            'user_id': str(self.user._id), 'activity_type': 'Running', 'duration': 30, 'date': str(date.today())
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['calories_burned'], 490)
+        self.assertEqual(response.data['distance'], 4.0)
+        self.assertEqual(Leaderboard.objects.get(user_id=str(self.user._id)).total_calories, 490)
+        
+        response = self.client.post('/api/activities/', {
+            'user_id': 'unknown', 'activity_type': 'Yoga', 'duration': 60, 'calories_burned': 100,
+            'date': str(date.today())
+        }, format='json')
+        self.assertEqual((response.data['calories_burned'], response.data['distance']), (100, 0.0))
+    
+    def test_bulk_import_and_batch_estimates(self):
+        """Test that bulk imports are estimated and that the batch engine matches the single estimates"""
+        response = self.client.post('/api/activities/bulk/', [
+            {'user_id': 'bulk_user', 'activity_type': 'Cycling', 'duration': 45, 'date': str(date.today())},
+        ], format='json')
+        self.assertEqual(response.data['created'], 1)
+        activity = Activity.objects.get(user_id='bulk_user')
+        self.assertEqual((activity.calories_burned, activity.distance), (394, 11.25))
+        
+        rows = [('Running', 37, 82.5), ('Swimming', 13, None), ('Unknown', 61, 55.0), ('Walking', 1, 70.0)]
+        calories, distances = estimation.estimate_batch(*zip(*rows))
+        self.assertEqual(calories.tolist(), [
+            estimation.estimate_calories(activity_type, duration, weight) for activity_type, duration, weight in rows
+        ])
+        self.assertEqual(distances.tolist(), [
+            estimation.estimate_distance(activity_type, duration) for activity_type, duration, _ in rows
+        ])
+    
+    def test_reestimate_updates_only_changed_activities(self):
+        """Test that a full re-estimation rewrites stale values and skips up-to-date ones"""
+        for calories in (490, 100):
+            self.client.post('/api/activities/', {
+                'user_id': str(self.user._id), 'activity_type': 'Running', 'duration': 30,
+                'calories_burned': calories, 'date': str(date.today())
+            }, format='json')
+        self.assertEqual(estimation.reestimate(), (0, 0))
+        self.assertEqual(estimation.reestimate(recompute_all=True, batch_size=1), (2, 1))
+        self.assertEqual(sorted(Activity.objects.values_list('calories_burned', flat=True)), [490, 490])
+
+
+class LeaderboardTopKTest(APITestCase):
+    def setUp(self):
+        api_cache().clear()
+        self.teams = [Team.objects.create(name=f"Top Team {i}") for i in range(2)]
+        self.users = []
+        for i in range(6):
+            user = User.objects.create(
+                name=f"Ranked {i}",
+                email=f"ranked{i}@example.com",
+                password="password123",
+                team_id=str(self.teams[i % 2]._id)
+            )
+            self.users.append(user)
+            self.client.post('/api/activities/', {
+                'user_id': str(user._id),
+                'activity_type': 'Running' if i % 3 else 'Cycling',
+                'duration': 30,
+                'calories_burned': 100 * (i + 1),
+                'date': '2024-03-05'
+            }, format='json')
+    
+    def test_top_overall_and_per_team(self):
+        """Test that top-K returns the best ranks overall and within a team"""
+        response = self.client.get('/api/leaderboard/top/?k=3')
+        self.assertEqual([row['user_name'] for row in response.data['results']], ["Ranked 5", "Ranked 4", "Ranked 3"])
+        response = self.client.get(f'/api/leaderboard/top/?k=2&team_id={self.teams[0]._id}')
+        self.assertEqual(
+            [(row['user_name'], row['rank']) for row in response.data['results']],
+            [("Ranked 4", 1), ("Ranked 2", 2)]
+        )
+    
+    def test_top_per_activity_type(self):
+        """Test that top-K per activity type ranks users by that type only"""
+        response = self.client.get('/api/leaderboard/top/?activity_type=Cycling')
+        self.assertEqual(
+            [(row['user_name'], row['rank']) for row in response.data['results']],
+            [("Ranked 3", 1), ("Ranked 0", 2)]
+        )
+        response = self.client.get(f'/api/leaderboard/top/?activity_type=Running&team_id={self.teams[1]._id}')
+        self.assertEqual(
+            [(row['user_name'], row['rank']) for row in response.data['results']],
+            [("Ranked 5", 1), ("Ranked 1", 2)]
+        )
+    
+    def test_activity_type_rankings_follow_writes(self):
+        """Test that activity writes keep the activity type rankings equal to a rebuild"""
+        activity = Activity.objects.get(user_id=str(self.users[3]._id))
+        self.client.patch(f'/api/activities/{activity._id}/', {'activity_type': 'Running'}, format='json')
+        response = self.client.get('/api/leaderboard/top/?activity_type=Running')
+        self.assertEqual(
+            [(row['user_name'], row['rank'], row['total_activities']) for row in response.data['results']],
+            [("Ranked 5", 1, 1), ("Ranked 4", 2, 1), ("Ranked 3", 3, 1), ("Ranked 2", 4, 1), ("Ranked 1", 5, 1)]
+        )
+        
+        def entries():
+            return sorted(
+                (entry.activity_type, entry.user_id, entry.total_calories, entry.total_activities, entry.rank)
+                for entry in ActivityTypeLeaderboard.objects.all()
+            )
+        
+        incremental = entries()
+        self.assertEqual(len(incremental), 6)
+        leaderboard.rebuild()
+        self.assertEqual(entries(), incremental)
+    
+    def test_around_user(self):
+        """Test that the window around a user is centred on their entry"""
+        response = self.client.get(f'/api/leaderboard/around/?user_id={self.users[2]._id}&radius=1')
+        self.assertEqual([row['rank'] for row in response.data['results']], [3, 4, 5])
+        response = self.client.get('/api/leaderboard/around/?user_id=missing')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class PeriodLeaderboardTest(APITestCase):
+    def setUp(self):
+        api_cache().clear()
+        self.users = [
+            User.objects.create(name=f"Weekly {i}", email=f"weekly{i}@example.com", password="password123")
+            for i in range(2)
+        ]
+    
+    def _post(self, user, calories, day):
+        return self.client.post('/api/activities/', {
+            'user_id': str(user._id),
+            'activity_type': 'Running',
+            'duration': 30,
+            'calories_burned': calories,
+            'date': day.isoformat()
+        }, format='json')
+    
+    def test_windows_rank_independently(self):
+        """Test that each week is ranked from its own activities only"""
+        monday = date.today() - timedelta(days=date.today().weekday())
+        self._post(self.users[0], 500, monday)
+        self._post(self.users[1], 300, monday)
+        self._post(self.users[1], 400, monday - timedelta(days=7))
+        
+        response = self.client.get(f'/api/leaderboard/period/?period=week&date={monday}')
+        self.assertEqual(
+            [(row['user_name'], row['rank']) for row in response.data['results']],
+            [("Weekly 0", 1), ("Weekly 1", 2)]
+        )
+        response = self.client.get(f'/api/leaderboard/period/?period=week&date={monday - timedelta(days=7)}')
+        self.assertEqual([row['total_calories'] for row in response.data['results']], [400])
+    
+    def test_rebuild_matches_incremental(self):
+        """Test that rebuilding the windows from rollups gives the incremental result"""
+        self._post(self.users[0], 200, date.today())
+        self._post(self.users[1], 300, date.today() - timedelta(days=1))
+        fields = ('period', 'period_start', 'user_id', 'total_calories', 'rank')
+        incremental = sorted(PeriodLeaderboard.objects.values_list(*fields))
+        periods.rebuild()
+        self.assertEqual(sorted(PeriodLeaderboard.objects.values_list(*fields)), incremental)
+    
+    def test_expired_windows_are_not_written(self):
+        """Test that activities older than the retention do not recreate expired windows"""
+        self._post(self.users[0], 200, date.today() - timedelta(days=800))
+        self.assertFalse(PeriodLeaderboard.objects.filter(period='month').exists())
+
+
+@override_settings(OCTOFIT_JOBS_IN_PROCESS=False)
+class JobAPITest(APITestCase):
+    def test_rebuild_job_is_deduplicated_and_runs(self):
+        """Test that a pending rebuild is reused and that running it records the result"""
+        first = self.client.post('/api/jobs/', {'kind': 'leaderboard.rebuild'}, format='json')
+        second = self.client.post('/api/jobs/', {'kind': 'leaderboard.rebuild'}, format='json')
+        self.assertEqual(first.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(first.data['_id'], second.data['_id'])
+        
+        self.assertEqual(jobs.run_pending(), 1)
+        response = self.client.get(f"/api/jobs/{first.data['_id']}/")
+        self.assertEqual(response.data['status'], 'succeeded')
+        self.assertEqual(response.data['result'], {'entries': 0, 'period_entries': 0})
+    
+    def test_concurrent_enqueue_returns_pending_job(self):
+        """Test that the unique dedup index turns an enqueue that lost a race into the pending job"""
+        call_command('mongo_indexes', 'create', stdout=io.StringIO())
+        self.addCleanup(call_command, 'mongo_indexes', 'drop', stdout=io.StringIO())
+        first = jobs.enqueue('leaderboard.rebuild')
+        lookup = Job.objects.filter
+        missed = []
+        
+        def stale_lookup(**lookups):
+            # The first lookup runs before the other process inserted its job
+            if not missed:
+                missed.append(lookups)
+                return Job.objects.none()
+            return lookup(**lookups)
+        
+        with mock.patch.object(Job.objects, 'filter', stale_lookup):
+            second = jobs.enqueue('leaderboard.rebuild')
+        self.assertTrue(missed)
+        self.assertEqual(second._id, first._id)
+        self.assertEqual(Job.objects.count(), 1)
+        
+        jobs.run_pending()
+        self.assertNotEqual(jobs.enqueue('leaderboard.rebuild')._id, first._id)
+    
+    def test_fields_narrow_job_output(self):
+        """Test that ?fields= narrows job lists and details"""
+        job = jobs.enqueue('leaderboard.rebuild')
+        response = self.client.get('/api/jobs/', {'fields': '_id,status'})
+        self.assertEqual(response.data['results'], [{'_id': str(job._id), 'status': 'queued'}])
+        response = self.client.get(f'/api/jobs/{job._id}/', {'fields': 'kind'})
+        self.assertEqual(response.data, {'kind': 'leaderboard.rebuild'})
+    
+    def test_unknown_kind(self):
+        """Test that only registered job kinds can be queued"""
+        response = self.client.post('/api/jobs/', {'kind': 'nope'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_background_bulk_import(self):
+        """Test that a background bulk import creates the activities once the job runs"""
+        user = User.objects.create(name="Queued User", email="queued@example.com", password="password123")
+        rows = [{'user_id': str(user._id), 'activity_type': 'Running', 'duration': 30,
+                 'calories_burned': 300, 'date': '2024-03-05'}, {'duration': 'x'}]
+        response = self.client.post('/api/activities/bulk/?background=true', rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(Activity.objects.count(), 0)
+        
+        jobs.run_pending()
+        job = Job.objects.get()
+        self.assertEqual(job.status, 'succeeded')
+        self.assertEqual(job.result['created'], 1)
+        self.assertEqual(job.result['errors'][0]['index'], 1)
+        self.assertEqual(Activity.objects.count(), 1)
+
+
+@override_settings(OCTOFIT_PROFILING_SAMPLE_RATE=1.0)
+class ProfilingTest(APITestCase):
+    def setUp(self):
+        api_cache().clear()
+        profiling.reset()
+    
+    def test_server_timing_and_metrics(self):
+        """Test that sampled requests report their queries and are aggregated per route"""
+        response = self.client.get('/api/activities/')
+        self.assertIn('db;dur=', response['Server-Timing'])
+        routes = self.client.get('/api/_metrics').data['routes']
+        self.assertEqual(routes['GET activity-list']['count'], 1)
+        self.assertGreater(routes['GET activity-list']['queries']['p50'], 0)
+    
+    def test_serialization_time(self):
+        """Test that building the response data is timed, including cached endpoints rendered on a miss"""
+        user = User.objects.create(name="Timed", email="timed@example.com", password="password123")
+        self.client.post('/api/activities/', {
+            'user_id': str(user._id), 'activity_type': 'Running', 'duration': 30, 'date': str(date.today())
+        }, format='json')
+        response = self.client.get('/api/leaderboard/')
+        self.assertIn('serialize;dur=', response['Server-Timing'])
+        routes = self.client.get('/api/_metrics').data['routes']
+        self.assertGreater(routes['GET leaderboard-list']['serialize_ms']['p50'], 0)
+    
+    @override_settings(OCTOFIT_PROFILING_SAMPLE_RATE=0.0)
+    def test_unsampled_requests_are_not_profiled(self):
+        """Test that requests outside the sample get no header and no metrics"""
+        response = self.client.get('/api/activities/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(profiling.metrics(), {})
+
+
+class MongoIndexesTest(TestCase):
+    def setUp(self):
+        self.command = mongo_indexes.Command(stdout=io.StringIO())
+        self.addCleanup(call_command, 'mongo_indexes', 'drop', stdout=io.StringIO())
+    
+    def test_create_builds_every_declared_index(self):
+        """Test that create builds the Meta.indexes and unique constraints with their Mongo options"""
+        call_command('mongo_indexes', 'create', stdout=io.StringIO())
+        declared = list(self.command.declared_indexes())
+        self.assertIn('jobs_dedup_pending_uniq', {index.name for _, index in declared})
+        for model, index in declared:
+            existing = model.objects.mongo_index_information().get(index.name)
+            self.assertIsNotNone(existing, index.name)
+            self.assertEqual(mongo_indexes.index_differences(
+                existing, mongo_indexes.index_keys(model, index), mongo_indexes.index_options(index)
+            ), [], index.name)
+        self.assertTrue(Leaderboard.objects.mongo_index_information()['leaderboard_user_uniq']['unique'])
+        expiry = PeriodLeaderboard.objects.mongo_index_information()['period_lb_expiry_idx']
+        self.assertEqual(expiry['expireAfterSeconds'], 0)
+        
+        output = io.StringIO()
+        call_command('mongo_indexes', 'verify', stdout=output)
+        self.assertNotIn('Missing', output.getvalue())
+        self.assertNotIn('Mismatched', output.getvalue())
+        
+        call_command('mongo_indexes', 'drop', stdout=io.StringIO())
+        self.assertNotIn('leaderboard_user_uniq', Leaderboard.objects.mongo_index_information())
+
+
+class PopulateDbTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        archive_settings = override_settings(OCTOFIT_ARCHIVE_DIR=directory.name)
+        archive_settings.enable()
+        self.addCleanup(archive_settings.disable)
+    
+    def test_synthetic_population(self):
+        """Test that the synthetic mode fills every collection and ranks users like a leaderboard rebuild"""
+        call_command('populate_db', users=6, teams=2, activities_per_user=5, seed=1, batch_size=4,
+                     stdout=io.StringIO())
+        self.assertEqual((Team.objects.count(), User.objects.count(), Activity.objects.count()), (2, 6, 30))
+        self.assertEqual(sum(DailyActivityRollup.objects.values_list('count', flat=True)), 30)
+        self.assertEqual(sum(ActivityTypeLeaderboard.objects.values_list('total_activities', flat=True)), 30)
+        
+        fields = ('user_id', 'total_calories', 'total_duration', 'rank')
+        inserted = sorted(Leaderboard.objects.values_list(*fields))
+        self.assertEqual(sorted(rank for *_, rank in inserted), [1, 2, 3, 4, 5, 6])
+        leaderboard.rebuild()
+        self.assertEqual(sorted(Leaderboard.objects.values_list(*fields)), inserted)
+
+
+@skipUnless(importlib.util.find_spec('mongomock'), 'mongomock is not installed')
+class BenchmarkMongomockTest(APITestCase):
+    def test_native_and_djongo_reads_share_the_database(self):
+        """Test that --mongomock points the pymongo read path at the database djongo writes to"""
+        with mock.patch.object(database, 'MongoClient'), mock.patch.dict(database.clients), \
+                mock.patch.object(repositories, 'MongoClient'), mock.patch.object(repositories, '_client'):
+            try:
+                benchmark.use_mongomock()
+                user = User.objects.create(name="Mock User", email="mock@example.com", password="password123")
+                for day in range(1, 4):
+                    Activity.objects.create(user_id=str(user._id), activity_type="Running", duration=30,
+                                            calories_burned=300, date=date(2024, 3, day))
+                counts = {}
+                for native in (False, True):
+                    with override_settings(OCTOFIT_NATIVE_READS=native):
+                        response = self.client.get('/api/activities/')
+                    counts[native] = len(json.loads(response.content)['results'])
+                self.assertEqual(counts, {False: 3, True: 3})
+            finally:
+                connections.close_all()
+
+
+class FastSerializationTest(TestCase):
+    def test_fast_lists_match_drf(self):
+        """Test that the compiled list serializers return exactly what DRF's would"""
+        user = User.objects.create(name="Fast User", email="fast@example.com", password="password123")
+        Activity.objects.create(user_id=str(user._id), user_name="Fast User", activity_type="Running",
+                                duration=30, distance=5.5, calories_burned=300, date=date(2024, 3, 5))
+        Activity.objects.create(user_id=str(user._id), activity_type="Yoga", duration=45,
+                                calories_burned=150, date=date(2024, 3, 6), notes="No snapshot")
+        # The saves created the leaderboard entry; drop its snapshot so the names are looked up
+        Leaderboard.objects.mongo_update_many({}, {'$set': {'user_name': None}})
+        Workout.objects.create(name="Intervals", description="Short sprints", difficulty="Hard",
+                               duration=20, calories_estimate=250, activity_type="Running")
+        for serializer_class in (ActivitySerializer, LeaderboardSerializer, WorkoutSerializer):
+            instances = list(serializer_class.Meta.model.objects.all())
+            expected = ListSerializer(instances, child=serializer_class()).data
+            self.assertEqual(serializer_class(instances, many=True).data, expected)
+    
+    def test_fast_renderer_matches_drf(self):
+        """Test that the orjson renderer produces the same bytes as DRF's renderer"""
+        data = {'results': [{'name': "Zoë \u2028 line", 'count': 3, 'ratio': 0.25, 'missing': None}], 'next': None}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+
+class AsyncAPITest(TestCase):
+    def setUp(self):
+        api_cache().clear()
+    
+    def create_activities(self):
+        team = Team.objects.create(name="Async Team")
+        for i, calories in enumerate((300, 200, 200)):
+            user = User.objects.create(name=f"Async User {i}", email=f"async{i}@example.com",
+                                       password="password123", team_id=str(team._id))
+            Activity.objects.create(user_id=str(user._id), activity_type='Running', duration=30,
+                                    calories_burned=calories, date=date(2024, 3, 5 + i))
+    
+    def read_pages(self, url, **params):
+        """Follow the next links of a paginated endpoint and return every result"""
+        results = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            page = json.loads(response.content)
+            results.extend(page['results'])
+            if not page['next']:
+                return results
+            response = self.client.get(page['next'])
+    
+    @skipUnless(async_views.AsyncIOMotorClient, 'motor is not installed')
+    def test_async_lists_match_sync_lists(self):
+        """Test that the async activity and leaderboard pages return the rows of the sync endpoints in order"""
+        self.create_activities()
+        for sync_url, async_url in (('/api/activities/', '/api/async/activities/'),
+                                    ('/api/leaderboard/', '/api/async/leaderboard/')):
+            expected = self.read_pages(sync_url)
+            self.assertEqual(len(expected), 3)
+            self.assertEqual(self.read_pages(async_url), expected)
+            self.assertEqual(self.read_pages(async_url, page_size=1), expected)
+    
+    @skipUnless(async_views.AsyncIOMotorClient, 'motor is not installed')
+    def test_async_stats_match_sync_stats(self):
+        """Test that the async stats endpoint returns the series of the sync one"""
+        self.create_activities()
+        for params in ({}, {'group_by': 'team', 'bucket': 'day'}, {'group_by': 'activity_type', 'start': '2024-03-06'}):
+            expected = self.client.get('/api/activities/stats/', params)
+            response = self.client.get('/api/async/activities/stats/', params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(json.loads(response.content), json.loads(expected.content))
+    
+    def test_async_stats_rejects_invalid_bucket(self):
+        """Test that the async stats endpoint validates its query like the sync one"""
+        response = self.client.get('/api/async/activities/stats/', {'bucket': 'decade'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_async_leaderboard_rejects_invalid_cursor(self):
+        """Test that a malformed keyset position is rejected"""
+        response = self.client.get('/api/async/leaderboard/', {'after': 'nope'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
 class WorkoutAPITest(APITestCase):
     def test_create_workout(self):
         """Test creating a workout via API"""
@@ -196,3 +1289,4 @@ class APIRootTest(APITestCase):
         self.assertIn('activities', response.data)
         self.assertIn('leaderboard', response.data)
         self.assertIn('workouts', response.data)
+        self.assertIn('jobs', response.data)
@@ -0,0 +1,37 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from .models import Activity
+from . import caching, leaderboard, periods, records, rollups
+
+
+# Every collection derived from activities (leaderboards, daily rollups,
+# period rankings and user stats) follows activity writes through the model
+# signals below, so the API, the admin, populate_db and plain ORM code all keep
+# them current. Writes that skip the signals call activities_changed()
+# themselves (bulk_create in imports.py) or must leave the derived data alone
+# (archive.py, resets that clear the derived collections too).
+
+def activities_changed(added=(), removed=()):
+    """Propagate activity writes to every collection derived from activities"""
+    leaderboard.apply_activity_changes(added=added, removed=removed)
+    rollups.apply_activity_changes(added=added, removed=removed)
+    periods.apply_activity_changes(added=added, removed=removed)
+    records.apply_activity_changes(added=added, removed=removed)
+    caching.invalidate('leaderboard')
+
+
+@receiver(pre_save, sender=Activity, dispatch_uid='octofit_tracking_pre_save')
+def _load_previous(sender, instance, **kwargs):
+    """Keep the stored version of an updated activity, whose values have to be taken back out"""
+    instance._previous = None if instance._state.adding else Activity.objects.filter(_id=instance._id).first()
+
+
+@receiver(post_save, sender=Activity, dispatch_uid='octofit_tracking_post_save')
+def _saved(sender, instance, **kwargs):
+    previous = instance.__dict__.pop('_previous', None)
+    activities_changed(added=[instance], removed=[previous] if previous is not None else [])
+
+
+@receiver(post_delete, sender=Activity, dispatch_uid='octofit_tracking_post_delete')
+def _deleted(sender, instance, **kwargs):
+    activities_changed(removed=[instance])
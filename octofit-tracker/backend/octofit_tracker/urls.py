@@ -16,7 +16,8 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework import routers
-from .views import UserViewSet, TeamViewSet, ActivityViewSet, LeaderboardViewSet, WorkoutViewSet, api_root
+from .views import UserViewSet, TeamViewSet, ActivityViewSet, LeaderboardViewSet, WorkoutViewSet, JobViewSet, api_root, metrics
+from . import async_views
 import os
 
 codespace_name = os.environ.get('CODESPACE_NAME')
@@ -31,10 +32,15 @@ router.register(r'teams', TeamViewSet)
 router.register(r'activities', ActivityViewSet)
 router.register(r'leaderboard', LeaderboardViewSet)
 router.register(r'workouts', WorkoutViewSet)
+router.register(r'jobs', JobViewSet)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', api_root, name='api-root'),
     path('api/', api_root, name='api-root'),
+    path('api/_metrics', metrics, name='api-metrics'),
+    path('api/async/activities/', async_views.activities, name='async-activities'),
+    path('api/async/activities/stats/', async_views.activity_stats, name='async-activity-stats'),
+    path('api/async/leaderboard/', async_views.leaderboard, name='async-leaderboard'),
     path('api/', include(router.urls)),
 ]
@@ -0,0 +1,23 @@
+from itertools import islice
+
+
+def batches(iterable, size):
+    """Yield lists of up to size items from an iterable"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def percentile(samples, fraction):
+    """Return the given percentile (0-1) of a list of samples"""
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def partition_key(day):
+    """Get the monthly partition of a date or datetime (2024-03), see octofit_tracker.archive"""
+    return f'{day.year:04d}-{day.month:02d}'
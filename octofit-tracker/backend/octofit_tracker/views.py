@@ -1,9 +1,25 @@
-from rest_framework import viewsets
-from rest_framework.decorators import api_view
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+from django.http import Http404, StreamingHttpResponse
+from datetime import date
+from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import NotFound, ParseError, ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
-from .models import User, Team, Activity, Leaderboard, Workout
-from .serializers import UserSerializer, TeamSerializer, ActivitySerializer, LeaderboardSerializer, WorkoutSerializer
+from .models import User, Team, Activity, Leaderboard, PeriodLeaderboard, UserStats, Workout, Job
+from .serializers import UserSerializer, TeamSerializer, ActivitySerializer, LeaderboardSerializer, WorkoutSerializer, ActivityStatsQuerySerializer, ActivityExportQuerySerializer, LeaderboardTopQuerySerializer, LeaderboardAroundQuerySerializer, LeaderboardPeriodQuerySerializer, PeriodLeaderboardSerializer, ActivityTypeLeaderboardSerializer, UserStatsSerializer, RecommendationQuerySerializer, JobSerializer
+from .caching import CacheInvalidationMixin, CachedResponseMixin
+from .fieldsets import SparseFieldsetMixin
+from .pagination import RankCursorPagination
+from .repositories import NativeReadMixin, UserRepository, ActivityRepository, LeaderboardRepository
+from .parsers import NDJSONParser
+from .utils import batches
+from .stats import activity_stats
+from .imports import import_activities
+from . import denormalization, estimation, exports, jobs, leaderboard, periods, profiling, recommendations
 
 
 @api_view(['GET'])
@@ -22,29 +38,237 @@ def api_root(request, format=None):
         'activities': f"{base_url}/api/activities/",
         'leaderboard': f"{base_url}/api/leaderboard/",
         'workouts': f"{base_url}/api/workouts/",
+        'jobs': f"{base_url}/api/jobs/",
     })
 
 
-class UserViewSet(viewsets.ModelViewSet):
+@api_view(['GET', 'DELETE'])
+def metrics(request):
+    """Per-route p50/p95/p99 of latency, DB time, query count, render time and size; DELETE resets them"""
+    if request.method == 'DELETE':
+        profiling.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    return Response({
+        'sample_rate': settings.OCTOFIT_PROFILING_SAMPLE_RATE,
+        'routes': profiling.metrics(),
+    })
+
+
+class ObjectIdLookupMixin:
+    """Looks detail routes up by ObjectId; djongo compares a string _id literally and finds nothing"""
+    def get_object(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            self.kwargs[lookup_url_kwarg] = ObjectId(self.kwargs[lookup_url_kwarg])
+        except (InvalidId, TypeError):
+            raise Http404
+        return super().get_object()
+
+
+class UserViewSet(ObjectIdLookupMixin, CacheInvalidationMixin, NativeReadMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    repository_class = UserRepository
+    invalidates = ('teams', 'leaderboard')
+    
+    def perform_update(self, serializer):
+        previous = (serializer.instance.name, serializer.instance.team_id)
+        super().perform_update(serializer)
+        if (serializer.instance.name, serializer.instance.team_id) != previous:
+            jobs.enqueue('names.propagate_user', {'user_id': str(serializer.instance._id)})
+    
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        """Streaks, personal bests and weekly totals of a user, read from one summary document"""
+        stats = UserStats.objects.filter(user_id=pk).first()
+        if stats is None:
+            # Users without activities have no summary yet; unknown users are a 404
+            self.get_object()
+            stats = UserStats(user_id=pk)
+        return Response(UserStatsSerializer(stats).data)
+    
+    @action(detail=True, methods=['get'])
+    def recommendations(self, request, pk=None):
+        """The workouts that best match the user's recent activity, best first (?limit=, 10 by default)"""
+        query = RecommendationQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        user_id = str(self.get_object()._id)
+        ranked = recommendations.recommend([user_id], query.validated_data['limit'])[user_id]
+        workout_ids = [workout_id for workout_id, _ in ranked]
+        workouts = {workout._id: workout for workout in Workout.objects.filter(_id__in=workout_ids)}
+        return Response({'results': [
+            {**WorkoutSerializer(workouts[workout_id]).data, 'score': round(score, 4)}
+            for workout_id, score in ranked if workout_id in workouts
+        ]})
 
 
-class TeamViewSet(viewsets.ModelViewSet):
+class TeamViewSet(ObjectIdLookupMixin, CachedResponseMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = Team.objects.all()
     serializer_class = TeamSerializer
+    cache_resource = 'teams'
+    invalidates = ('leaderboard',)
+    
+    def perform_update(self, serializer):
+        previous_name = serializer.instance.name
+        super().perform_update(serializer)
+        if serializer.instance.name != previous_name:
+            jobs.enqueue('names.propagate_team', {'team_id': str(serializer.instance._id)})
 
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class ActivityViewSet(ObjectIdLookupMixin, NativeReadMixin, viewsets.ModelViewSet):
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
+    repository_class = ActivityRepository
+    
+    # Saves and deletes update the derived collections through the signals in tracking.py
+    def perform_create(self, serializer):
+        serializer.save(
+            **estimation.missing_estimates([serializer.validated_data])[0],
+            **denormalization.snapshot_for(serializer.validated_data['user_id']),
+        )
+    
+    def perform_update(self, serializer):
+        user_id = serializer.validated_data.get('user_id', serializer.instance.user_id)
+        if user_id != serializer.instance.user_id:
+            serializer.save(**denormalization.snapshot_for(user_id))
+        else:
+            serializer.save()
+    
+    bulk_chunk_size = 500
+    
+    @action(detail=False, methods=['post'], parser_classes=[NDJSONParser, JSONParser])
+    def bulk(self, request):
+        """Create many activities from an NDJSON stream or a JSON array, reporting errors per row"""
+        rows = request.data
+        if isinstance(rows, dict):
+            raise ParseError('Expected a JSON array or an NDJSON body of activities.')
+        
+        if request.query_params.get('background', '').lower() in ('1', 'true', 'yes'):
+            return self.bulk_in_background(rows)
+        
+        created, errors = import_activities(rows, self.bulk_chunk_size, self.get_serializer_context())
+        if not errors:
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({'created': created, 'errors': errors}, status=response_status)
+    
+    bulk_job_size = 5000
+    
+    def bulk_in_background(self, rows):
+        """Queue import jobs of bulk_job_size rows each; undecodable NDJSON lines reject the whole body"""
+        rows = list(rows)
+        errors = [
+            {'index': index, 'errors': {'non_field_errors': [row.detail]}}
+            for index, row in enumerate(rows) if isinstance(row, ParseError)
+        ]
+        if errors:
+            return Response({'created': 0, 'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+        queued = [jobs.enqueue('activities.import', {'rows': chunk}) for chunk in batches(rows, self.bulk_job_size)]
+        return Response({'jobs': JobSerializer(queued, many=True).data}, status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        """Activity totals per user, team or activity type, bucketed by day, week or month"""
+        query = ActivityStatsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return Response({
+            **{key: str(value) for key, value in query.validated_data.items()},
+            'series': activity_stats(**query.validated_data),
+        })
+    
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream activities as NDJSON or CSV (?output=), filtered by user_id, team_id, start and end"""
+        query = ActivityExportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = dict(query.validated_data)
+        output = params.pop('output')
+        response = StreamingHttpResponse(
+            exports.render(output, exports.activity_rows(**params)),
+            content_type=exports.CONTENT_TYPES[output],
+        )
+        response['Content-Disposition'] = f'attachment; filename="activities.{output}"'
+        return response
 
 
-class LeaderboardViewSet(viewsets.ModelViewSet):
+class LeaderboardViewSet(ObjectIdLookupMixin, CachedResponseMixin, NativeReadMixin, viewsets.ModelViewSet):
     queryset = Leaderboard.objects.all()
     serializer_class = LeaderboardSerializer
+    repository_class = LeaderboardRepository
+    pagination_class = RankCursorPagination
+    cache_resource = 'leaderboard'
+    
+    @action(detail=False, methods=['get'])
+    def top(self, request):
+        """The k best-ranked users overall or in one activity type (?activity_type=), optionally within a team (?team_id=)
+
+        Within a team, ranks are counted among the team's members.
+        """
+        return self.cached_response(self._top, request)
+    
+    def _top(self, request):
+        query = LeaderboardTopQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        if params.get('activity_type'):
+            entries = leaderboard.top_by_activity_type(params['activity_type'], params['k'], team_id=params.get('team_id'))
+            serializer = ActivityTypeLeaderboardSerializer(entries, many=True, context=self.get_serializer_context())
+            return Response({'results': serializer.data})
+        entries = leaderboard.top(params['k'], team_id=params.get('team_id'))
+        return Response({'results': self.get_serializer(entries, many=True).data})
+    
+    @action(detail=False, methods=['get'])
+    def around(self, request):
+        """A user's leaderboard entry with up to radius entries ranked above and below it"""
+        return self.cached_response(self._around, request)
+    
+    def _around(self, request):
+        query = LeaderboardAroundQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        entries = leaderboard.around(query.validated_data['user_id'], query.validated_data['radius'])
+        if entries is None:
+            raise NotFound('This user has no leaderboard entry.')
+        return Response({'results': self.get_serializer(entries, many=True).data})
+    
+    @action(detail=False, methods=['get'])
+    def period(self, request):
+        """The leaderboard of the day, week or month containing ?date= (today by default)"""
+        return self.cached_response(self._period, request)
+    
+    def _period(self, request):
+        query = LeaderboardPeriodQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        period = query.validated_data['period']
+        day = query.validated_data.get('date') or date.today()
+        entries = PeriodLeaderboard.objects.filter(period=period, period_start=periods.period_start(period, day))
+        page = self.paginate_queryset(entries)
+        serializer = PeriodLeaderboardSerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
 
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+class WorkoutViewSet(ObjectIdLookupMixin, CachedResponseMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = Workout.objects.all()
     serializer_class = WorkoutSerializer
+    cache_resource = 'workouts'
+
+
+class JobViewSet(ObjectIdLookupMixin, SparseFieldsetMixin, mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
+    """Queue background jobs and poll their status"""
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            job = jobs.enqueue(**serializer.validated_data)
+        except ValueError as exc:
+            raise ValidationError({'kind': [str(exc)]})
+        return Response(
+            self.get_serializer(job).data,
+            status=status.HTTP_202_ACCEPTED,
+            headers={'Location': reverse('job-detail', args=[str(job._id)], request=request)},
+        )